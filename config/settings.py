@@ -10,8 +10,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
-from decouple import config
+from decouple import config, Csv
 from datetime import timedelta
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -59,6 +60,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'shared.db_router.replica_pinning_middleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -109,10 +111,90 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-    ]
+        # builds request.user from the token claims instead of loading the row,
+        # set JWT_CLAIMS_AUTH=False to go back to one query per request
+        'users.authentication.ClaimsJWTAuthentication'
+        if config('JWT_CLAIMS_AUTH', default=True, cast=bool)
+        else 'rest_framework_simplejwt.authentication.JWTAuthentication',
+    ],
+    # proxies in front of the app that append to X-Forwarded-For; with 0 the IP throttles key on
+    # REMOTE_ADDR, otherwise clients could pick their own address
+    'NUM_PROXIES': config('NUM_PROXIES', default=0, cast=int),
+    # writes to views with a throttle_scope (or the view's throttle_methods) are limited per
+    # '<scope>.<ip|user|identifier>' below
+    'DEFAULT_THROTTLE_CLASSES': [
+        'shared.throttling.IPThrottle',
+        'shared.throttling.UserThrottle',
+        'shared.throttling.IdentifierThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'signup.ip': '20/hour',
+        'signup.identifier': '5/hour',
+        'login.ip': '60/min',
+        'login.identifier': '10/min',
+        'login_refresh.ip': '60/min',
+        'verify.user': '10/min',
+        'new_verify.user': '10/hour',
+        'forgot_password.ip': '20/hour',
+        'forgot_password.identifier': '5/hour',
+        'like.user': '120/min',
+        'comment.user': '30/min',
+    },
 }
 
+# counters of the throttles above, must be shared by all workers (e.g. redis) for the limits to hold
+THROTTLE_CACHE = 'default'
+
+# per-process cache of user rows loaded by ClaimsJWTAuthentication
+USER_CACHE_SIZE = 10000
+USER_CACHE_TTL = 60
+
+# refresh tokens are checked against a per-process Bloom filter of blacklisted JTIs and
+# only looked up in the blacklist table on a possible hit; tokens blacklisted by another
+# process are picked up every BLACKLIST_FILTER_SYNC_INTERVAL seconds; each sync re-reads the rows
+# of the last BLACKLIST_FILTER_SYNC_OVERLAP seconds, in case they committed out of id order
+BLACKLIST_FILTER_ERROR_RATE = 0.001
+BLACKLIST_FILTER_SYNC_INTERVAL = 5
+BLACKLIST_FILTER_SYNC_OVERLAP = 60
+
+# login password checks run on this many threads per process, at most PASSWORD_HASH_QUEUE_SIZE
+# more wait for one and a login that finds no room within PASSWORD_HASH_TIMEOUT seconds gets 429
+PASSWORD_HASH_WORKERS = config('PASSWORD_HASH_WORKERS', default=os.cpu_count() or 1, cast=int)
+PASSWORD_HASH_QUEUE_SIZE = config('PASSWORD_HASH_QUEUE_SIZE', default=100, cast=int)
+PASSWORD_HASH_TIMEOUT = 1.0
+
+# 'page' (PageNumberPagination with counts) or 'cursor' (keyset on created_time, id)
+PAGINATION_MODE = config('PAGINATION_MODE', default='page')
+
+# authors with more followers than this are not pushed into timelines, their posts are merged in on read
+FANOUT_MAX_FOLLOWERS = config('FANOUT_MAX_FOLLOWERS', default=10000, cast=int)
+FANOUT_BATCH_SIZE = 1000
+FEED_BACKFILL_POSTS = 20
+
+# a word in a post's description counts this many times more than the same word in a comment
+SEARCH_DESCRIPTION_WEIGHT = 3
+# words of a search query past this many are ignored
+SEARCH_MAX_QUERY_TERMS = 8
+# a search reads at most this many postings of its rarest word, the other words are looked up per post
+SEARCH_MAX_TERM_POSTINGS = 10000
+
+# hashtag uses are counted in buckets of TRENDING_BUCKET_SECONDS, trending tags are the most used
+# over the last TRENDING_WINDOW_BUCKETS buckets; purge_hashtag_counts drops older buckets
+TRENDING_BUCKET_SECONDS = 3600
+TRENDING_WINDOW_BUCKETS = 24
+TRENDING_LIMIT = 20
+TRENDING_CACHE_SECONDS = 60
+
+# explore ranks posts by likes and comments, each worth its weight and halving every EXPLORE_HALF_LIFE;
+# compact_explore_scores drops posts whose score decayed below EXPLORE_MIN_SCORE and keeps the best
+# EXPLORE_MAX_POSTS
+EXPLORE_LIKE_WEIGHT = 1.0
+EXPLORE_COMMENT_WEIGHT = 3.0
+EXPLORE_COMMENT_LIKE_WEIGHT = 0.5
+EXPLORE_HALF_LIFE = timedelta(hours=12)
+EXPLORE_MIN_SCORE = 0.1
+EXPLORE_MAX_POSTS = 10000
+
 ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
@@ -145,9 +227,65 @@ DATABASES = {
         'PASSWORD': config('DB_PASSWORD'),
         'HOST': config('DB_HOST'),
         'PORT': config('DB_PORT'),
+        # connections are kept open between requests and checked before reuse; under config/asgi.py
+        # set DB_CONN_MAX_AGE=0 and use DB_POOL, persistent connections are per thread
+        'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=60, cast=int),
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
+
+# DB_POOL=True shares a psycopg (3) connection pool between the threads of a process instead;
+# connections are checked on checkout (CONN_HEALTH_CHECKS) and replaced after DB_POOL_MAX_LIFETIME seconds
+DB_POOL = config('DB_POOL', default=False, cast=bool)
+if DB_POOL:
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+            'max_size': config('DB_POOL_MAX_SIZE', default=20, cast=int),
+            # seconds a request waits for a free connection before failing
+            'timeout': config('DB_POOL_TIMEOUT', default=10, cast=float),
+            'max_lifetime': config('DB_POOL_MAX_LIFETIME', default=1800, cast=float),
+            'max_idle': config('DB_POOL_MAX_IDLE', default=300, cast=float),
+        },
+    }
+
+# read replicas of the primary, e.g. DB_REPLICA_HOSTS=replica1,replica2; DB_REPLICA_NAME defaults to
+# DB_NAME, pointing it at a second local database is enough to try the routing out
+DATABASE_REPLICAS = []
+for i, host in enumerate(config('DB_REPLICA_HOSTS', default='', cast=Csv())):
+    alias = f'replica_{i}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'NAME': config('DB_REPLICA_NAME', default=DATABASES['default']['NAME']),
+        # tests run against the primary's test database
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ['shared.db_router.ReplicaRouter']
+# a user who wrote is sent to the primary for this long, so they see their own like, comment or post
+REPLICA_PIN_SECONDS = 10
+REPLICA_PIN_CACHE = 'default'
+
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default=''),
     }
 }
 
+# Likes are buffered in LIKE_BUFFER_CACHE and written in batches by `manage.py flush_like_buffer`,
+# the cache must be shared by all workers (e.g. redis) when this is on, the system checks refuse a per-process one
+LIKE_WRITE_BEHIND = config('LIKE_WRITE_BEHIND', default=False, cast=bool)
+LIKE_BUFFER_CACHE = 'default'
+
+# 'database' keeps verification codes as UserConfirmation rows, purged by `manage.py purge_verifications`;
+# 'cache' keeps them in VERIFICATION_CACHE until they expire, which must then be shared by all workers
+VERIFICATION_STORE = config('VERIFICATION_STORE', default='database')
+VERIFICATION_CACHE = 'default'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -188,6 +326,34 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = str(BASE_DIR.joinpath('media'))
 
+STORAGES = {
+    # media files are named by their sha256 and stored once, see shared.storage
+    'default': {
+        'BACKEND': config('MEDIA_STORAGE', default='shared.storage.ContentAddressedStorage'),
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+# resized copies of Post.image and User.photo, by longest side in pixels
+IMAGE_VARIANTS = {
+    'thumbnail': 150,
+    'feed': 640,
+    'full': 1080,
+}
+IMAGE_VARIANT_FORMAT = 'WEBP'
+# processes rendering variants in the background, 0 renders them inline after commit
+IMAGE_WORKERS = config('IMAGE_WORKERS', default=2, cast=int)
+IMAGE_QUEUE_SIZE = config('IMAGE_QUEUE_SIZE', default=100, cast=int)
+
+# resumable post uploads are spooled here, keep it on the same filesystem as MEDIA_ROOT
+# so finished files are moved into place rather than copied
+UPLOAD_STAGING_DIR = config('UPLOAD_STAGING_DIR', default=str(BASE_DIR.joinpath('uploads')))
+UPLOAD_MAX_SIZE = config('UPLOAD_MAX_SIZE', default=50 * 1024 * 1024, cast=int)
+# unfinished uploads older than this are removed by `manage.py purge_uploads`
+UPLOAD_SESSION_TTL = timedelta(days=1)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -196,3 +362,21 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'users.User'
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+
+# outgoing mail is sent by a pool of EMAIL_WORKERS threads per process, each reusing one connection;
+# a message waits up to EMAIL_QUEUE_TIMEOUT seconds for room in the queue and is dropped after that
+EMAIL_WORKERS = config('EMAIL_WORKERS', default=2, cast=int)
+EMAIL_QUEUE_SIZE = config('EMAIL_QUEUE_SIZE', default=1000, cast=int)
+EMAIL_BATCH_SIZE = 50
+EMAIL_QUEUE_TIMEOUT = 1.0
+
+# verification codes go through the outbox table and `manage.py process_outbox`,
+# failed sends are retried after OUTBOX_RETRY_BACKOFF * 2^(attempt - 1) seconds
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_RETRY_BACKOFF = 30
+OUTBOX_RETRY_BACKOFF_MAX = 3600
+# seconds process_outbox waits for the email pool to send a message before counting it as failed
+OUTBOX_SEND_TIMEOUT = 30
+# claimed messages are leased for this many seconds, long enough for a slow send to finish, and are
+# claimed again once the lease runs out without an outcome (the worker died)
+OUTBOX_LEASE_SECONDS = 300
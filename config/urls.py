@@ -22,6 +22,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('users/', include('users.urls')),
     path('posts/', include('post.urls')),
+    path('shared/', include('shared.urls')),
 
     # swagger
     path('swagger/', schema_view.with_ui(
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from post.models import Post, PostComment, PostLike, CommentLike
+from post.models import Post, PostComment, PostLike, CommentLike, PostUpload
 
 
 @admin.register(Post)
@@ -26,3 +26,9 @@ class CommentLikeAdmin(admin.ModelAdmin):
     search_fields = ('id', 'author__username')
 
 
+
+
+@admin.register(PostUpload)
+class PostUploadAdmin(admin.ModelAdmin):
+    list_display = ('id', 'author', 'filename', 'size', 'received', 'post', 'created_time')
+    search_fields = ('id', 'author__username', 'filename')
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class PostConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'post'
+
+    def ready(self):
+        from django.core import checks
+        from post.like_buffer import check_like_buffer_cache
+
+        checks.register(check_like_buffer_cache)
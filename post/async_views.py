@@ -0,0 +1,128 @@
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views import View
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from post.like_buffer import get_like_buffer, write_behind_enabled
+from post.models import Post, PostComment, PostLike, CommentLike
+from post.serializers import PostSerializer, PostCommentSerializer, PostLikeSerializer, CommentLikeSerializer
+from shared.custom_pagination import CustomPagination
+
+
+class AsyncReadView(View):
+    """
+    A read-only endpoint as a native async view. Under config/asgi.py the rows are
+    read with the async ORM and the request holds no worker thread while it waits
+    on the database or the client. Authentication and response shapes are those of
+    the DRF views; conditional GET is left to the sync endpoints.
+    """
+    serializer_class = None
+
+    async def get(self, request, *args, **kwargs):
+        try:
+            self.request = await self.initialize_request(request)
+            data = await self.get_data(self.request, *args, **kwargs)
+        except APIException as e:
+            return JsonResponse({'detail': e.detail}, status=e.status_code, encoder=JSONEncoder)
+        return JsonResponse(data, safe=False, encoder=JSONEncoder)
+
+    async def initialize_request(self, request):
+        drf_request = Request(request)
+        drf_request.user = await sync_to_async(self.authenticate)(request)
+        return drf_request
+
+    @staticmethod
+    def authenticate(request):
+        # ClaimsJWTAuthentication needs no query for current tokens
+        for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+            result = authentication_class().authenticate(request)
+            if result is not None:
+                return result[0]
+        return api_settings.UNAUTHENTICATED_USER()
+
+    def get_serializer(self, *args, **kwargs):
+        return self.serializer_class(*args, context={'request': self.request, 'view': self}, **kwargs)
+
+    def get_queryset(self):
+        raise NotImplementedError
+
+    async def process_page(self, page):
+        return page
+
+    async def get_data(self, request, *args, **kwargs):
+        raise NotImplementedError
+
+
+class AsyncListView(AsyncReadView):
+    pagination_class = CustomPagination
+
+    async def get_data(self, request, *args, **kwargs):
+        paginator = self.pagination_class()
+        page = await paginator.apaginate_queryset(self.get_queryset(), request, view=self)
+        data = self.get_serializer(await self.process_page(page), many=True).data
+        return paginator.get_paginated_response(data).data
+
+
+class AsyncRetrieveView(AsyncReadView):
+    label = None
+
+    async def get_data(self, request, *args, **kwargs):
+        instance = await self.get_queryset().filter(pk=self.kwargs['pk']).afirst()
+        if instance is None:
+            raise NotFound(f"No {self.label} matches the given query.")
+        page = await self.process_page([instance])
+        return self.get_serializer(page[0]).data
+
+
+class AsyncPendingLikesMixin:
+
+    async def process_page(self, page):
+        if not write_behind_enabled():
+            return page
+        return await sync_to_async(get_like_buffer().merge)(page, self.request.user)
+
+
+class AsyncPostListView(AsyncPendingLikesMixin, AsyncListView):
+    serializer_class = PostSerializer
+
+    def get_queryset(self):
+        return Post.objects.for_feed(self.request.user).order_by('-created_time', '-id')
+
+
+class AsyncPostDetailView(AsyncPendingLikesMixin, AsyncRetrieveView):
+    serializer_class = PostSerializer
+    label = 'Post'
+
+    def get_queryset(self):
+        return Post.objects.for_feed(self.request.user)
+
+
+class AsyncPostCommentListView(AsyncListView):
+    serializer_class = PostCommentSerializer
+    cursor_ordering = ('created_time', 'id')
+
+    async def process_page(self, page):
+        return await PostComment.objects.aattach_replies(page, self.request.user)
+
+    def get_queryset(self):
+        return PostComment.objects.filter(post__id=self.kwargs['pk'], parent__isnull=True) \
+            .select_related('author').with_me_liked(self.request.user).order_by('created_time', 'id')
+
+
+class AsyncPostLikeListView(AsyncListView):
+    serializer_class = PostLikeSerializer
+
+    def get_queryset(self):
+        return PostLike.objects.filter(post__id=self.kwargs['pk']).select_related('author') \
+            .order_by('-created_time', '-id')
+
+
+class AsyncCommentLikeListView(AsyncListView):
+    serializer_class = CommentLikeSerializer
+
+    def get_queryset(self):
+        return CommentLike.objects.filter(comment__id=self.kwargs['pk']).select_related('author') \
+            .order_by('-created_time', '-id')
@@ -0,0 +1,96 @@
+import math
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Value
+from django.db.models.functions import Abs, Exp, Greatest, Ln
+from django.utils import timezone
+
+from post.models import PostComment, PostScore, ScoredLike
+from shared.custom_pagination import CustomPagination
+
+# scores are relative to this moment, any fixed point in the past works
+EPOCH = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def decay_rate():
+    return math.log(2) / settings.EXPLORE_HALF_LIFE.total_seconds()
+
+
+def log_weight(weight, moment=None):
+    """
+    log(weight * 2 ** (age since EPOCH / EXPLORE_HALF_LIFE)). Growing new events
+    instead of shrinking old ones means stored scores never need rewriting;
+    logs keep the numbers small however far from EPOCH we get.
+    """
+    moment = moment or timezone.now()
+    return math.log(weight) + (moment - EPOCH).total_seconds() * decay_rate()
+
+
+def record_engagement(post_id, weight, moment=None):
+    """
+    Adds `weight` to the post's decayed score with one UPDATE of its row, as
+    score = log(exp(score) + exp(value)) written so it cannot overflow.
+    """
+    value = log_weight(weight, moment)
+    score = Greatest(F('score'), Value(value)) + Ln(Value(1.0) + Exp(-Abs(F('score') - Value(value))))
+    if not PostScore.objects.filter(post_id=post_id).update(score=score):
+        # first engagement since the post was created or compacted away; a concurrent
+        # first engagement can win the insert, losing one event of a cold post
+        PostScore.objects.bulk_create([PostScore(post_id=post_id, score=value)], ignore_conflicts=True)
+
+
+def first_like(author, post_id, comment_id=None):
+    """
+    Records that the author's like of the post or comment was scored, returns
+    whether it is the first one. A single INSERT ... ON CONFLICT DO NOTHING.
+    """
+    scored = ScoredLike(author=author, post_id=post_id, comment_id=comment_id)
+    scored.created_time = scored.updated_time = timezone.now()
+    opts = ScoredLike._meta
+    fields = [opts.pk] + [opts.get_field(name) for name in ('created_time', 'updated_time', 'author', 'post',
+                                                             'comment')]
+    params = [field.get_db_prep_save(field.value_from_object(scored), connection) for field in fields]
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {qn(opts.db_table)} ({', '.join(qn(field.column) for field in fields)}) "
+            f"VALUES ({', '.join(['%s'] * len(fields))}) ON CONFLICT DO NOTHING",
+            params
+        )
+        return bool(cursor.rowcount)
+
+
+def record_post_like(post_id, author):
+    # only the first like of each user counts, so cycling like/unlike cannot push a post up
+    if first_like(author, post_id):
+        record_engagement(post_id, settings.EXPLORE_LIKE_WEIGHT)
+
+
+def record_comment(post_id):
+    record_engagement(post_id, settings.EXPLORE_COMMENT_WEIGHT)
+
+
+def record_comment_like(comment_id, author):
+    post_id = PostComment.objects.filter(pk=comment_id).values_list('post_id', flat=True).first()
+    if post_id is not None and first_like(author, post_id, comment_id):
+        record_engagement(post_id, settings.EXPLORE_COMMENT_LIKE_WEIGHT)
+
+
+def read_explore(position=None, limit=10):
+    """
+    Returns up to `limit` (score, post_id) pairs, best first and strictly after
+    `position`, read from the top of post_score_idx.
+    """
+    rows = PostScore.objects.all()
+    if position is not None:
+        rows = rows.filter(CustomPagination.seek_filter(('-score', '-post_id'), position))
+    return list(rows.order_by('-score', '-post_id').values_list('score', 'post_id')[:limit])
+
+
+def cold_scores(now=None):
+    """
+    Scores that decayed below EXPLORE_MIN_SCORE, one range of post_score_idx.
+    """
+    return PostScore.objects.filter(score__lt=log_weight(settings.EXPLORE_MIN_SCORE, now))
@@ -0,0 +1,272 @@
+import time
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from rest_framework.exceptions import Throttled
+
+from post.models import Post, PostLike
+
+
+class LikeBuffer:
+    """
+    Write-behind buffer for post likes kept in a shared cache backend.
+
+    Every like/unlike that changes a user's state is recorded as
+      - state key  (post, user) -> (liked, seq, like id, time), read by me_liked
+      - delta key  post -> pending likes_count change, read by the counters
+      - op key     seq -> (post, user), the log the flusher walks in order
+    `flush()` applies the log to the database in batches with bulk_create and a
+    single bulk delete, then moves the pending deltas into Post.likes_count.
+
+    The state of a (post, user) pair is only read and written under that pair's
+    lock, so two toggles of the same user cannot both act on the same state.
+    """
+    prefix = 'likebuf'
+    # a lock left by a crashed writer expires after this many seconds
+    lock_timeout = 5
+    # how long a writer waits for the pair lock before giving up
+    lock_wait = 1.0
+    # an op still missing this many seconds after the flusher first saw the gap is skipped
+    stall_timeout = 10
+
+    def __init__(self, cache_alias='default'):
+        self.cache = caches[cache_alias]
+
+    def state_key(self, post_id, user_id):
+        return f'{self.prefix}:state:{post_id}:{user_id}'
+
+    def pair_lock_key(self, post_id, user_id):
+        return f'{self.prefix}:lock:{post_id}:{user_id}'
+
+    def delta_key(self, post_id):
+        return f'{self.prefix}:delta:{post_id}'
+
+    def op_key(self, seq):
+        return f'{self.prefix}:op:{seq}'
+
+    @property
+    def seq_key(self):
+        return f'{self.prefix}:seq'
+
+    @property
+    def flushed_key(self):
+        return f'{self.prefix}:flushed'
+
+    @property
+    def lock_key(self):
+        return f'{self.prefix}:lock'
+
+    @property
+    def stalled_key(self):
+        return f'{self.prefix}:stalled'
+
+    def like(self, post_id, author):
+        like = PostLike(post_id=post_id, author=author)
+        like.created_time = like.updated_time = timezone.now()
+        if self.record(post_id, author.pk, True, like):
+            return like
+        return None
+
+    def unlike(self, post_id, author):
+        return self.record(post_id, author.pk, False)
+
+    def record(self, post_id, user_id, liked, like=None):
+        """
+        Records the new state if it differs from the effective one (pending state,
+        or the database when nothing is pending). Returns whether it changed.
+        """
+        post_id, user_id = str(post_id), str(user_id)
+        lock_key = self.pair_lock_key(post_id, user_id)
+        deadline = time.monotonic() + self.lock_wait
+        while not self.cache.add(lock_key, 1, timeout=self.lock_timeout):
+            if time.monotonic() >= deadline:
+                raise Throttled(detail="A like of this post is already being recorded, try again shortly")
+            time.sleep(0.01)
+        try:
+            return self._record(post_id, user_id, liked, like)
+        finally:
+            self.cache.delete(lock_key)
+
+    def _record(self, post_id, user_id, liked, like):
+        state_key = self.state_key(post_id, user_id)
+        state = self.cache.get(state_key)
+        if state is None:
+            current = Post.objects.filter(pk=post_id).annotate(
+                liked=Exists(PostLike.objects.filter(post=OuterRef('pk'), author_id=user_id))
+            ).values_list('liked', flat=True).first()
+            if current is None:
+                return False
+        else:
+            current = state[0]
+        if current == liked:
+            return False
+
+        seq = self.incr(self.seq_key, 1)
+        # the op goes in first, the flusher waits for a missing op before skipping it
+        self.cache.set(self.op_key(seq), (post_id, user_id), timeout=None)
+        like_id = str(like.pk) if like else None
+        created_time = like.created_time if like else None
+        self.cache.set(state_key, (liked, seq, like_id, created_time), timeout=None)
+        self.incr(self.delta_key(post_id), 1 if liked else -1)
+        return True
+
+    def incr(self, key, delta):
+        self.cache.add(key, 0, timeout=None)
+        return self.cache.incr(key, delta)
+
+    def merge(self, posts, user=None):
+        """
+        Applies pending deltas to `likes_count` and pending states to `me_liked`.
+        """
+        posts = list(posts)
+        if not posts:
+            return posts
+        deltas = self.cache.get_many([self.delta_key(post.pk) for post in posts])
+        states = {}
+        if user is not None and user.is_authenticated:
+            states = self.cache.get_many([self.state_key(post.pk, user.pk) for post in posts])
+        for post in posts:
+            post.likes_count = max(post.likes_count + deltas.get(self.delta_key(post.pk), 0), 0)
+            state = states.get(self.state_key(post.pk, user.pk)) if states else None
+            if state is not None:
+                post.me_liked = state[0]
+        return posts
+
+    def pending_deltas(self, post_ids):
+        deltas = self.cache.get_many([self.delta_key(post_id) for post_id in post_ids])
+        return {post_id: deltas.get(self.delta_key(post_id), 0) for post_id in post_ids}
+
+    def flush(self, batch_size=1000):
+        """
+        Applies up to `batch_size` buffered operations, returns how many were applied.
+        Only one flusher runs at a time, others return 0.
+        """
+        if not self.cache.add(self.lock_key, 1, timeout=300):
+            return 0
+        try:
+            return self._flush(batch_size)
+        finally:
+            self.cache.delete(self.lock_key)
+
+    def _flush(self, batch_size):
+        flushed = self.cache.get(self.flushed_key, 0)
+        head = self.cache.get(self.seq_key, 0)
+        upto = min(head, flushed + batch_size)
+        if upto <= flushed:
+            return 0
+
+        ops = self.cache.get_many([self.op_key(seq) for seq in range(flushed + 1, upto + 1)])
+        # stop before an op whose writer has not finished yet, unless it has been
+        # missing for stall_timeout seconds (the writer died); the marker is kept in
+        # the cache so that one-shot flushes see it too
+        for seq in range(flushed + 1, upto + 1):
+            if self.op_key(seq) in ops:
+                continue
+            if seq == flushed + 1:
+                stalled = self.cache.get(self.stalled_key)
+                if stalled is None or stalled[0] != seq:
+                    self.cache.set(self.stalled_key, (seq, time.time()), timeout=None)
+                elif time.time() - stalled[1] >= self.stall_timeout:
+                    continue
+            upto = seq - 1
+            break
+        if upto <= flushed:
+            return 0
+        op_keys = [self.op_key(seq) for seq in range(flushed + 1, upto + 1)]
+        pairs = {ops[key] for key in op_keys if key in ops}
+        state_keys = {pair: self.state_key(*pair) for pair in pairs}
+        states = self.cache.get_many(list(state_keys.values()))
+        post_ids = {post_id for post_id, _ in pairs}
+        existing = {str(pk) for pk in Post.objects.filter(pk__in=post_ids).values_list('pk', flat=True)}
+
+        likes = []
+        unlikes = Q()
+        for (post_id, user_id), key in state_keys.items():
+            state = states.get(key)
+            if state is None or post_id not in existing:
+                continue
+            liked, _, like_id, created_time = state
+            if liked:
+                likes.append(PostLike(
+                    id=like_id, post_id=post_id, author_id=user_id,
+                    created_time=created_time, updated_time=created_time,
+                ))
+            else:
+                unlikes |= Q(post_id=post_id, author_id=user_id)
+
+        deltas = {post_id: delta for post_id, delta in self.pending_deltas(sorted(existing)).items() if delta}
+        with transaction.atomic():
+            PostLike.objects.bulk_create(likes, batch_size=batch_size, ignore_conflicts=True)
+            if unlikes:
+                PostLike.objects.filter(unlikes).delete()
+            for post_id, delta in deltas.items():
+                Post.objects.increment(post_id, likes_count=delta)
+        for post_id, delta in deltas.items():
+            try:
+                self.cache.decr(self.delta_key(post_id), delta)
+            except ValueError:
+                # evicted, nothing left to drain
+                pass
+
+        self.cache.set(self.flushed_key, upto, timeout=None)
+        self.cache.delete_many(op_keys)
+        for (post_id, user_id), key in state_keys.items():
+            self.forget_state(post_id, user_id, key, upto)
+        for post_id in post_ids - existing:
+            self.cache.delete(self.delta_key(post_id))
+        return upto - flushed
+
+    def forget_state(self, post_id, user_id, key, upto):
+        """
+        Deletes a flushed state under the pair lock. A state written after this
+        batch was read belongs to a later op and must stay; so does any state
+        whose pair is locked, its writer is about to replace it.
+        """
+        lock_key = self.pair_lock_key(post_id, user_id)
+        if not self.cache.add(lock_key, 1, timeout=self.lock_timeout):
+            return
+        try:
+            state = self.cache.get(key)
+            if state is not None and state[1] <= upto:
+                self.cache.delete(key)
+        finally:
+            self.cache.delete(lock_key)
+
+
+_buffers = {}
+
+
+def get_like_buffer():
+    alias = getattr(settings, 'LIKE_BUFFER_CACHE', 'default')
+    if alias not in _buffers:
+        _buffers[alias] = LikeBuffer(alias)
+    return _buffers[alias]
+
+
+def write_behind_enabled():
+    return getattr(settings, 'LIKE_WRITE_BEHIND', False)
+
+
+# caches each process keeps to itself, the buffer would split between workers and the flusher
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def check_like_buffer_cache(app_configs=None, **kwargs):
+    if not write_behind_enabled():
+        return []
+    alias = getattr(settings, 'LIKE_BUFFER_CACHE', 'default')
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if backend in PROCESS_LOCAL_CACHES:
+        return [checks.Error(
+            f"LIKE_WRITE_BEHIND needs a cache shared by all processes, LIKE_BUFFER_CACHE '{alias}' uses {backend}",
+            hint="Point LIKE_BUFFER_CACHE at a shared cache such as redis, or turn LIKE_WRITE_BEHIND off.",
+            id='post.E001',
+        )]
+    return []
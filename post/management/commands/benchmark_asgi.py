@@ -0,0 +1,146 @@
+import asyncio
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand
+
+from config.asgi import application as asgi_application
+from config.wsgi import application as wsgi_application
+
+
+def percentile(latencies, fraction):
+    return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)]
+
+
+class Command(BaseCommand):
+    help = ("Compare a sync endpoint served by config/wsgi.py on a thread pool with its async variant "
+            "served by config/asgi.py, in-process, reporting requests/sec and latency percentiles")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=200, help="Requests in flight at once")
+        parser.add_argument('--threads', type=int, default=8, help="WSGI worker threads")
+        parser.add_argument('--sync-path', default='/posts/list/')
+        parser.add_argument('--async-path', default='/posts/async/list/')
+        parser.add_argument('--token', help="Access token sent as a Bearer Authorization header")
+        parser.add_argument('--host', default='localhost')
+
+    def handle(self, *args, **options):
+        headers = {'host': options['host']}
+        if options['token']:
+            headers['authorization'] = f"Bearer {options['token']}"
+
+        results = self.run_wsgi(wsgi_application, options['sync_path'], headers, options)
+        self.report('WSGI', options['sync_path'], *results)
+        results = asyncio.run(self.run_asgi(asgi_application, options['async_path'], headers, options))
+        self.report('ASGI', options['async_path'], *results)
+
+    def run_wsgi(self, application, url, headers, options):
+        path, _, query = url.partition('?')
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'SERVER_NAME': options['host'],
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'wsgi.url_scheme': 'http',
+            'wsgi.errors': sys.stderr,
+            **{f"HTTP_{name.upper().replace('-', '_')}": value for name, value in headers.items()},
+        }
+        statuses = []
+
+        def request(queued):
+            def start_response(status, response_headers, exc_info=None):
+                statuses.append(int(status.split()[0]))
+
+            response = application({**environ, 'wsgi.input': BytesIO()}, start_response)
+            try:
+                for _ in response:
+                    pass
+            finally:
+                if hasattr(response, 'close'):
+                    response.close()
+            return time.perf_counter() - queued
+
+        # clients keep `concurrency` requests in flight, the server works through them on `threads`
+        in_flight = threading.BoundedSemaphore(options['concurrency'])
+        futures = []
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as server:
+            for _ in range(options['requests']):
+                in_flight.acquire()
+                future = server.submit(request, time.perf_counter())
+                future.add_done_callback(lambda _: in_flight.release())
+                futures.append(future)
+        elapsed = time.perf_counter() - started
+        return [future.result() for future in futures], statuses, elapsed
+
+    async def run_asgi(self, application, url, headers, options):
+        parts = urlsplit(url)
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': parts.path,
+            'raw_path': parts.path.encode(),
+            'query_string': parts.query.encode(),
+            'root_path': '',
+            'headers': [(name.encode(), value.encode()) for name, value in headers.items()],
+            'client': ('127.0.0.1', 0),
+            'server': (options['host'], 80),
+        }
+        latencies = []
+        statuses = []
+        remaining = options['requests']
+
+        async def request():
+            body_sent = False
+            finished = asyncio.Event()
+
+            async def receive():
+                nonlocal body_sent
+                if not body_sent:
+                    body_sent = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                # the client stays connected until the response is complete
+                await finished.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    statuses.append(message['status'])
+                elif message['type'] == 'http.response.body' and not message.get('more_body'):
+                    finished.set()
+
+            queued = time.perf_counter()
+            await application(dict(scope), receive, send)
+            latencies.append(time.perf_counter() - queued)
+
+        async def client():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                await request()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(options['concurrency'])))
+        return latencies, statuses, time.perf_counter() - started
+
+    def report(self, label, path, latencies, statuses, elapsed):
+        latencies = sorted(latencies)
+        errors = sum(1 for status in statuses if status >= 400)
+        self.stdout.write(
+            f"{label} {path}: {len(latencies)} requests in {elapsed:.2f}s, {len(latencies) / elapsed:.1f} req/s, "
+            f"{errors} errors"
+        )
+        self.stdout.write(
+            f"  latency p50 {percentile(latencies, 0.5) * 1000:.1f}ms, p95 {percentile(latencies, 0.95) * 1000:.1f}ms, "
+            f"p99 {percentile(latencies, 0.99) * 1000:.1f}ms, max {latencies[-1] * 1000:.1f}ms"
+        )
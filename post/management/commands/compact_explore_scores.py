@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from post.explore import cold_scores
+from post.models import PostScore
+from shared.custom_pagination import CustomPagination
+
+
+class Command(BaseCommand):
+    help = ("Prune explore scores that decayed below EXPLORE_MIN_SCORE and keep at most EXPLORE_MAX_POSTS, "
+            "run it periodically")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        cold = self.purge(cold_scores(), options['batch_size'])
+        overflow = 0
+        last = PostScore.objects.order_by('-score', '-post_id') \
+            .values_list('score', 'post_id')[settings.EXPLORE_MAX_POSTS - 1:settings.EXPLORE_MAX_POSTS]
+        if last:
+            below = PostScore.objects.filter(CustomPagination.seek_filter(('-score', '-post_id'), last[0]))
+            overflow = self.purge(below, options['batch_size'])
+        self.stdout.write(f"Cold scores pruned: {cold}, scores over the limit pruned: {overflow}")
+
+    @staticmethod
+    def purge(queryset, batch_size):
+        total = 0
+        while True:
+            batch = list(queryset.order_by('score').values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                return total
+            total += PostScore.objects.filter(pk__in=batch).delete()[0]
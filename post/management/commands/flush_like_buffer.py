@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from post.like_buffer import get_like_buffer
+
+
+class Command(BaseCommand):
+    help = "Write likes buffered by LIKE_WRITE_BEHIND to the database"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--interval', type=float, default=0,
+                            help="Seconds between flushes, 0 flushes what is pending and exits")
+
+    def handle(self, *args, **options):
+        buffer = get_like_buffer()
+        while True:
+            total = 0
+            while True:
+                applied = buffer.flush(options['batch_size'])
+                total += applied
+                if applied < options['batch_size']:
+                    break
+            if total:
+                self.stdout.write(f"Flushed {total} like operations")
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,77 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models.functions import Now
+
+from post.models import Post
+from shared.storage import ContentAddressedStorage
+from users.models import User
+
+# matches names already in the <upload_to>/ab/cd/<sha256>.<ext> layout
+HASHED_NAME_PATTERN = r'/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.[a-z0-9]+)?$'
+
+
+class Command(BaseCommand):
+    help = "Move Post.image and User.photo files into the content-addressed layout of ContentAddressedStorage"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if not isinstance(default_storage, ContentAddressedStorage):
+            raise CommandError("STORAGES['default'] must be shared.storage.ContentAddressedStorage")
+        for model, field_name, variants_field in [
+            (Post, 'image', 'image_variants'),
+            (User, 'photo', 'photo_variants'),
+        ]:
+            moved, missing = self.migrate(model, field_name, variants_field, options['batch_size'])
+            self.stdout.write(f"{model._meta.verbose_name_plural.capitalize()} migrated: {moved}, missing files: {missing}")
+
+    def migrate(self, model, field_name, variants_field, batch_size):
+        """
+        Walks the rows still pointing at old names in pk order. Rows are updated
+        one by one and only if their file did not change meanwhile, so the command
+        can be interrupted and started again at any point.
+        """
+        moved = missing = 0
+        last_pk = None
+        legacy = model._base_manager.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True}) \
+            .exclude(**{f'{field_name}__regex': HASHED_NAME_PATTERN}).order_by('pk')
+        while True:
+            queryset = legacy if last_pk is None else legacy.filter(pk__gt=last_pk)
+            batch = list(queryset.values_list('pk', field_name, variants_field)[:batch_size])
+            if not batch:
+                return moved, missing
+            last_pk = batch[-1][0]
+            for pk, name, variants in batch:
+                if not default_storage.exists(name):
+                    missing += 1
+                    continue
+                saved = []
+                new_name = self.move(name, saved)
+                new_variants = {
+                    variant: self.move(variant_name, saved) if default_storage.exists(variant_name) else variant_name
+                    for variant, variant_name in (variants or {}).items()
+                }
+                # the file URLs change, so cached representations must go stale
+                updated = model._base_manager.filter(pk=pk, **{field_name: name}) \
+                    .update(**{field_name: new_name, variants_field: new_variants, 'updated_time': Now()})
+                if not updated:
+                    for stored in saved:
+                        default_storage.delete(stored)
+                    continue
+                # old names have no StoredFile row, so this removes them from disk
+                # unless another row still points at the same file
+                if not model._base_manager.filter(**{field_name: name}).exists():
+                    for old in [name] + list((variants or {}).values()):
+                        if not ContentAddressedStorage.is_hashed_name(old):
+                            default_storage.delete(old)
+                moved += 1
+
+    @staticmethod
+    def move(name, saved):
+        if ContentAddressedStorage.is_hashed_name(name):
+            return name
+        with default_storage.open(name, 'rb') as content:
+            new_name = default_storage.save(name, content)
+        saved.append(new_name)
+        return new_name
@@ -0,0 +1,46 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from post.models import Post
+from shared.images import generate_variants
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = "Render missing image variants of Post.image and User.photo"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--workers', type=int, default=2)
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        with ProcessPoolExecutor(max_workers=workers) as processes, ThreadPoolExecutor(max_workers=workers) as threads:
+            done = self.process(Post, 'image', 'image_variants', options['batch_size'], processes, threads)
+            self.stdout.write(f"Posts processed: {done}")
+            done = self.process(User, 'photo', 'photo_variants', options['batch_size'], processes, threads)
+            self.stdout.write(f"Users processed: {done}")
+
+    def process(self, model, field_name, variants_field, batch_size, processes, threads):
+        def run(instance):
+            try:
+                return bool(generate_variants(instance, field_name, variants_field, processes))
+            except Exception as e:
+                self.stderr.write(f"{model._meta.label} {instance.pk}: {e}")
+                return False
+            finally:
+                connection.close()
+
+        done = 0
+        last_pk = None
+        pending = model.objects.filter(**{variants_field: {}}).exclude(**{field_name: ''}) \
+            .exclude(**{f'{field_name}__isnull': True}).order_by('pk')
+        while True:
+            queryset = pending if last_pk is None else pending.filter(pk__gt=last_pk)
+            batch = list(queryset.only('pk', field_name)[:batch_size])
+            if not batch:
+                return done
+            last_pk = batch[-1].pk
+            done += sum(threads.map(run, batch))
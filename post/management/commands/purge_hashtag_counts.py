@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from post.tags import purge_hashtag_counts
+
+
+class Command(BaseCommand):
+    help = "Delete hashtag use counters of buckets that fell out of the trending window"
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Hashtag counters purged: {purge_hashtag_counts()}")
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from post.models import PostUpload
+from post.uploads import discard_upload
+
+
+class Command(BaseCommand):
+    help = "Delete resumable uploads that were not finalized within UPLOAD_SESSION_TTL"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        expired = PostUpload.objects.filter(
+            post__isnull=True, created_time__lt=timezone.now() - settings.UPLOAD_SESSION_TTL
+        ).order_by('created_time')
+        total = 0
+        while True:
+            batch = list(expired[:options['batch_size']])
+            if not batch:
+                break
+            for upload in batch:
+                discard_upload(upload)
+            total += len(batch)
+        self.stdout.write(f"Uploads purged: {total}")
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from post.models import Post
+from post.search import reindex_posts
+from post.tags import extract_post_tags
+
+
+class Command(BaseCommand):
+    help = ("Rebuild the search postings of every post's description and comments and its hashtag and "
+            "mention rows, one batch of posts at a time")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        posts = entries = 0
+        last_pk = None
+        while True:
+            queryset = Post.objects.order_by('pk')
+            if last_pk is not None:
+                queryset = queryset.filter(pk__gt=last_pk)
+            batch = list(queryset.only('pk', 'author_id', 'description', 'created_time')[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            entries += reindex_posts([post.pk for post in batch])
+            with transaction.atomic():
+                for post in batch:
+                    # existing tags are not new uses, keep them out of trending
+                    extract_post_tags(post, count=False)
+            posts += len(batch)
+        self.stdout.write(f"Posts indexed: {posts}, postings written: {entries}")
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+
+from post.models import Post, PostComment
+
+
+class Command(BaseCommand):
+    help = "Recalculate denormalized like/comment/reply counters that drifted from the real rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        fixed = self.reconcile(
+            Post, batch_size,
+            likes_count='post_likes_count',
+            comments_count='post_comments_count',
+        )
+        self.stdout.write(f"Posts fixed: {fixed}")
+        fixed = self.reconcile(
+            PostComment, batch_size,
+            likes_count='comment_likes_count',
+            replies_count='comment_replies_count',
+        )
+        self.stdout.write(f"Comments fixed: {fixed}")
+
+    @staticmethod
+    def reconcile(model, batch_size, **counters):
+        fixed = 0
+        last_pk = None
+        while True:
+            queryset = model.objects.order_by('pk')
+            if last_pk is not None:
+                queryset = queryset.filter(pk__gt=last_pk)
+            batch = list(queryset.values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                return fixed
+            last_pk = batch[-1]
+
+            drifted = model.objects.filter(pk__in=batch).with_counts().exclude(
+                **{field: F(actual) for field, actual in counters.items()}
+            ).values_list('pk', *counters.values())
+            with transaction.atomic():
+                for row in drifted:
+                    model.objects.filter(pk=row[0]).update(**dict(zip(counters, row[1:])))
+                    fixed += 1
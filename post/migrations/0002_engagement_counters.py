@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:14
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_of(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(field)
+        .annotate(count=Count('pk')).values('count')
+    ), 0)
+
+
+def populate_counters(apps, schema_editor):
+    Post = apps.get_model('post', 'Post')
+    PostComment = apps.get_model('post', 'PostComment')
+    PostLike = apps.get_model('post', 'PostLike')
+    CommentLike = apps.get_model('post', 'CommentLike')
+    Post.objects.update(
+        likes_count=count_of(PostLike, 'post'),
+        comments_count=count_of(PostComment, 'post'),
+    )
+    PostComment.objects.update(
+        likes_count=count_of(CommentLike, 'comment'),
+        replies_count=count_of(PostComment, 'parent'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='postcomment',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='postcomment',
+            name='replies_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:16
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_roots(apps, schema_editor):
+    PostComment = apps.get_model('post', 'PostComment')
+    parent_root = PostComment.objects.filter(pk=OuterRef('parent_id')).values(root_or_self=Coalesce('root_id', 'pk'))
+    # resolve one level of the thread per pass, starting from replies to root comments
+    while PostComment.objects.filter(parent__isnull=False, root__isnull=True).filter(
+        Q(parent__parent__isnull=True) | Q(parent__root__isnull=False)
+    ).update(root=Subquery(parent_root[:1])):
+        pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post', '0002_engagement_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postcomment',
+            name='root',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='descendants', to='post.postcomment'),
+        ),
+        migrations.AddIndex(
+            model_name='postcomment',
+            index=models.Index(fields=['post', 'parent', 'created_time'], name='comment_post_parent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='postcomment',
+            index=models.Index(fields=['root', 'created_time'], name='comment_root_idx'),
+        ),
+        migrations.RunPython(populate_roots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:09
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post', '0009_hashtags_mentions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostScore',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False, unique=True)),
+                ('created_time', models.DateTimeField(auto_now_add=True)),
+                ('updated_time', models.DateTimeField(auto_now=True)),
+                ('score', models.FloatField()),
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='score', to='post.post')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['score', 'post'], name='post_score_idx')],
+            },
+        ),
+    ]
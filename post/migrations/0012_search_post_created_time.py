@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:12
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_post_created_time(apps, schema_editor):
+    Post = apps.get_model('post', 'Post')
+    PostSearchEntry = apps.get_model('post', 'PostSearchEntry')
+    created_time = Post.objects.filter(pk=OuterRef('post_id')).values('created_time')
+    PostSearchEntry.objects.update(post_created_time=Subquery(created_time[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('post', '0011_scored_likes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postsearchentry',
+            name='post_created_time',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(copy_post_created_time, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='postsearchentry',
+            name='post_created_time',
+            field=models.DateTimeField(),
+        ),
+        migrations.AddIndex(
+            model_name='postsearchentry',
+            index=models.Index(fields=['term', 'post_created_time', 'post'], name='post_search_recent_idx'),
+        ),
+    ]
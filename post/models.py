@@ -1,27 +1,149 @@
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import connection, models
+from django.db.models import Count, Exists, OuterRef, Q, Subquery, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
 from django.core.validators import MaxLengthValidator, FileExtensionValidator
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 
-from shared.models import BaseModel
+from shared.models import BaseModel, CounterQuerySet
+from shared.storage import release_files
 
 User = get_user_model()
 
+
+class PostQuerySet(CounterQuerySet):
+
+    def with_counts(self):
+        likes = PostLike.objects.filter(post=OuterRef('pk')).order_by().values('post') \
+            .annotate(count=Count('pk')).values('count')
+        comments = PostComment.objects.filter(post=OuterRef('pk')).order_by().values('post') \
+            .annotate(count=Count('pk')).values('count')
+        return self.annotate(
+            post_likes_count=Coalesce(Subquery(likes), 0),
+            post_comments_count=Coalesce(Subquery(comments), 0),
+        )
+
+    def with_me_liked(self, user):
+        if user is None or not user.is_authenticated:
+            return self.annotate(me_liked=Value(False))
+        return self.annotate(
+            me_liked=Exists(PostLike.objects.filter(post=OuterRef('pk'), author=user))
+        )
+
+    def for_feed(self, user):
+        return self.select_related('author').with_me_liked(user)
+
+
 class Post(BaseModel):
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='posts')
     image = models.ImageField(upload_to='posts_images/', validators=[FileExtensionValidator(
         allowed_extensions=['png', 'jpg', 'jpeg', 'heic', 'heif']
     )])
     description = models.TextField(validators=[MaxLengthValidator(2000)])
+    # storage names of the resized copies, filled in by shared.images
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    likes_count = models.PositiveIntegerField(default=0)
+    comments_count = models.PositiveIntegerField(default=0)
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         db_table = 'posts'
         verbose_name = 'post'
         verbose_name_plural = 'posts'
+        indexes = [
+            models.Index(fields=['created_time', 'id'], name='post_created_idx'),
+            models.Index(fields=['author', 'created_time', 'id'], name='post_author_created_idx'),
+        ]
 
     def __str__(self):
         return f"'{self.description[:25]}' - post by {self.author}"
 
 
+@receiver(post_delete, sender=Post)
+def release_post_image(sender, instance, **kwargs):
+    release_files(instance.image, instance.image_variants)
+
+
+class PostCommentQuerySet(CounterQuerySet):
+
+    def with_counts(self):
+        likes = CommentLike.objects.filter(comment=OuterRef('pk')).order_by().values('comment') \
+            .annotate(count=Count('pk')).values('count')
+        replies = PostComment.objects.filter(parent=OuterRef('pk')).order_by().values('parent') \
+            .annotate(count=Count('pk')).values('count')
+        return self.annotate(
+            comment_likes_count=Coalesce(Subquery(likes), 0),
+            comment_replies_count=Coalesce(Subquery(replies), 0),
+        )
+
+    def with_me_liked(self, user):
+        if user is None or not user.is_authenticated:
+            return self.annotate(me_liked=Value(False))
+        return self.annotate(
+            me_liked=Exists(CommentLike.objects.filter(comment=OuterRef('pk'), author=user))
+        )
+
+    def attach_replies(self, comments, user=None):
+        """
+        Loads every descendant of the given comments with a single query and sets
+        `tree_replies` on each node, so serializing the thread needs no further
+        queries. Top-level comments take their whole thread through `root`,
+        replies only their own subtree.
+        """
+        comments = list(comments)
+        descendants = self.descendants_of(comments, user)
+        if descendants is None:
+            return comments
+        return self.link_replies(comments, list(descendants))
+
+    async def aattach_replies(self, comments, user=None):
+        comments = list(comments)
+        descendants = self.descendants_of(comments, user)
+        if descendants is None:
+            return comments
+        return self.link_replies(comments, [comment async for comment in descendants])
+
+    def descendants_of(self, comments, user=None):
+        root_ids = {comment.pk for comment in comments if comment.root_id is None}
+        reply_ids = {comment.pk for comment in comments if comment.root_id is not None}
+        if not root_ids and not reply_ids:
+            return None
+        lookup = Q(root_id__in=root_ids) if root_ids else Q()
+        if reply_ids:
+            lookup |= Q(pk__in=self.subtree_sql(reply_ids))
+        return self.model.objects.filter(lookup).select_related('author') \
+            .with_me_liked(user).order_by('created_time', 'pk')
+
+    def subtree_sql(self, comment_ids):
+        """
+        Ids of the descendants of the given comments, walked down `parent`.
+        """
+        opts = self.model._meta
+        qn = connection.ops.quote_name
+        table, pk, parent = qn(opts.db_table), qn(opts.pk.column), qn(opts.get_field('parent').column)
+        return RawSQL(
+            f"WITH RECURSIVE subtree (id) AS ("
+            f"SELECT {pk} FROM {table} WHERE {parent} IN ({', '.join(['%s'] * len(comment_ids))}) "
+            f"UNION ALL SELECT child.{pk} FROM {table} child JOIN subtree ON child.{parent} = subtree.id"
+            f") SELECT id FROM subtree",
+            [opts.pk.get_db_prep_value(pk, connection) for pk in comment_ids]
+        )
+
+    @staticmethod
+    def link_replies(comments, descendants):
+        children = {}
+        for comment in descendants:
+            children.setdefault(comment.parent_id, []).append(comment)
+        for comment in descendants:
+            comment.tree_replies = children.get(comment.pk, [])
+        for comment in comments:
+            comment.tree_replies = children.get(comment.pk, [])
+        return comments
+
+
 class PostComment(BaseModel):
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
@@ -33,10 +155,46 @@ class PostComment(BaseModel):
         related_name='child',
         on_delete=models.CASCADE
     )
+    root = models.ForeignKey(
+        'self',
+        null=True,
+        blank=True,
+        editable=False,
+        related_name='descendants',
+        on_delete=models.CASCADE
+    )
+    likes_count = models.PositiveIntegerField(default=0)
+    replies_count = models.PositiveIntegerField(default=0)
+
+    objects = PostCommentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'parent', 'created_time', 'id'], name='comment_post_parent_idx'),
+            models.Index(fields=['root', 'created_time'], name='comment_root_idx'),
+            models.Index(fields=['created_time', 'id'], name='comment_created_idx'),
+        ]
 
     def __str__(self):
         return f"'{self.comment[:20]}' comment by {self.author}"
 
+    def get_descendant_count(self):
+        if not hasattr(self, 'tree_replies'):
+            if self.parent_id is None:
+                return PostComment.objects.filter(root_id=self.pk).count()
+            PostComment.objects.attach_replies([self])
+        total = 0
+        nodes = self.tree_replies
+        while nodes:
+            total += len(nodes)
+            nodes = [child for node in nodes for child in node.tree_replies]
+        return total
+
+    def save(self, *args, **kwargs):
+        if self.parent_id and not self.root_id:
+            self.root_id = self.parent.root_id or self.parent_id
+        super(PostComment, self).save(*args, **kwargs)
+
 
 class PostLike(BaseModel):
     author = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -49,6 +207,9 @@ class PostLike(BaseModel):
                 name='unique_post_like'
             )
         ]
+        indexes = [
+            models.Index(fields=['post', 'created_time', 'id'], name='post_like_created_idx'),
+        ]
 
 
 class CommentLike(BaseModel):
@@ -62,3 +223,187 @@ class CommentLike(BaseModel):
                 name='unique_comment_like'
             )
         ]
+        indexes = [
+            models.Index(fields=['comment', 'created_time', 'id'], name='comment_like_created_idx'),
+        ]
+
+
+class TimelineEntry(BaseModel):
+    """
+    A post pushed into a follower's home timeline when it was created (fan-out on write).
+    `post_created_time` and `post_author` are copied from the post so that reading
+    a timeline page is one range scan over timeline_owner_idx.
+    """
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+    post_author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    post_created_time = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['owner', 'post'],
+                name='unique_timeline_entry'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['owner', 'post_created_time', 'post'], name='timeline_owner_idx'),
+            models.Index(fields=['owner', 'post_author'], name='timeline_owner_author_idx'),
+        ]
+
+
+class PostSearchEntry(BaseModel):
+    """
+    A posting of the inverted index built by post.search: `term` occurs in the
+    post's description (`comment` is null) or in one of its comments, `weight`
+    times weighted by where it occurs. A search reads only the postings of its
+    terms through post_search_term_idx. `post_created_time` is copied from the
+    post so that the newest postings of a term are one range of
+    post_search_recent_idx.
+    """
+    term = models.CharField(max_length=64)
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='search_entries')
+    comment = models.ForeignKey(PostComment, null=True, blank=True, on_delete=models.CASCADE,
+                                related_name='search_entries')
+    weight = models.PositiveIntegerField()
+    post_created_time = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['term', 'post', 'weight'], name='post_search_term_idx'),
+            models.Index(fields=['term', 'post_created_time', 'post'], name='post_search_recent_idx'),
+        ]
+
+
+class Hashtag(BaseModel):
+    name = models.CharField(max_length=100, unique=True)
+
+    def __str__(self):
+        return f"#{self.name}"
+
+
+class PostHashtag(BaseModel):
+    """
+    A post carrying a hashtag in its description or in one of its comments, kept
+    up to date by post.tags. `post_created_time` is copied from the post so that
+    a page of a tag is one range scan over post_hashtag_created_idx.
+    """
+    hashtag = models.ForeignKey(Hashtag, on_delete=models.CASCADE, related_name='posts')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='hashtags')
+    post_created_time = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['hashtag', 'post'],
+                name='unique_post_hashtag'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['hashtag', 'post_created_time', 'post'], name='post_hashtag_created_idx'),
+        ]
+
+
+class HashtagCount(BaseModel):
+    """
+    How many times a hashtag was used in the TRENDING_BUCKET_SECONDS long bucket
+    starting at `bucket`. Trending tags are summed from the last few buckets.
+    """
+    hashtag = models.ForeignKey(Hashtag, on_delete=models.CASCADE, related_name='counts')
+    bucket = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['hashtag', 'bucket'],
+                name='unique_hashtag_bucket'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['bucket'], name='hashtag_count_bucket_idx'),
+        ]
+
+
+class PostMention(BaseModel):
+    """
+    `user` mentioned by `author` in the post's description (`comment` is null)
+    or in one of its comments.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='mentions')
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='mentions')
+    comment = models.ForeignKey(PostComment, null=True, blank=True, on_delete=models.CASCADE,
+                                related_name='mentions')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_time', 'id'], name='post_mention_user_idx'),
+        ]
+
+
+class PostScore(BaseModel):
+    """
+    Explore ranking of a post, maintained by post.explore. `score` is the log of
+    the post's decayed engagement scaled to a fixed epoch, so it only changes when
+    the post is engaged with and ordering by it is ordering by current score.
+    """
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, related_name='score')
+    score = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['score', 'post'], name='post_score_idx'),
+        ]
+
+
+class ScoredLike(BaseModel):
+    """
+    A like of a post (`comment` is null) or of one of its comments that already
+    counted towards the post's explore score. It outlives the like, so unliking
+    and liking again adds nothing.
+    """
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+')
+    comment = models.ForeignKey(PostComment, null=True, blank=True, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['author', 'post'],
+                condition=models.Q(comment__isnull=True),
+                name='unique_scored_post_like'
+            ),
+            models.UniqueConstraint(
+                fields=['author', 'comment'],
+                condition=models.Q(comment__isnull=False),
+                name='unique_scored_comment_like'
+            ),
+        ]
+
+
+class PostUpload(BaseModel):
+    """
+    A resumable upload of a post image. Byte ranges are written straight into a
+    staging file under UPLOAD_STAGING_DIR and the post is created from it once
+    every byte has arrived.
+    """
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='post_uploads')
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    received = models.PositiveBigIntegerField(default=0)
+    # hex digest the client expects, checked when the upload is finalized
+    sha256 = models.CharField(max_length=64, blank=True)
+    post = models.OneToOneField(Post, null=True, blank=True, on_delete=models.SET_NULL, related_name='upload')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_time'], name='post_upload_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.filename} ({self.received}/{self.size}) by {self.author}"
+
+    @property
+    def is_complete(self):
+        return self.received >= self.size
@@ -0,0 +1,109 @@
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from post.models import Post, PostComment, PostSearchEntry
+from shared.custom_pagination import CustomPagination
+
+TERM_MAX_LENGTH = PostSearchEntry._meta.get_field('term').max_length
+word_regex = re.compile(r'\w+')
+# words too common to tell posts apart, neither indexed nor searched
+STOPWORDS = frozenset("""
+    a about after all also am an and any are as at be been before being but by can could did do does doing
+    for from had has have having he her here hers him his how if in into is it its just me more most my no
+    nor not of off on once only or other our ours out over own same she should so some such than that the
+    their theirs them then there these they this those through to too under until up very was we were what
+    when where which while who whom why will with would you your yours
+""".split())
+
+
+def tokenize(text):
+    """
+    Case-folded words of `text`, single characters and STOPWORDS dropped. '#tag'
+    and '@name' index as 'tag' and 'name'.
+    """
+    return [
+        word[:TERM_MAX_LENGTH] for word in word_regex.findall(text.casefold())
+        if len(word) > 1 and word not in STOPWORDS
+    ]
+
+
+def build_entries(post_id, post_created_time, text, comment_id=None):
+    factor = 1 if comment_id else settings.SEARCH_DESCRIPTION_WEIGHT
+    return [
+        PostSearchEntry(term=term, post_id=post_id, comment_id=comment_id, weight=count * factor,
+                        post_created_time=post_created_time)
+        for term, count in Counter(tokenize(text)).items()
+    ]
+
+
+def index_post(post):
+    """
+    Replaces the postings of the post's description, call it whenever the
+    description is written.
+    """
+    with transaction.atomic():
+        PostSearchEntry.objects.filter(post_id=post.pk, comment__isnull=True).delete()
+        PostSearchEntry.objects.bulk_create(build_entries(post.pk, post.created_time, post.description))
+
+
+def index_comment(comment):
+    # comments cannot be edited and their postings go with them on delete
+    PostSearchEntry.objects.bulk_create(
+        build_entries(comment.post_id, comment.post.created_time, comment.comment, comment.pk)
+    )
+
+
+def reindex_posts(post_ids):
+    """
+    Rebuilds every posting of the given posts, descriptions and comments, in one
+    transaction. Returns the number of postings written.
+    """
+    entries = []
+    created_times = {}
+    for post_id, created_time, description in Post.objects.filter(pk__in=post_ids) \
+            .values_list('pk', 'created_time', 'description'):
+        created_times[post_id] = created_time
+        entries += build_entries(post_id, created_time, description)
+    comments = PostComment.objects.filter(post_id__in=post_ids).values_list('post_id', 'comment', 'pk')
+    for post_id, text, comment_id in comments.iterator(chunk_size=1000):
+        entries += build_entries(post_id, created_times[post_id], text, comment_id)
+    with transaction.atomic():
+        PostSearchEntry.objects.filter(post_id__in=post_ids).delete()
+        PostSearchEntry.objects.bulk_create(entries, batch_size=1000)
+    return len(entries)
+
+
+def parse_query(query):
+    terms = list(dict.fromkeys(tokenize(query or '')))
+    return terms[:settings.SEARCH_MAX_QUERY_TERMS]
+
+
+def search_posts(terms, position=None, limit=10):
+    """
+    Returns up to `limit` (score, post_id) pairs of the posts matching every
+    term, best first and strictly after `position`. The score is the summed
+    weight of the matched postings.
+
+    Candidates are the posts of the rarest term's postings, the other terms are
+    looked up for those posts only. The rarest term's postings are read up to
+    SEARCH_MAX_TERM_POSTINGS, newest post first, so when every term is that
+    common the search ranks the most recent posts using it instead of reading
+    posting lists as long as the posts table.
+    """
+    cap = settings.SEARCH_MAX_TERM_POSTINGS
+    # counts stop at cap + 1, so counting a common term costs no more than a rare one
+    frequencies = {term: PostSearchEntry.objects.filter(term=term)[:cap + 1].count() for term in terms}
+    rarest = min(terms, key=frequencies.get)
+    if not frequencies[rarest]:
+        return []
+    candidates = PostSearchEntry.objects.filter(term=rarest).order_by('-post_created_time', '-post_id') \
+        .values('post_id')[:cap]
+    rows = PostSearchEntry.objects.filter(term__in=terms, post_id__in=candidates).order_by().values('post_id') \
+        .annotate(score=Sum('weight'), matched=Count('term', distinct=True)).filter(matched=len(terms))
+    if position is not None:
+        rows = rows.filter(CustomPagination.seek_filter(('-score', '-post_id'), position))
+    return list(rows.order_by('-score', '-post_id').values_list('score', 'post_id')[:limit])
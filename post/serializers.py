@@ -1,27 +1,37 @@
+from django.conf import settings
+from django.core.files import File
 from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
 
+from shared.images import variant_urls
 from users.models import User
-from post.models import Post, PostLike, PostComment, CommentLike
+from post.models import Post, PostLike, PostComment, CommentLike, PostUpload, PostMention
 
 
 class UserSerializer(serializers.ModelSerializer):
     id = serializers.ReadOnlyField(read_only=True)
+    photo_variants = serializers.SerializerMethodField('get_photo_variants')
 
     class Meta:
         model = User
         fields = [
             'id',
             'username',
-            'photo'
+            'photo',
+            'photo_variants'
         ]
 
+    def get_photo_variants(self, obj):
+        return variant_urls(obj.photo, obj.photo_variants, self.context.get('request'))
+
 
 class PostSerializer(serializers.ModelSerializer):
     id = serializers.UUIDField(read_only=True)
     author = UserSerializer(read_only=True)
-    post_likes_count = serializers.SerializerMethodField('get_post_likes_count')
-    post_comments_count = serializers.SerializerMethodField('get_post_comments_count')
+    post_likes_count = serializers.IntegerField(source='likes_count', read_only=True)
+    post_comments_count = serializers.IntegerField(source='comments_count', read_only=True)
     me_liked = serializers.SerializerMethodField('get_me_liked')
+    image_variants = serializers.SerializerMethodField('get_image_variants')
 
     class Meta:
         model = Post
@@ -29,6 +39,7 @@ class PostSerializer(serializers.ModelSerializer):
             'id',
             'author',
             'image',
+            'image_variants',
             'description',
             'created_time',
             'post_likes_count',
@@ -39,30 +50,25 @@ class PostSerializer(serializers.ModelSerializer):
             'image': {'required': False},
         }
 
-    def get_post_likes_count(self, obj):
-        return obj.likes.count()
-
-    def get_post_comments_count(self, obj):
-        return obj.comments.count()
-
     def get_me_liked(self, obj):
+        if hasattr(obj, 'me_liked'):
+            return obj.me_liked
         request = self.context.get('request', None)
         if request and request.user.is_authenticated:
-            try:
-                PostLike.objects.get(author=request.user, post=obj)
-                return True
-            except PostLike.DoesNotExist:
-                return False
+            return PostLike.objects.filter(author=request.user, post=obj).exists()
 
         return False
 
+    def get_image_variants(self, obj):
+        return variant_urls(obj.image, obj.image_variants, self.context.get('request'))
+
 
 class PostCommentSerializer(serializers.ModelSerializer):
     id = serializers.UUIDField(read_only=True)
     author = UserSerializer(read_only=True)
     post = serializers.PrimaryKeyRelatedField(queryset=Post.objects.all(), required=False)
     replies = serializers.SerializerMethodField('get_replies')
-    comment_likes_count = serializers.SerializerMethodField('get_comment_likes_count')
+    comment_likes_count = serializers.IntegerField(source='likes_count', read_only=True)
     me_liked = serializers.SerializerMethodField('get_me_liked')
 
 
@@ -81,15 +87,17 @@ class PostCommentSerializer(serializers.ModelSerializer):
         ]
 
     def get_replies(self, obj):
-        if obj.child.exists():
-            serializer = self.__class__(obj.child.all(), many=True, context=self.context)
+        replies = getattr(obj, 'tree_replies', None)
+        if replies is None and obj.replies_count:
+            replies = obj.child.all()
+        if replies:
+            serializer = self.__class__(replies, many=True, context=self.context)
             return serializer.data
         return None
 
-    def get_comment_likes_count(self, obj):
-        return obj.likes.count()
-
     def get_me_liked(self, obj):
+        if hasattr(obj, 'me_liked'):
+            return obj.me_liked
         user = self.context.get('request').user
         if user.is_authenticated:
             return obj.likes.filter(author=user).exists()
@@ -123,3 +131,56 @@ class CommentLikeSerializer(serializers.ModelSerializer):
 
 
 
+
+
+class PostMentionSerializer(serializers.ModelSerializer):
+    id = serializers.UUIDField(read_only=True)
+    author = UserSerializer(read_only=True)
+    post = PostSerializer(read_only=True)
+
+    class Meta:
+        model = PostMention
+        fields = [
+            'id',
+            'author',
+            'post',
+            'comment',
+            'created_time',
+        ]
+
+
+class PostUploadSerializer(serializers.ModelSerializer):
+    id = serializers.UUIDField(read_only=True)
+    sha256 = serializers.RegexField(r'^[0-9a-fA-F]{64}$', required=False)
+
+    class Meta:
+        model = PostUpload
+        fields = [
+            'id',
+            'filename',
+            'size',
+            'received',
+            'sha256',
+            'post',
+            'created_time',
+        ]
+        read_only_fields = ['received', 'post']
+
+    def validate_filename(self, filename):
+        for validator in Post._meta.get_field('image').validators:
+            validator(File(None, name=filename))
+        return filename
+
+    def validate_size(self, size):
+        if not 0 < size <= settings.UPLOAD_MAX_SIZE:
+            raise ValidationError(
+                {
+                    'success': False,
+                    'message': f"File size must be between 1 and {settings.UPLOAD_MAX_SIZE} bytes",
+                }
+            )
+        return size
+
+
+class PostUploadFinalizeSerializer(serializers.Serializer):
+    description = serializers.CharField(max_length=2000, required=False, allow_blank=True, default='')
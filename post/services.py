@@ -0,0 +1,130 @@
+from django.db import connection, transaction
+from django.utils import timezone
+
+from post.explore import record_comment, record_comment_like, record_post_like
+from post.like_buffer import get_like_buffer, write_behind_enabled
+from post.models import Post, PostComment, PostLike, CommentLike
+from post.search import index_comment
+from post.tags import extract_comment_tags, sync_post_hashtags
+
+
+def create_comment(serializer, **kwargs):
+    with transaction.atomic():
+        comment = serializer.save(**kwargs)
+        index_comment(comment)
+        extract_comment_tags(comment)
+        Post.objects.increment(comment.post_id, comments_count=1)
+        if comment.parent_id:
+            PostComment.objects.increment(comment.parent_id, replies_count=1)
+    record_comment(comment.post_id)
+    return comment
+
+
+def delete_comment(comment):
+    with transaction.atomic():
+        removed = 1 + comment.get_descendant_count()
+        comment.delete()
+        Post.objects.increment(comment.post_id, comments_count=-removed)
+        sync_post_hashtags(comment.post)
+        if comment.parent_id:
+            PostComment.objects.increment(comment.parent_id, replies_count=-1)
+
+
+def like_post(post_id, author):
+    """
+    Idempotently likes the post, returns the new PostLike or None when the like
+    already existed or the post does not exist. With LIKE_WRITE_BEHIND the like
+    is only recorded in the like buffer and written later by flush_like_buffer.
+    """
+    if write_behind_enabled():
+        like = get_like_buffer().like(post_id, author)
+    else:
+        like = _insert_like(PostLike, 'post', post_id, author)
+    if like is not None:
+        record_post_like(post_id, author)
+    return like
+
+
+def unlike_post(post_id, author):
+    if write_behind_enabled():
+        return get_like_buffer().unlike(post_id, author)
+    return _delete_like(PostLike, 'post', post_id, author)
+
+
+def like_comment(comment_id, author):
+    like = _insert_like(CommentLike, 'comment', comment_id, author)
+    if like is not None:
+        record_comment_like(comment_id, author)
+    return like
+
+
+def unlike_comment(comment_id, author):
+    return _delete_like(CommentLike, 'comment', comment_id, author)
+
+
+def _insert_like(model, target_field, target_id, author):
+    """
+    INSERT ... SELECT ... ON CONFLICT DO NOTHING, so a double tap never raises
+    on the unique constraint and a missing target inserts nothing. On PostgreSQL
+    the counter update rides along in the same statement.
+    """
+    like = model(author=author, **{f'{target_field}_id': target_id})
+    like.created_time = like.updated_time = timezone.now()
+    target = model._meta.get_field(target_field).related_model
+    qn = connection.ops.quote_name
+    fields = [model._meta.pk, model._meta.get_field('created_time'), model._meta.get_field('updated_time'),
+              model._meta.get_field('author')]
+    params = [field.get_db_prep_save(field.value_from_object(like), connection) for field in fields]
+    target_pk = target._meta.pk
+    params.append(target_pk.get_db_prep_value(target_pk.to_python(target_id), connection))
+    sql = (
+        f"INSERT INTO {qn(model._meta.db_table)} "
+        f"({', '.join(qn(field.column) for field in fields)}, {qn(model._meta.get_field(target_field).column)}) "
+        f"SELECT %s, %s, %s, %s, {qn(target_pk.column)} FROM {qn(target._meta.db_table)} "
+        f"WHERE {qn(target_pk.column)} = %s ON CONFLICT DO NOTHING"
+    )
+    counter = f"{qn('likes_count')} = {qn('likes_count')} + 1, {qn('updated_time')} = NOW()"
+    with transaction.atomic(), connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                f"WITH inserted AS ({sql} RETURNING 1) UPDATE {qn(target._meta.db_table)} SET {counter} "
+                f"WHERE {qn(target_pk.column)} = %s AND EXISTS (SELECT 1 FROM inserted)",
+                params + [params[-1]]
+            )
+            created = cursor.rowcount
+        else:
+            cursor.execute(sql, params)
+            created = cursor.rowcount
+            if created:
+                target.objects.increment(target_id, likes_count=1)
+    return like if created else None
+
+
+def _delete_like(model, target_field, target_id, author):
+    """
+    Single conditional DELETE, returns whether a like was removed.
+    """
+    target = model._meta.get_field(target_field).related_model
+    qn = connection.ops.quote_name
+    if connection.vendor == 'postgresql':
+        target_pk = target._meta.pk
+        author_field = model._meta.get_field('author')
+        target_column = model._meta.get_field(target_field).column
+        params = [
+            target_pk.get_db_prep_value(target_pk.to_python(target_id), connection),
+            author_field.get_db_prep_value(author.pk, connection),
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"WITH deleted AS (DELETE FROM {qn(model._meta.db_table)} "
+                f"WHERE {qn(target_column)} = %s AND {qn(author_field.column)} = %s RETURNING {qn(target_column)}) "
+                f"UPDATE {qn(target._meta.db_table)} SET {qn('likes_count')} = GREATEST({qn('likes_count')} - 1, 0), {qn('updated_time')} = NOW() "
+                f"WHERE {qn(target_pk.column)} IN (SELECT {qn(target_column)} FROM deleted)",
+                params
+            )
+            return bool(cursor.rowcount)
+    with transaction.atomic():
+        deleted, _ = model.objects.filter(author=author, **{f'{target_field}_id': target_id}).delete()
+        if deleted:
+            target.objects.increment(target_id, likes_count=-deleted)
+    return bool(deleted)
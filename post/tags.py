@@ -0,0 +1,174 @@
+import re
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Case, F, FloatField, Sum, When
+from django.utils import timezone
+
+from post.models import Hashtag, HashtagCount, PostHashtag, PostMention
+from users.models import User
+
+HASHTAG_MAX_LENGTH = Hashtag._meta.get_field('name').max_length
+TRENDING_CACHE_KEY = 'trending-hashtags'
+hashtag_regex = re.compile(r'(?<![\w#])#(\w+)')
+mention_regex = re.compile(r'(?<![\w@])@([A-Za-z][\w-]*\w)')
+
+
+def parse_hashtags(text):
+    """
+    Case-folded hashtags of `text` in order of first use, longer ones are ignored.
+    """
+    names = (name.casefold() for name in hashtag_regex.findall(text))
+    return list(dict.fromkeys(name for name in names if len(name) <= HASHTAG_MAX_LENGTH))
+
+
+def parse_mentions(text):
+    return list(dict.fromkeys(mention_regex.findall(text)))
+
+
+def get_hashtags(names):
+    """
+    Maps each name to its Hashtag id, creating the missing ones.
+    """
+    hashtags = dict(Hashtag.objects.filter(name__in=names).values_list('name', 'pk'))
+    missing = [name for name in names if name not in hashtags]
+    if missing:
+        Hashtag.objects.bulk_create([Hashtag(name=name) for name in missing], ignore_conflicts=True)
+        hashtags.update(Hashtag.objects.filter(name__in=missing).values_list('name', 'pk'))
+    return hashtags
+
+
+def link_hashtags(post, hashtag_ids):
+    PostHashtag.objects.bulk_create([
+        PostHashtag(hashtag_id=hashtag_id, post_id=post.pk, post_created_time=post.created_time)
+        for hashtag_id in hashtag_ids
+    ], ignore_conflicts=True)
+
+
+def sync_post_hashtags(post, count=True):
+    """
+    Links the post to the hashtags of its description and comments and unlinks
+    the rest. Newly linked hashtags count as used unless `count` is false.
+    """
+    names = parse_hashtags(post.description)
+    for text in post.comments.filter(comment__contains='#').values_list('comment', flat=True):
+        names += parse_hashtags(text)
+    wanted = set(get_hashtags(list(dict.fromkeys(names))).values())
+    linked = set(PostHashtag.objects.filter(post_id=post.pk).values_list('hashtag_id', flat=True))
+    if linked - wanted:
+        PostHashtag.objects.filter(post_id=post.pk, hashtag_id__in=linked - wanted).delete()
+    link_hashtags(post, wanted - linked)
+    if count:
+        count_uses(wanted - linked)
+
+
+def sync_post_mentions(post):
+    mentioned = set(User.objects.filter(username__in=parse_mentions(post.description)).values_list('pk', flat=True))
+    existing = PostMention.objects.filter(post_id=post.pk, comment__isnull=True)
+    recorded = set(existing.values_list('user_id', flat=True))
+    if recorded - mentioned:
+        existing.filter(user_id__in=recorded - mentioned).delete()
+    PostMention.objects.bulk_create([
+        PostMention(user_id=user_id, author_id=post.author_id, post_id=post.pk) for user_id in mentioned - recorded
+    ])
+
+
+def extract_post_tags(post, count=True):
+    """
+    Indexes the hashtags and mentions of the post's description, call it whenever
+    the description is written.
+    """
+    sync_post_hashtags(post, count)
+    sync_post_mentions(post)
+
+
+def extract_comment_tags(comment):
+    # mentions of a deleted comment go with it, its hashtags are unlinked by sync_post_hashtags()
+    names = parse_hashtags(comment.comment)
+    if names:
+        hashtag_ids = list(get_hashtags(names).values())
+        link_hashtags(comment.post, hashtag_ids)
+        count_uses(hashtag_ids)
+    mentioned = User.objects.filter(username__in=parse_mentions(comment.comment)).values_list('pk', flat=True)
+    PostMention.objects.bulk_create([
+        PostMention(user_id=user_id, author_id=comment.author_id, post_id=comment.post_id, comment_id=comment.pk)
+        for user_id in mentioned
+    ])
+
+
+def bucket_start(moment):
+    size = settings.TRENDING_BUCKET_SECONDS
+    return datetime.fromtimestamp(int(moment.timestamp()) // size * size, tz=dt_timezone.utc)
+
+
+def count_uses(hashtag_ids, now=None):
+    """
+    Adds one use of each hashtag to the current bucket with a single upsert.
+    """
+    if not hashtag_ids:
+        return
+    now = now or timezone.now()
+    bucket = bucket_start(now)
+    opts = HashtagCount._meta
+    fields = [opts.pk] + [opts.get_field(name) for name in ('created_time', 'updated_time', 'hashtag', 'bucket',
+                                                             'count')]
+    params = []
+    # sorted, so concurrent upserts take the row locks in the same order
+    for hashtag_id in sorted(hashtag_ids):
+        counter = HashtagCount(hashtag_id=hashtag_id, bucket=bucket, count=1, created_time=now, updated_time=now)
+        params += [field.get_db_prep_save(field.value_from_object(counter), connection) for field in fields]
+    qn = connection.ops.quote_name
+    row = f"({', '.join(['%s'] * len(fields))})"
+    count = qn(opts.get_field('count').column)
+    updated_time = qn(opts.get_field('updated_time').column)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {qn(opts.db_table)} ({', '.join(qn(field.column) for field in fields)}) "
+            f"VALUES {', '.join([row] * len(hashtag_ids))} "
+            f"ON CONFLICT ({qn(opts.get_field('hashtag').column)}, {qn(opts.get_field('bucket').column)}) "
+            f"DO UPDATE SET {count} = {qn(opts.db_table)}.{count} + EXCLUDED.{count}, "
+            f"{updated_time} = EXCLUDED.{updated_time}",
+            params
+        )
+
+
+def window_start(now):
+    """
+    Start of the oldest bucket that still overlaps the trending window, and the
+    share of it that does.
+    """
+    size = settings.TRENDING_BUCKET_SECONDS
+    current = bucket_start(now)
+    overlap = 1 - (now - current).total_seconds() / size
+    return current - timedelta(seconds=size * settings.TRENDING_WINDOW_BUCKETS), overlap
+
+
+def trending_hashtags(now=None):
+    """
+    The TRENDING_LIMIT hashtags used most in the last TRENDING_WINDOW_BUCKETS
+    buckets, as (name, uses) pairs. Like the throttles' sliding window, the
+    oldest bucket counts for the share of it still inside the window, so the
+    ranking moves smoothly instead of jumping when a bucket expires. The result
+    is cached for TRENDING_CACHE_SECONDS.
+    """
+    if now is None:
+        trending = cache.get(TRENDING_CACHE_KEY)
+        if trending is not None:
+            return trending
+    oldest, overlap = window_start(now or timezone.now())
+    rows = HashtagCount.objects.filter(bucket__gte=oldest).values('hashtag__name').annotate(
+        uses=Sum(Case(When(bucket=oldest, then=F('count') * overlap), default=F('count'), output_field=FloatField()))
+    ).order_by('-uses', 'hashtag__name')
+    trending = [(row['hashtag__name'], round(row['uses'])) for row in rows[:settings.TRENDING_LIMIT]]
+    trending = [(name, uses) for name, uses in trending if uses]
+    if now is None:
+        cache.set(TRENDING_CACHE_KEY, trending, timeout=settings.TRENDING_CACHE_SECONDS)
+    return trending
+
+
+def purge_hashtag_counts(now=None):
+    oldest, _ = window_start(now or timezone.now())
+    deleted, _ = HashtagCount.objects.filter(bucket__lt=oldest).delete()
+    return deleted
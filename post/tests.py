@@ -1,3 +1,946 @@
-from django.test import TestCase
+import datetime
+import hashlib
+import shutil
+import tempfile
+import threading
+import time
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.urls import reverse
+from PIL import Image
+from rest_framework.test import APIClient, APITestCase
+
+from post.models import Post, PostComment, PostLike, CommentLike, PostUpload, TimelineEntry, PostSearchEntry, \
+    Hashtag, HashtagCount, PostHashtag, PostMention, PostScore
+from post.explore import record_engagement
+from post.like_buffer import LikeBuffer, check_like_buffer_cache
+from post.search import index_post
+from post.tags import count_uses, trending_hashtags, purge_hashtag_counts
+from post.uploads import staging_path
+from shared.images import generate_variants
+from shared.models import StoredFile
+from shared.storage import ContentAddressedStorage
+from users.models import User, DONE
+
+
+class PostReadQueryCountTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author', password='password-author', auth_status=DONE)
+        cls.reader = User.objects.create(username='reader', password='password-reader', auth_status=DONE)
+        for i in range(15):
+            post = Post.objects.create(author=cls.author, image='posts_images/test.jpg', description=f'post {i}')
+            PostComment.objects.create(author=cls.reader, post=post, comment='nice')
+            if i % 2:
+                PostLike.objects.create(author=cls.reader, post=post)
+        cls.post = post
+        call_command('reconcile_counters', stdout=StringIO())
+
+    def test_post_list_query_count_is_constant(self):
+        self.client.force_authenticate(self.reader)
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('post_list'), {'page_size': 5})
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('post_list'), {'page_size': 15})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 15)
+        liked = sum(1 for post in response.data['results'] if post['me_liked'])
+        self.assertEqual(liked, 7)
+        for post in response.data['results']:
+            self.assertEqual(post['post_likes_count'], int(post['me_liked']))
+            self.assertEqual(post['post_comments_count'], 1)
+            self.assertEqual(post['author']['username'], 'author')
+
+    def test_post_detail_query_count(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('post_detail', kwargs={'pk': self.post.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['post_likes_count'], 0)
+        self.assertFalse(response.data['me_liked'])
+
+
+class EngagementCounterTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author', password='password-author', auth_status=DONE)
+        cls.post = Post.objects.create(author=cls.author, image='posts_images/test.jpg', description='post')
+
+    def setUp(self):
+        self.client.force_authenticate(self.author)
+
+    def test_like_toggle_updates_counter(self):
+        url = reverse('post_like_create_delete', kwargs={'pk': self.post.pk})
+        self.client.post(url)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 1)
+        self.client.post(url)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 0)
+
+    def test_comment_create_and_delete_update_counters(self):
+        url = reverse('post_comment_create', kwargs={'pk': self.post.pk})
+        root = self.client.post(url, {'comment': 'root'}).data
+        self.client.post(url, {'comment': 'reply', 'parent': root['id']})
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 2)
+        self.assertEqual(PostComment.objects.get(pk=root['id']).replies_count, 1)
+
+        self.client.delete(reverse('comment_detail_delete', kwargs={'pk': root['id']}))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 0)
+
+    def test_reconcile_counters_fixes_drift(self):
+        Post.objects.filter(pk=self.post.pk).update(likes_count=42, comments_count=7)
+        call_command('reconcile_counters', batch_size=1, stdout=StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.likes_count, self.post.comments_count), (0, 0))
+
+
+class CommentTreeTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author', password='password-author', auth_status=DONE)
+        cls.post = Post.objects.create(author=cls.author, image='posts_images/test.jpg', description='post')
+        for i in range(3):
+            root = PostComment.objects.create(author=cls.author, post=cls.post, comment=f'root {i}')
+            parent = root
+            for depth in range(4):
+                parent = PostComment.objects.create(author=cls.author, post=cls.post, comment='reply', parent=parent)
+        call_command('reconcile_counters', stdout=StringIO())
+        cls.root = root
+
+    def test_thread_is_loaded_with_constant_queries(self):
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('post_comments', kwargs={'pk': self.post.pk}))
+        self.assertEqual(response.data['count'], 3)
+        depth = 0
+        node = response.data['results'][0]
+        while node['replies']:
+            self.assertEqual(len(node['replies']), 1)
+            node = node['replies'][0]
+            depth += 1
+        self.assertEqual(depth, 4)
+
+    def test_replies_get_thread_root(self):
+        reply = PostComment.objects.filter(root=self.root).order_by('created_time').last()
+        self.assertEqual(reply.root_id, self.root.pk)
+        self.assertEqual(self.root.get_descendant_count(), 4)
+        self.assertEqual(reply.parent.get_descendant_count(), 1)
+
+    def test_reply_loads_only_its_subtree(self):
+        first, second = PostComment.objects.filter(root=self.root).order_by('created_time')[:2]
+        branch = PostComment.objects.create(author=self.author, post=self.post, comment='branch', parent=first)
+        subtree = PostComment.objects.filter(root=self.root).exclude(pk__in=[first.pk, branch.pk])
+        self.assertEqual({comment.pk for comment in PostComment.objects.descendants_of([second])},
+                         {comment.pk for comment in subtree.exclude(pk=second.pk)})
+
+        response = self.client.get(reverse('comment_detail_delete', kwargs={'pk': first.pk}))
+        self.assertEqual(sorted(reply['comment'] for reply in response.data['replies']), ['branch', 'reply'])
+        response = self.client.get(reverse('comment_detail_delete', kwargs={'pk': second.pk}))
+        self.assertEqual(len(response.data['replies']), 1)
+
+
+@override_settings(PAGINATION_MODE='cursor')
+class CursorPaginationTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author', password='password-author', auth_status=DONE)
+        posts = [
+            Post.objects.create(author=cls.author, image='posts_images/test.jpg', description=f'post {i}')
+            for i in range(7)
+        ]
+        # force timestamp ties so the id tie-breaker is exercised
+        Post.objects.filter(pk__in=[post.pk for post in posts[:4]]).update(created_time=posts[0].created_time)
+        cls.expected = list(Post.objects.order_by('-created_time', '-id').values_list('id', flat=True))
+
+    def test_walk_forward_and_back(self):
+        url = reverse('post_list')
+        seen = []
+        pages = []
+        response = self.client.get(url, {'page_size': 3})
+        while True:
+            self.assertNotIn('count', response.data)
+            pages.append(response.data)
+            seen.extend(post['id'] for post in response.data['results'])
+            if not response.data['next']:
+                break
+            with self.assertNumQueries(2):
+                response = self.client.get(response.data['next'])
+        self.assertEqual([str(pk) for pk in self.expected], seen)
+        self.assertEqual(len(pages), 3)
+        self.assertIsNone(pages[0]['previous'])
+
+        response = self.client.get(pages[-1]['previous'])
+        self.assertEqual(response.data['results'], pages[1]['results'])
+        response = self.client.get(response.data['previous'])
+        self.assertEqual(response.data['results'], pages[0]['results'])
+        self.assertIsNone(response.data['previous'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('post_list'), {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+
+
+class ConditionalGetTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author', password='password-author', auth_status=DONE)
+        cls.reader = User.objects.create(username='reader', password='password-reader', auth_status=DONE)
+        cls.post = Post.objects.create(author=cls.author, image='posts_images/test.jpg', description='post')
+        cls.comment = PostComment.objects.create(author=cls.author, post=cls.post, comment='comment')
+
+    def setUp(self):
+        self.client.force_authenticate(self.reader)
+
+    def test_detail_not_modified(self):
+        url = reverse('post_detail', kwargs={'pk': self.post.pk})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+        self.client.put(reverse('post_like_create_delete', kwargs={'pk': self.post.pk}))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertTrue(response.data['me_liked'])
+
+    def test_etag_depends_on_user(self):
+        url = reverse('post_detail', kwargs={'pk': self.post.pk})
+        etag = self.client.get(url)['ETag']
+        self.client.force_authenticate(self.author)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_list_not_modified(self):
+        url = reverse('post_list')
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(2):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(response.has_header('Last-Modified'))
+
+        Post.objects.create(author=self.author, image='posts_images/test.jpg', description='new')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_comment_list_not_modified(self):
+        url = reverse('post_comments', kwargs={'pk': self.post.pk})
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.client.put(reverse('comment_like_create_delete', kwargs={'pk': self.comment.pk}))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        etag = self.client.get(url)['ETag']
+        self.client.post(reverse('post_comment_create', kwargs={'pk': self.post.pk}),
+                         {'comment': 'reply', 'parent': self.comment.pk})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results'][0]['replies']), 1)
+
+
+class IdempotentLikeTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author', password='password-author', auth_status=DONE)
+        cls.post = Post.objects.create(author=cls.author, image='posts_images/test.jpg', description='post')
+        cls.comment = PostComment.objects.create(author=cls.author, post=cls.post, comment='comment')
+
+    def setUp(self):
+        self.client.force_authenticate(self.author)
+
+    def test_put_and_delete_are_idempotent(self):
+        url = reverse('post_like_create_delete', kwargs={'pk': self.post.pk})
+        self.assertEqual(self.client.put(url).status_code, 201)
+        self.assertEqual(self.client.put(url).status_code, 200)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 1)
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 0)
+
+    def test_comment_like(self):
+        url = reverse('comment_like_create_delete', kwargs={'pk': self.comment.pk})
+        response = self.client.put(url)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['data']['comment'], self.comment.pk)
+        self.comment.refresh_from_db()
+        self.assertEqual(self.comment.likes_count, 1)
+
+    def test_missing_target_is_404(self):
+        post = Post(pk=self.comment.pk)
+        url = reverse('post_like_create_delete', kwargs={'pk': post.pk})
+        self.assertEqual(self.client.put(url).status_code, 404)
+        self.assertEqual(self.client.delete(url).status_code, 404)
+        self.assertEqual(self.client.post(url).status_code, 404)
+
+
+@skipUnlessDBFeature('test_db_allows_multiple_connections')
+class ConcurrentLikeTest(TransactionTestCase):
+
+    def test_parallel_likes_do_not_error(self):
+        author = User.objects.create(username='author', password='password-author', auth_status=DONE)
+        users = [
+            User.objects.create(username=f'liker{i}', password=f'password-{i}', auth_status=DONE)
+            for i in range(4)
+        ]
+        post = Post.objects.create(author=author, image='posts_images/test.jpg', description='post')
+        url = reverse('post_like_create_delete', kwargs={'pk': post.pk})
+        statuses = []
+        errors = []
+        barrier = threading.Barrier(len(users) * 4)
+
+        def like(user):
+            client = APIClient()
+            client.force_authenticate(user)
+            try:
+                barrier.wait()
+                for _ in range(5):
+                    statuses.append(client.put(url).status_code)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=like, args=(user,)) for user in users for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(set(statuses), {200, 201})
+        self.assertEqual(statuses.count(201), len(users))
+        post.refresh_from_db()
+        self.assertEqual(post.likes_count, len(users))
+        self.assertEqual(PostLike.objects.filter(post=post).count(), len(users))
+
+
+@override_settings(LIKE_WRITE_BEHIND=True)
+class WriteBehindLikeTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author', password='password-author', auth_status=DONE)
+        cls.reader = User.objects.create(username='reader', password='password-reader', auth_status=DONE)
+        cls.post = Post.objects.create(author=cls.author, image='posts_images/test.jpg', description='post')
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('post_like_create_delete', kwargs={'pk': self.post.pk})
+        self.detail_url = reverse('post_detail', kwargs={'pk': self.post.pk})
+
+    def test_likes_are_buffered_and_merged_into_reads(self):
+        self.client.force_authenticate(self.reader)
+        response = self.client.put(self.url)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.client.put(self.url).status_code, 200)
+        self.client.force_authenticate(self.author)
+        self.client.put(self.url)
+        self.assertFalse(PostLike.objects.exists())
+
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response.data['post_likes_count'], 2)
+        self.assertTrue(response.data['me_liked'])
+
+        call_command('flush_like_buffer', stdout=StringIO())
+        self.assertEqual(PostLike.objects.filter(post=self.post).count(), 2)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 2)
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response.data['post_likes_count'], 2)
+        self.assertTrue(response.data['me_liked'])
+
+    def test_unlike_of_flushed_like(self):
+        self.client.force_authenticate(self.reader)
+        like_id = self.client.put(self.url).data['data']['id']
+        call_command('flush_like_buffer', stdout=StringIO())
+        self.assertTrue(PostLike.objects.filter(pk=like_id).exists())
+
+        self.assertEqual(self.client.delete(self.url).status_code, 204)
+        response = self.client.get(self.detail_url)
+        self.assertEqual(response.data['post_likes_count'], 0)
+        self.assertFalse(response.data['me_liked'])
+        self.assertTrue(PostLike.objects.exists())
+
+        call_command('flush_like_buffer', stdout=StringIO())
+        self.assertFalse(PostLike.objects.exists())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 0)
+
+    def test_concurrent_toggles_keep_the_count(self):
+        buffer = LikeBuffer()
+        buffer.record(self.post.pk, self.reader.pk, True, buffer.like(self.post.pk, self.reader))
+        get = buffer.cache.get
+
+        def slow_get(key, *args, **kwargs):
+            # widen the window between reading a state and replacing it
+            value = get(key, *args, **kwargs)
+            time.sleep(0.001)
+            return value
+
+        def toggle(liked):
+            for _ in range(20):
+                buffer.record(self.post.pk, self.reader.pk, liked)
+
+        threads = [threading.Thread(target=toggle, args=(i % 2 == 0,)) for i in range(4)]
+        with mock.patch.object(buffer.cache, 'get', slow_get):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        state = cache.get(buffer.state_key(self.post.pk, self.reader.pk))
+        self.assertEqual(cache.get(buffer.delta_key(self.post.pk)), 1 if state[0] else 0)
+
+    def test_evicted_delta_does_not_stop_the_flush(self):
+        self.client.force_authenticate(self.reader)
+        self.client.put(self.url)
+        buffer = LikeBuffer()
+        with mock.patch.object(buffer.cache, 'decr', side_effect=ValueError):
+            self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(PostLike.objects.filter(post=self.post).count(), 1)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_count, 1)
+
+    def test_per_process_cache_is_refused(self):
+        self.assertEqual([error.id for error in check_like_buffer_cache()], ['post.E001'])
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}
+        with override_settings(CACHES=shared):
+            self.assertEqual(check_like_buffer_cache(), [])
+        with override_settings(LIKE_WRITE_BEHIND=False):
+            self.assertEqual(check_like_buffer_cache(), [])
+
+    def test_missing_op_is_skipped_by_one_shot_flushes(self):
+        self.client.force_authenticate(self.reader)
+        buffer = LikeBuffer()
+        # a writer died between allocating its seq and writing the op
+        buffer.incr(buffer.seq_key, 1)
+        self.client.put(self.url)
+        self.assertEqual(LikeBuffer().flush(), 0)
+        with mock.patch.object(LikeBuffer, 'stall_timeout', 0):
+            self.assertEqual(LikeBuffer().flush(), 2)
+        self.assertTrue(PostLike.objects.filter(post=self.post, author=self.reader).exists())
+
+
+class HomeFeedTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create(username='reader', password='password-reader', auth_status=DONE)
+        cls.friend = User.objects.create(username='friend', password='password-friend', auth_status=DONE)
+        cls.star = User.objects.create(username='star', password='password-star', auth_status=DONE)
+        cls.stranger = User.objects.create(username='stranger', password='password-stranger', auth_status=DONE)
+        cls.old_post = Post.objects.create(author=cls.friend, image='posts_images/test.jpg', description='old')
+
+    def create_post(self, user, description):
+        self.client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('post_create'), {'description': description})
+
+    def follow(self, user, other):
+        self.client.force_authenticate(user)
+        return self.client.put(reverse('user_follow', kwargs={'pk': other.pk}))
+
+    @override_settings(FANOUT_MAX_FOLLOWERS=1)
+    def test_feed_merges_pushed_and_pulled_posts(self):
+        self.assertEqual(self.follow(self.reader, self.friend).status_code, 201)
+        self.assertEqual(self.follow(self.reader, self.friend).status_code, 200)
+        self.follow(self.reader, self.star)
+        self.follow(self.stranger, self.star)
+        self.star.refresh_from_db()
+        self.assertEqual(self.star.followers_count, 2)
+
+        for i in range(3):
+            self.create_post(self.friend, f'friend {i}')
+            self.create_post(self.star, f'star {i}')
+            self.create_post(self.stranger, f'stranger {i}')
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.reader, post_author=self.star).exists())
+
+        self.client.force_authenticate(self.reader)
+        descriptions = []
+        response = self.client.get(reverse('post_feed'), {'page_size': 4})
+        while True:
+            descriptions += [post['description'] for post in response.data['results']]
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(descriptions, [
+            'star 2', 'friend 2', 'star 1', 'friend 1', 'star 0', 'friend 0', 'old'
+        ])
+
+    def test_unfollow_removes_posts_from_feed(self):
+        self.follow(self.reader, self.friend)
+        self.client.force_authenticate(self.reader)
+        self.assertEqual(len(self.client.get(reverse('post_feed')).data['results']), 1)
+        self.assertEqual(self.client.delete(reverse('user_follow', kwargs={'pk': self.friend.pk})).status_code, 204)
+        self.assertEqual(self.client.get(reverse('post_feed')).data['results'], [])
+        self.friend.refresh_from_db()
+        self.assertEqual(self.friend.followers_count, 0)
+
+
+@override_settings(IMAGE_WORKERS=0)
+class ImageVariantTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author', password='password-author', auth_status=DONE)
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.client.force_authenticate(self.author)
+
+    @staticmethod
+    def upload(name='photo.jpg'):
+        image = Image.new('RGB', (400, 200), 'red')
+        exif = image.getexif()
+        # rotated 90 degrees clockwise by the camera
+        exif[0x0112] = 6
+        output = BytesIO()
+        image.save(output, format='JPEG', exif=exif)
+        return SimpleUploadedFile(name, output.getvalue(), content_type='image/jpeg')
+
+    def test_variants_are_rendered_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('post_create'), {'description': 'post', 'image': self.upload()})
+        post = Post.objects.get(pk=response.data['id'])
+        self.assertEqual(set(post.image_variants), {'thumbnail', 'feed', 'full'})
+
+        with post.image.storage.open(post.image_variants['thumbnail']) as file, Image.open(file) as thumbnail:
+            self.assertEqual(thumbnail.format, 'WEBP')
+            self.assertEqual(thumbnail.size, (75, 150))
+            self.assertFalse(thumbnail.getexif())
+
+        response = self.client.get(reverse('post_detail', kwargs={'pk': post.pk}))
+        self.assertTrue(response.data['image_variants']['feed'].endswith('.webp'))
+
+    def test_original_is_the_fallback(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            response = self.client.post(reverse('post_create'), {'description': 'post', 'image': self.upload()})
+        self.assertEqual(set(response.data['image_variants'].values()), {response.data['image']})
+
+        url = reverse('post_detail', kwargs={'pk': response.data['id']})
+        etag = self.client.get(url)['ETag']
+        generate_variants(Post.objects.get(pk=response.data['id']), 'image', 'image_variants')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['image_variants']['feed'].endswith('.webp'))
+
+
+@override_settings(IMAGE_WORKERS=0)
+class ResumableUploadTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author', password='password-author', auth_status=DONE)
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root, UPLOAD_STAGING_DIR=f'{media_root}/staging')
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.client.force_authenticate(self.author)
+        output = BytesIO()
+        Image.new('RGB', (300, 300), 'blue').save(output, format='PNG')
+        self.content = output.getvalue()
+
+    def put_range(self, upload, start, end):
+        return self.client.put(
+            reverse('post_upload', kwargs={'pk': upload['id']}), self.content[start:end + 1],
+            content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {start}-{end}/{len(self.content)}',
+        )
+
+    def test_upload_in_ranges_and_finalize(self):
+        upload = self.client.post(reverse('post_upload_create'), {
+            'filename': 'photo.png', 'size': len(self.content),
+            'sha256': hashlib.sha256(self.content).hexdigest(),
+        }).data
+        middle = len(self.content) // 2
+        self.assertEqual(self.put_range(upload, 0, middle).data['received'], middle + 1)
+        # a retried, overlapping range
+        response = self.put_range(upload, 10, len(self.content) - 1)
+        self.assertEqual(response.data['received'], len(self.content))
+        self.assertEqual(response['Range'], f'bytes=0-{len(self.content) - 1}')
+
+        finalize_url = reverse('post_upload_finalize', kwargs={'pk': upload['id']})
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(finalize_url, {'description': 'uploaded'})
+        self.assertEqual(response.status_code, 201)
+        post = Post.objects.get(pk=response.data['id'])
+        with post.image.open('rb') as image:
+            self.assertEqual(image.read(), self.content)
+        self.assertTrue(post.image_variants)
+        self.assertFalse(staging_path(PostUpload(pk=upload['id'])).exists())
+        self.assertEqual(self.client.post(finalize_url).data['id'], str(post.pk))
+
+    def test_gaps_and_incomplete_uploads_are_rejected(self):
+        upload = self.client.post(reverse('post_upload_create'), {
+            'filename': 'photo.png', 'size': len(self.content),
+        }).data
+        self.assertEqual(self.put_range(upload, 5, 10).status_code, 400)
+        self.put_range(upload, 0, 10)
+        response = self.client.post(reverse('post_upload_finalize', kwargs={'pk': upload['id']}))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(reverse('post_upload', kwargs={'pk': upload['id']})).data['received'], 11)
+
+    def test_extension_is_checked_up_front(self):
+        response = self.client.post(reverse('post_upload_create'), {'filename': 'movie.mp4', 'size': 10})
+        self.assertEqual(response.status_code, 400)
+
+
+class MediaStorageTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author', password='password-author', auth_status=DONE)
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_migrate_media_moves_legacy_files(self):
+        legacy = FileSystemStorage().save('posts_images/legacy.jpg', ContentFile(b'legacy image'))
+        post = Post.objects.create(author=self.author, image=legacy, description='post')
+        repost = Post.objects.create(author=self.author, image=legacy, description='repost')
+        User.objects.filter(pk=self.author.pk).update(photo='users_photos/missing.jpg')
+
+        out = StringIO()
+        call_command('migrate_media', batch_size=1, stdout=out)
+        self.assertIn('Posts migrated: 2', out.getvalue())
+        self.assertIn('missing files: 1', out.getvalue())
+        post.refresh_from_db()
+        repost.refresh_from_db()
+        self.assertTrue(ContentAddressedStorage.is_hashed_name(post.image.name))
+        self.assertEqual(post.image.name, repost.image.name)
+        with post.image.open('rb') as image:
+            self.assertEqual(image.read(), b'legacy image')
+        self.assertEqual(StoredFile.objects.get(name=post.image.name).refcount, 2)
+        self.assertFalse(FileSystemStorage().exists(legacy))
+
+    def test_deleting_posts_releases_shared_files(self):
+        image = ContentFile(b'shared image', name='photo.jpg')
+        posts = []
+        for _ in range(2):
+            with self.captureOnCommitCallbacks(execute=True):
+                posts.append(Post.objects.create(author=self.author, image=image, description='post'))
+        self.assertEqual(posts[0].image.name, posts[1].image.name)
+        with self.captureOnCommitCallbacks(execute=True):
+            posts[0].delete()
+        self.assertTrue(posts[1].image.storage.exists(posts[1].image.name))
+        with self.captureOnCommitCallbacks(execute=True):
+            posts[1].delete()
+        self.assertFalse(posts[1].image.storage.exists(posts[1].image.name))
+
+
+class AsyncReadTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author', password='password-author', auth_status=DONE)
+        cls.reader = User.objects.create(username='reader', password='password-reader', auth_status=DONE)
+        for i in range(12):
+            post = Post.objects.create(author=cls.author, image='posts_images/test.jpg', description=f'post {i}')
+            if i % 3 == 0:
+                PostLike.objects.create(author=cls.reader, post=post)
+        cls.post = post
+        PostLike.objects.create(author=cls.reader, post=post)
+        root = PostComment.objects.create(author=cls.author, post=post, comment='root')
+        reply = PostComment.objects.create(author=cls.reader, post=post, comment='reply', parent=root)
+        CommentLike.objects.create(author=cls.author, comment=reply)
+        call_command('reconcile_counters', stdout=StringIO())
+        cls.root = root
+
+    def setUp(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.reader.token()['access']}")
+
+    def assertSameResponse(self, name, async_name, params=None, **kwargs):
+        expected = self.client.get(reverse(name, kwargs=kwargs), params)
+        response = self.client.get(reverse(async_name, kwargs=kwargs), params)
+        self.assertEqual(response.status_code, 200)
+        data, expected = response.json(), expected.json()
+        # links point at the endpoint that was called
+        for link in ('next', 'previous'):
+            if link in expected:
+                self.assertEqual(bool(data.pop(link)), bool(expected.pop(link)))
+        self.assertEqual(data, expected)
+        return data
+
+    def test_reads_match_the_sync_views(self):
+        data = self.assertSameResponse('post_list', 'post_list_async', {'page_size': 5, 'page': 2})
+        self.assertEqual(data['count'], 12)
+        with override_settings(PAGINATION_MODE='cursor'):
+            data = self.assertSameResponse('post_list', 'post_list_async', {'page_size': 5})
+        self.assertNotIn('count', data)
+        data = self.assertSameResponse('post_detail', 'post_detail_async', pk=self.post.pk)
+        self.assertTrue(data['me_liked'])
+        data = self.assertSameResponse('post_comments', 'post_comments_async', pk=self.post.pk)
+        self.assertEqual(data['results'][0]['replies'][0]['comment_likes_count'], 1)
+        self.assertSameResponse('post_like_list', 'post_like_list_async', pk=self.post.pk)
+        reply = self.root.child.get()
+        self.assertSameResponse('comment_like_list', 'comment_like_list_async', pk=reply.pk)
+
+    def test_errors(self):
+        response = self.client.get(reverse('post_detail_async', kwargs={'pk': self.author.pk}))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()['detail'], "No Post matches the given query.")
+        self.assertEqual(self.client.get(reverse('post_list_async'), {'page': 9}).status_code, 404)
+        self.client.credentials(HTTP_AUTHORIZATION="Bearer broken")
+        self.assertEqual(self.client.get(reverse('post_list_async')).status_code, 401)
+
+
+class PostSearchTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='searcher', password='password-searcher', auth_status=DONE)
+        cls.posts = {}
+        for name, description in [
+            ('sunset', 'Sunset over the beach, #sunset'),
+            ('beach', 'A day at the beach'),
+            ('city', 'City lights'),
+            ('mixed', 'Beach sunset sunset sunset'),
+        ]:
+            cls.posts[name] = Post.objects.create(author=cls.user, image='posts_images/test.jpg', description=description)
+            index_post(cls.posts[name])
+
+    def search(self, query, **params):
+        return self.client.get(reverse('post_search'), {'q': query, **params})
+
+    def descriptions(self, response):
+        return [post['description'] for post in response.data['results']]
+
+    def test_ranked_and_paginated(self):
+        self.assertEqual(self.descriptions(self.search('SUNSET')), [
+            'Beach sunset sunset sunset', 'Sunset over the beach, #sunset'
+        ])
+        self.assertEqual(self.descriptions(self.search('beach sunset')), [
+            'Beach sunset sunset sunset', 'Sunset over the beach, #sunset'
+        ])
+        self.assertEqual(self.descriptions(self.search('nothing here')), [])
+
+        descriptions = []
+        response = self.search('beach', page_size=1)
+        while True:
+            descriptions += self.descriptions(response)
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(sorted(descriptions), [
+            'A day at the beach', 'Beach sunset sunset sunset', 'Sunset over the beach, #sunset'
+        ])
+        self.assertEqual(self.search('').status_code, 400)
+        self.assertEqual(self.search('beach', cursor='bad').status_code, 404)
+
+    @override_settings(SEARCH_MAX_TERM_POSTINGS=2)
+    def test_common_words_are_bounded(self):
+        self.assertFalse(PostSearchEntry.objects.filter(term__in=['the', 'at', 'over']).exists())
+        self.assertEqual(self.search('the').status_code, 400)
+        # 'sunset' is within the limit, so every post it matches is ranked
+        self.assertEqual(self.descriptions(self.search('beach sunset')), [
+            'Beach sunset sunset sunset', 'Sunset over the beach, #sunset'
+        ])
+        # 'beach' alone is not, only the two newest posts using it are ranked
+        self.assertEqual(sorted(self.descriptions(self.search('beach'))), [
+            'A day at the beach', 'Beach sunset sunset sunset'
+        ])
+        self.assertEqual(self.descriptions(self.search('over the beach')), self.descriptions(self.search('beach')))
+        newest = Post.objects.create(author=self.user, image='posts_images/test.jpg', description='Beach party')
+        index_post(newest)
+        self.assertEqual(sorted(self.descriptions(self.search('beach'))), ['Beach party', 'Beach sunset sunset sunset'])
+
+    def test_index_follows_writes(self):
+        self.client.force_authenticate(self.user)
+        city = self.posts['city']
+        response = self.client.post(reverse('post_comment_create', kwargs={'pk': city.pk}),
+                                    {'comment': 'Great skyline'})
+        self.assertEqual(self.descriptions(self.search('skyline')), ['City lights'])
+
+        self.client.patch(reverse('post_edit', kwargs={'pk': city.pk}), {'description': 'Night skyline'})
+        self.assertEqual(self.descriptions(self.search('night skyline')), ['Night skyline'])
+        self.assertEqual(self.descriptions(self.search('lights')), [])
+
+        self.client.delete(reverse('comment_detail_delete', kwargs={'pk': response.data['id']}))
+        self.assertFalse(PostSearchEntry.objects.filter(term='great').exists())
+
+    def test_rebuild_search_index(self):
+        PostSearchEntry.objects.all().delete()
+        PostComment.objects.create(author=self.user, post=self.posts['city'], comment='neon')
+        out = StringIO()
+        call_command('rebuild_search_index', batch_size=2, stdout=out)
+        self.assertIn('Posts indexed: 4', out.getvalue())
+        self.assertEqual(self.descriptions(self.search('neon')), ['City lights'])
+        self.assertEqual(self.descriptions(self.search('day')), ['A day at the beach'])
+
+
+class HashtagMentionTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author', password='password-author', auth_status=DONE)
+        cls.friend = User.objects.create(username='friend_one', password='password-friend', auth_status=DONE)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.author)
+
+    def create_post(self, description):
+        response = self.client.post(reverse('post_create'), {'description': description})
+        return Post.objects.get(pk=response.data['id'])
+
+    def tag_page(self, tag, **params):
+        response = self.client.get(reverse('post_hashtag', kwargs={'tag': tag}), params)
+        return [post['description'] for post in response.data['results']], response
+
+    def test_tags_and_mentions_follow_writes(self):
+        first = self.create_post('Morning run #Running #fitness with @friend_one and @nobody')
+        second = self.create_post('Evening #running')
+        self.assertEqual(self.tag_page('running')[0], ['Evening #running', first.description])
+        self.assertEqual(self.tag_page('RUNNING', page_size=1)[1].status_code, 200)
+        self.assertEqual(self.client.get(reverse('post_hashtag', kwargs={'tag': 'unknown'})).status_code, 404)
+
+        self.assertEqual(PostHashtag.objects.filter(post=first).count(), 2)
+
+        self.client.patch(reverse('post_edit', kwargs={'pk': second.pk}), {'description': 'Evening walk'})
+        self.assertEqual(self.tag_page('running')[0], [first.description])
+        self.assertFalse(PostHashtag.objects.filter(post=second).exists())
+
+        response = self.client.post(reverse('post_comment_create', kwargs={'pk': second.pk}),
+                                    {'comment': 'Still #running? @friend_one'})
+        self.assertEqual(self.tag_page('running')[0], ['Evening walk', first.description])
+        self.client.delete(reverse('comment_detail_delete', kwargs={'pk': response.data['id']}))
+        self.assertEqual(self.tag_page('running')[0], [first.description])
+
+        self.client.post(reverse('post_comment_create', kwargs={'pk': first.pk}), {'comment': 'Go @friend_one'})
+        self.client.force_authenticate(self.friend)
+        response = self.client.get(reverse('post_mentions'))
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual([mention['post']['id'] for mention in response.data['results']], [str(first.pk)] * 2)
+        self.assertIsNotNone(response.data['results'][0]['comment'])
+        self.assertIsNone(response.data['results'][1]['comment'])
+        self.assertEqual(PostMention.objects.count(), 2)
+
+    def test_paging_a_tag(self):
+        for i in range(5):
+            self.create_post(f'post {i} #daily')
+        descriptions = []
+        descriptions_page, response = self.tag_page('daily', page_size=2)
+        while True:
+            descriptions += descriptions_page
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+            descriptions_page = [post['description'] for post in response.data['results']]
+        self.assertEqual(descriptions, [f'post {i} #daily' for i in reversed(range(5))])
+
+    @override_settings(TRENDING_BUCKET_SECONDS=60, TRENDING_WINDOW_BUCKETS=2, TRENDING_LIMIT=2)
+    def test_trending_counts_slide(self):
+        tags = {name: Hashtag.objects.create(name=name).pk for name in ('old', 'new', 'rare')}
+        start = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+        for _ in range(4):
+            count_uses([tags['old']], start)
+        count_uses([tags['new'], tags['rare']], start + datetime.timedelta(seconds=60))
+        count_uses([tags['new']], start + datetime.timedelta(seconds=90))
+        self.assertEqual(HashtagCount.objects.get(hashtag_id=tags['new']).count, 2)
+
+        # half of the oldest bucket is still in the window
+        self.assertEqual(trending_hashtags(start + datetime.timedelta(seconds=150)), [('new', 2), ('old', 2)])
+        self.assertEqual(trending_hashtags(start + datetime.timedelta(seconds=175)), [('new', 2), ('rare', 1)])
+        self.assertEqual(purge_hashtag_counts(start + datetime.timedelta(seconds=180)), 1)
+
+        self.create_post('#rare #rare')
+        response = self.client.get(reverse('trending_hashtags'))
+        self.assertEqual(response.data['results'], [{'tag': 'rare', 'uses': 1}])
+
+
+class ExploreTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create(username=f'explorer{i}', password='password-explorer', auth_status=DONE)
+                     for i in range(3)]
+        cls.posts = [Post.objects.create(author=cls.users[0], image='posts_images/test.jpg', description=f'post {i}')
+                     for i in range(4)]
+
+    def explore(self, **params):
+        response = self.client.get(reverse('post_explore'), params)
+        return [post['description'] for post in response.data['results']], response
+
+    def test_engagement_updates_ranking(self):
+        first, second, third, _ = self.posts
+        for user in self.users:
+            self.client.force_authenticate(user)
+            self.client.put(reverse('post_like_create_delete', kwargs={'pk': first.pk}))
+        self.client.put(reverse('post_like_create_delete', kwargs={'pk': first.pk}))
+        response = self.client.post(reverse('post_comment_create', kwargs={'pk': second.pk}), {'comment': 'nice'})
+        self.client.put(reverse('comment_like_create_delete', kwargs={'pk': response.data['id']}))
+        self.client.put(reverse('post_like_create_delete', kwargs={'pk': third.pk}))
+
+        # a comment, worth three likes, and a like on it beat three likes; the repeated like counts once
+        self.assertEqual(self.explore()[0], ['post 1', 'post 0', 'post 2'])
+        descriptions, response = self.explore(page_size=2)
+        descriptions += [post['description'] for post in self.client.get(response.data['next']).data['results']]
+        self.assertEqual(descriptions, ['post 1', 'post 0', 'post 2'])
+        self.assertEqual(self.client.get(reverse('post_explore'), {'cursor': 'bad'}).status_code, 404)
+
+    def test_like_cycling_counts_once(self):
+        first, second, _, _ = self.posts
+        self.client.force_authenticate(self.users[0])
+        self.client.put(reverse('post_like_create_delete', kwargs={'pk': first.pk}))
+        self.client.force_authenticate(self.users[1])
+        self.client.put(reverse('post_like_create_delete', kwargs={'pk': first.pk}))
+        url = reverse('post_like_create_delete', kwargs={'pk': second.pk})
+        self.assertEqual(self.client.put(url).status_code, 201)
+        score = PostScore.objects.get(post=second).score
+        for _ in range(5):
+            self.assertEqual(self.client.delete(url).status_code, 204)
+            self.assertEqual(self.client.put(url).status_code, 201)
+        self.assertEqual(PostScore.objects.get(post=second).score, score)
+        self.assertEqual(self.explore()[0], ['post 0', 'post 1'])
+
+    @override_settings(EXPLORE_HALF_LIFE=datetime.timedelta(hours=1), EXPLORE_MIN_SCORE=1, EXPLORE_MAX_POSTS=2)
+    def test_scores_decay_and_compact(self):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        first, second, third, fourth = self.posts
+        record_engagement(first.pk, 8, now - datetime.timedelta(hours=2))
+        record_engagement(second.pk, 3, now)
+        record_engagement(third.pk, 1, now - datetime.timedelta(minutes=1))
+        record_engagement(fourth.pk, 1, now - datetime.timedelta(hours=2))
+        self.assertEqual(self.explore()[0], ['post 1', 'post 0', 'post 2', 'post 3'])
+
+        # a like an hour ago is worth half of one today
+        record_engagement(third.pk, 1, now - datetime.timedelta(hours=1))
+        self.assertEqual(self.explore()[0], ['post 1', 'post 0', 'post 2', 'post 3'])
+        record_engagement(third.pk, 2, now)
+        self.assertEqual(self.explore()[0], ['post 2', 'post 1', 'post 0', 'post 3'])
+
+        out = StringIO()
+        call_command('compact_explore_scores', stdout=out)
+        self.assertIn('Cold scores pruned: 1, scores over the limit pruned: 1', out.getvalue())
+        self.assertEqual(self.explore()[0], ['post 2', 'post 1'])
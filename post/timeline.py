@@ -0,0 +1,79 @@
+from django.conf import settings
+
+from post.models import Post, TimelineEntry
+from shared.custom_pagination import CustomPagination
+from users.models import UserFollow
+
+
+def is_fan_out_on_read(author):
+    return author.followers_count > settings.FANOUT_MAX_FOLLOWERS
+
+
+def fan_out_post(post):
+    """
+    Pushes a new post into the author's own timeline and, unless the author has
+    more than FANOUT_MAX_FOLLOWERS followers, into every follower's timeline.
+    Followers of bigger accounts pick their posts up at read time instead.
+    """
+    author = post.author
+    TimelineEntry.objects.bulk_create([_entry(author.pk, post)], ignore_conflicts=True)
+    if is_fan_out_on_read(author):
+        return
+
+    batch_size = settings.FANOUT_BATCH_SIZE
+    followers = UserFollow.objects.filter(following=author).order_by() \
+        .values_list('follower_id', flat=True).iterator(chunk_size=batch_size)
+    batch = []
+    for follower_id in followers:
+        batch.append(_entry(follower_id, post))
+        if len(batch) >= batch_size:
+            TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    if batch:
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def backfill_timeline(follower, following):
+    if is_fan_out_on_read(following):
+        return
+    posts = Post.objects.filter(author=following).order_by('-created_time', '-id')[:settings.FEED_BACKFILL_POSTS]
+    TimelineEntry.objects.bulk_create([_entry(follower.pk, post) for post in posts], ignore_conflicts=True)
+
+
+def remove_from_timeline(follower, following):
+    TimelineEntry.objects.filter(owner=follower, post_author=following).delete()
+
+
+def read_timeline(user, position=None, limit=10):
+    """
+    Returns up to `limit` (created_time, post_id) pairs of the user's home feed,
+    newest first and strictly after `position`. Pushed entries come from one range
+    scan over the user's timeline; posts of followed fan-out-on-read authors are
+    merged in from their own (author, created_time) index.
+    """
+    entries = TimelineEntry.objects.filter(owner=user)
+    if position is not None:
+        entries = entries.filter(CustomPagination.seek_filter(('-post_created_time', '-post_id'), position))
+    rows = list(
+        entries.order_by('-post_created_time', '-post_id').values_list('post_created_time', 'post_id')[:limit]
+    )
+
+    big_authors = list(UserFollow.objects.filter(
+        follower=user, following__followers_count__gt=settings.FANOUT_MAX_FOLLOWERS
+    ).values_list('following_id', flat=True))
+    if big_authors:
+        posts = Post.objects.filter(author_id__in=big_authors)
+        if position is not None:
+            posts = posts.filter(CustomPagination.seek_filter(('-created_time', '-id'), position))
+        rows += list(posts.order_by('-created_time', '-id').values_list('created_time', 'id')[:limit])
+        rows = sorted(set(rows), reverse=True)
+    return rows[:limit]
+
+
+def _entry(owner_id, post):
+    return TimelineEntry(
+        owner_id=owner_id,
+        post=post,
+        post_author_id=post.author_id,
+        post_created_time=post.created_time,
+    )
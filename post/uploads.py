@@ -0,0 +1,165 @@
+import hashlib
+import os
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from PIL import Image
+from rest_framework.exceptions import ValidationError
+
+from post.models import Post, PostUpload
+from post.search import index_post
+from post.tags import extract_post_tags
+from post.timeline import fan_out_post
+from shared.images import schedule_variants
+
+CHUNK_SIZE = 64 * 1024
+content_range_regex = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class StagedFile(File):
+    """
+    A finished upload. Exposing temporary_file_path() lets FileSystemStorage move
+    the staging file into place instead of copying it.
+    """
+
+    def __init__(self, path, name):
+        super(StagedFile, self).__init__(open(path, 'rb'), name=name)
+        self.path = path
+
+    def temporary_file_path(self):
+        return self.path
+
+
+def staging_path(upload):
+    return Path(settings.UPLOAD_STAGING_DIR).joinpath(f'{upload.pk}.part')
+
+
+def parse_content_range(header, upload):
+    match = content_range_regex.match(header or '')
+    if not match:
+        raise ValidationError(
+            {
+                'success': False,
+                'message': "Content-Range must look like 'bytes <start>-<end>/<size>'",
+            }
+        )
+    start, end, size = map(int, match.groups())
+    if size != upload.size or start > end or end >= upload.size:
+        raise ValidationError(
+            {
+                'success': False,
+                'message': f"Byte range must be within 0-{upload.size - 1}/{upload.size}",
+            }
+        )
+    if start > upload.received:
+        raise ValidationError(
+            {
+                'success': False,
+                'message': f"Upload must continue from byte {upload.received}",
+            }
+        )
+    return start, end
+
+
+def write_chunk(upload, stream, start, end):
+    """
+    Writes bytes start..end from `stream` at that offset of the staging file and
+    returns how many bytes of the upload have been received. A range that is cut
+    short still counts for the bytes that arrived, so the client resumes from there.
+    """
+    path = staging_path(upload)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    remaining = end - start + 1
+    written = 0
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o600)
+    with os.fdopen(fd, 'wb') as staged:
+        staged.seek(start)
+        while remaining:
+            chunk = stream.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            staged.write(chunk)
+            written += len(chunk)
+            remaining -= len(chunk)
+
+    # ranges may be retried or overlap, `received` only ever moves forward
+    PostUpload.objects.filter(pk=upload.pk, received__gte=start) \
+        .update(received=Greatest(F('received'), start + written))
+    upload.refresh_from_db(fields=['received'])
+    return upload.received
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as staged:
+        for chunk in iter(lambda: staged.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def finalize_upload(upload, description):
+    """
+    Creates the post from a complete upload. Finalizing twice returns the same post.
+    """
+    if upload.post_id:
+        return upload.post
+    if not upload.is_complete:
+        raise ValidationError(
+            {
+                'success': False,
+                'message': f"Upload is incomplete, {upload.received} of {upload.size} bytes received",
+            }
+        )
+
+    path = staging_path(upload)
+    digest = file_sha256(path)
+    if upload.sha256 and upload.sha256.lower() != digest:
+        raise ValidationError(
+            {
+                'success': False,
+                'message': "Uploaded file does not match its sha256, upload it again",
+            }
+        )
+    try:
+        with Image.open(path) as image:
+            image.verify()
+    except Exception:
+        raise ValidationError(
+            {
+                'success': False,
+                'message': "Uploaded file is not a valid image",
+            }
+        )
+
+    with transaction.atomic():
+        upload = PostUpload.objects.select_for_update().get(pk=upload.pk)
+        if upload.post_id:
+            return upload.post
+        post = Post(author_id=upload.author_id, description=description)
+        staged = StagedFile(path, upload.filename)
+        staged.sha256 = digest
+        try:
+            post.image.save(upload.filename, staged, save=False)
+        finally:
+            staged.close()
+        post.save()
+        index_post(post)
+        extract_post_tags(post)
+        upload.post = post
+        upload.sha256 = digest
+        upload.save(update_fields=['post', 'sha256', 'updated_time'])
+        schedule_variants(post, 'image', 'image_variants')
+        transaction.on_commit(lambda: fan_out_post(post))
+    # storages that copy rather than move leave the staging file behind
+    path.unlink(missing_ok=True)
+    return post
+
+
+def discard_upload(upload):
+    staging_path(upload).unlink(missing_ok=True)
+    upload.delete()
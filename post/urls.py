@@ -1,14 +1,27 @@
 from django.urls import path
 
+from post.async_views import AsyncPostListView, AsyncPostDetailView, AsyncPostCommentListView, \
+    AsyncPostLikeListView, AsyncCommentLikeListView
 from post.views import PostListApiView, PostCreateApiView, \
     PostDetailApiView, PostUpdateApiView, PostDeleteApiView, \
     PostCommentListView, PostCommentCreateView, CommentListCreateView, \
     PostLikeListView, CommentDetailDeleteView, CommentLikeListView, \
-    PostLikeApiView, CommentLikeApiView
+    PostLikeApiView, CommentLikeApiView, PostFeedApiView, PostUploadCreateView, PostUploadApiView, \
+    PostUploadFinalizeView, PostSearchApiView, PostHashtagApiView, TrendingHashtagApiView, PostMentionListView, \
+    PostExploreApiView
 
 urlpatterns = [
     path('list/', PostListApiView.as_view(), name='post_list'),
     path('create/', PostCreateApiView.as_view(), name='post_create'),
+    path('feed/', PostFeedApiView.as_view(), name='post_feed'),
+    path('search/', PostSearchApiView.as_view(), name='post_search'),
+    path('explore/', PostExploreApiView.as_view(), name='post_explore'),
+    path('tags/<str:tag>/', PostHashtagApiView.as_view(), name='post_hashtag'),
+    path('trending/tags/', TrendingHashtagApiView.as_view(), name='trending_hashtags'),
+    path('mentions/', PostMentionListView.as_view(), name='post_mentions'),
+    path('uploads/', PostUploadCreateView.as_view(), name='post_upload_create'),
+    path('uploads/<uuid:pk>/', PostUploadApiView.as_view(), name='post_upload'),
+    path('uploads/<uuid:pk>/finalize/', PostUploadFinalizeView.as_view(), name='post_upload_finalize'),
     path('<uuid:pk>/', PostDetailApiView.as_view(), name='post_detail'),
     path('<uuid:pk>/update/', PostUpdateApiView.as_view(), name='post_edit'),
     path('<uuid:pk>/delete/', PostDeleteApiView.as_view(), name='post_delete'),
@@ -21,4 +34,11 @@ urlpatterns = [
     path('comments/<uuid:pk>/', CommentDetailDeleteView.as_view(), name='comment_detail_delete'),
     path('comments/<uuid:pk>/likes/', CommentLikeListView.as_view(), name='comment_like_list'),
     path('comments/<uuid:pk>/liking/', CommentLikeApiView.as_view(), name='comment_like_create_delete'),
+
+    # async variants of the hot read paths, for deployments served by config/asgi.py
+    path('async/list/', AsyncPostListView.as_view(), name='post_list_async'),
+    path('async/<uuid:pk>/', AsyncPostDetailView.as_view(), name='post_detail_async'),
+    path('async/<uuid:pk>/likes/', AsyncPostLikeListView.as_view(), name='post_like_list_async'),
+    path('async/<uuid:pk>/comments/', AsyncPostCommentListView.as_view(), name='post_comments_async'),
+    path('async/comments/<uuid:pk>/likes/', AsyncCommentLikeListView.as_view(), name='comment_like_list_async'),
 ]
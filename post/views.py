@@ -1,27 +1,227 @@
+import uuid
+
+from django.db import transaction
+from django.db.models import Count, Max, Prefetch, Q, Subquery, Sum
 from rest_framework import status
 from rest_framework import generics
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.generics import get_object_or_404
 from rest_framework.permissions import AllowAny, IsAuthenticated, IsAuthenticatedOrReadOnly
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from yaml import serialize
 
-from post.models import Post, PostComment, PostLike, CommentLike
-from post.serializers import PostSerializer, PostCommentSerializer, PostLikeSerializer, CommentLikeSerializer
+from post.explore import read_explore
+from post.like_buffer import get_like_buffer, write_behind_enabled
+from post.models import Post, PostComment, PostLike, CommentLike, PostUpload, Hashtag, PostHashtag, PostMention
+from post.serializers import PostSerializer, PostCommentSerializer, PostLikeSerializer, CommentLikeSerializer, \
+    PostUploadSerializer, PostUploadFinalizeSerializer, PostMentionSerializer
+from post.search import index_post, parse_query, search_posts
+from post.services import create_comment, delete_comment, like_post, unlike_post, like_comment, unlike_comment
+from post.tags import extract_post_tags, trending_hashtags
+from post.timeline import fan_out_post, read_timeline
+from post.uploads import parse_content_range, write_chunk, finalize_upload
+from shared.conditional import ConditionalGetMixin
 from shared.custom_pagination import CustomPagination
+from shared.images import schedule_variants
+from shared.storage import release_files
+
+
+class PendingLikesMixin:
+    """
+    Merges likes still waiting in the write-behind buffer into counts and me_liked.
+    """
+
+    def process_page(self, page):
+        if not write_behind_enabled():
+            return page
+        return get_like_buffer().merge(page, self.request.user)
+
+    def paginate_queryset(self, queryset):
+        page = super(PendingLikesMixin, self).paginate_queryset(queryset)
+        if page is None:
+            return None
+        return self.process_page(page)
+
+    def get_object(self):
+        return self.process_page([super(PendingLikesMixin, self).get_object()])[0]
+
+    def get_etag_parts(self, rows):
+        parts = super(PendingLikesMixin, self).get_etag_parts(rows)
+        if write_behind_enabled():
+            buffer = get_like_buffer()
+            user = self.request.user
+            pending = [row['id'] for row in rows]
+            parts.append(buffer.pending_deltas(pending))
+            if user.is_authenticated:
+                parts.append(buffer.cache.get_many([buffer.state_key(pk, user.pk) for pk in pending]))
+        return parts
+
+    def get_last_modified(self, rows):
+        last_modified = super(PendingLikesMixin, self).get_last_modified(rows)
+        if write_behind_enabled() and any(get_like_buffer().pending_deltas([row['id'] for row in rows]).values()):
+            # buffered likes have not touched updated_time yet, rely on the ETag
+            return None
+        return last_modified
+
+
+class PostValidatorsMixin(PendingLikesMixin, ConditionalGetMixin):
+    validator_fields = ('id', 'created_time', 'updated_time', 'likes_count', 'comments_count',
+                        'author__updated_time')
+
+    def get_last_modified(self, rows):
+        last_modified = super(PostValidatorsMixin, self).get_last_modified(rows)
+        if last_modified is None:
+            return None
+        return max([last_modified] + [row['author__updated_time'] for row in rows])
+
+
+class PostListApiView(PostValidatorsMixin, generics.ListAPIView):
+    permission_classes = [AllowAny,]
+    serializer_class = PostSerializer
+    pagination_class = CustomPagination
+    list_last_modified = False
+
+    def get_queryset(self):
+        return Post.objects.for_feed(self.request.user).order_by('-created_time', '-id')
 
 
-class PostListApiView(generics.ListAPIView):
+class PostDetailApiView(PostValidatorsMixin, generics.RetrieveAPIView):
     permission_classes = [AllowAny,]
     serializer_class = PostSerializer
-    pagination_class = CustomPagination
-    queryset = Post.objects.all()
+
+    def get_queryset(self):
+        return Post.objects.for_feed(self.request.user)
 
 
-class PostDetailApiView(generics.RetrieveAPIView):
+class PostRowsApiView(generics.GenericAPIView):
+    """
+    Base of the post lists read as (sort key, post_id) rows from an index table
+    by get_rows() and loaded with one in_bulk, paginated with a `cursor` query
+    parameter only.
+    """
     permission_classes = [AllowAny,]
     serializer_class = PostSerializer
-    queryset = Post.objects.all()
+    pagination_class = CustomPagination
+
+    def get_rows(self, position, limit):
+        raise NotImplementedError
+
+    def parse_position(self, position):
+        return self.paginator.parse_position(Post, position)
+
+    def get(self, request, *args, **kwargs):
+        paginator = self.paginator
+        paginator.request = request
+        page_size = paginator.get_page_size(request)
+        position, _ = paginator.decode_cursor(request.query_params.get(paginator.cursor_query_param))
+        if position is not None:
+            position = self.parse_position(position)
+
+        rows = self.get_rows(position, page_size + 1)
+        next_position = rows[page_size - 1] if len(rows) > page_size else None
+        rows = rows[:page_size]
+        posts = Post.objects.for_feed(request.user).in_bulk([post_id for _, post_id in rows])
+        page = [posts[post_id] for _, post_id in rows if post_id in posts]
+        if write_behind_enabled():
+            get_like_buffer().merge(page, request.user)
+
+        serializer = self.get_serializer(page, many=True)
+        return Response(
+            {
+                'next': paginator.get_cursor_link(next_position, reverse=False),
+                'previous': None,
+                'results': serializer.data,
+            }
+        )
+
+
+class PostFeedApiView(PostRowsApiView):
+    """
+    Home feed of the posts of followed users and the user's own posts, newest first.
+    """
+    permission_classes = [IsAuthenticated,]
+
+    def get_rows(self, position, limit):
+        return read_timeline(self.request.user, position, limit)
+
+
+class PostSearchApiView(PostRowsApiView):
+    """
+    Posts whose description and comments contain every word of the `q` query
+    parameter, best match first.
+    """
+
+    def get_rows(self, position, limit):
+        terms = parse_query(self.request.query_params.get('q'))
+        if not terms:
+            raise ValidationError(
+                {
+                    'success': False,
+                    'message': "Search query must contain at least one word",
+                }
+            )
+        return search_posts(terms, position, limit)
+
+    def parse_position(self, position):
+        try:
+            return [int(position[0]), uuid.UUID(position[1])]
+        except (AttributeError, TypeError, ValueError):
+            raise NotFound("Invalid cursor")
+
+
+class PostExploreApiView(PostRowsApiView):
+    """
+    Posts ranked by likes and comments decayed with EXPLORE_HALF_LIFE, best first.
+    """
+
+    def get_rows(self, position, limit):
+        return read_explore(position, limit)
+
+    def parse_position(self, position):
+        try:
+            return [float(position[0]), uuid.UUID(position[1])]
+        except (AttributeError, TypeError, ValueError):
+            raise NotFound("Invalid cursor")
+
+
+class PostHashtagApiView(PostRowsApiView):
+    """
+    Posts carrying a hashtag in their description or comments, newest first.
+    """
+
+    def get_rows(self, position, limit):
+        hashtag = get_object_or_404(Hashtag, name=self.kwargs['tag'].lstrip('#').casefold())
+        entries = PostHashtag.objects.filter(hashtag=hashtag)
+        if position is not None:
+            entries = entries.filter(CustomPagination.seek_filter(('-post_created_time', '-post_id'), position))
+        entries = entries.order_by('-post_created_time', '-post_id').values_list('post_created_time', 'post_id')
+        return list(entries[:limit])
+
+
+class TrendingHashtagApiView(APIView):
+    permission_classes = [AllowAny,]
+
+    def get(self, request):
+        return Response(
+            {
+                'results': [{'tag': name, 'uses': uses} for name, uses in trending_hashtags()],
+            }
+        )
+
+
+class PostMentionListView(generics.ListAPIView):
+    """
+    Posts and comments mentioning the user, newest first.
+    """
+    permission_classes = [IsAuthenticated,]
+    serializer_class = PostMentionSerializer
+    pagination_class = CustomPagination
+
+    def get_queryset(self):
+        return PostMention.objects.filter(user=self.request.user).select_related('author') \
+            .prefetch_related(Prefetch('post', queryset=Post.objects.for_feed(self.request.user))) \
+            .order_by('-created_time', '-id')
 
 
 class PostCreateApiView(generics.CreateAPIView):
@@ -30,7 +230,11 @@ class PostCreateApiView(generics.CreateAPIView):
     queryset = Post.objects.all()
 
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        post = serializer.save(author=self.request.user)
+        index_post(post)
+        extract_post_tags(post)
+        schedule_variants(post, 'image', 'image_variants')
+        transaction.on_commit(lambda: fan_out_post(post))
 
 
 class PostUpdateApiView(generics.UpdateAPIView):
@@ -38,6 +242,18 @@ class PostUpdateApiView(generics.UpdateAPIView):
     serializer_class = PostSerializer
     queryset = Post.objects.all()
 
+    def perform_update(self, serializer):
+        if 'image' not in serializer.validated_data:
+            post = serializer.save()
+        else:
+            instance = serializer.instance
+            release_files(instance.image, instance.image_variants)
+            post = serializer.save(image_variants={})
+            schedule_variants(post, 'image', 'image_variants')
+        if 'description' in serializer.validated_data:
+            index_post(post)
+            extract_post_tags(post)
+
 
 class PostDeleteApiView(generics.DestroyAPIView):
     permission_classes = [IsAuthenticated,]
@@ -55,41 +271,150 @@ class PostDeleteApiView(generics.DestroyAPIView):
         )
 
 
-class PostCommentListView(generics.ListAPIView):
+class PostUploadCreateView(generics.CreateAPIView):
+    permission_classes = [IsAuthenticated,]
+    serializer_class = PostUploadSerializer
+
+    def perform_create(self, serializer):
+        serializer.save(author=self.request.user)
+
+
+class PostUploadApiView(APIView):
+    """
+    GET reports how many bytes arrived so a client can resume, PUT writes the
+    raw body at the offset given by its Content-Range header.
+    """
+    permission_classes = [IsAuthenticated,]
+
+    def get_upload(self, pk):
+        return get_object_or_404(PostUpload, pk=pk, author=self.request.user)
+
+    def get(self, request, pk):
+        return self.upload_response(self.get_upload(pk))
+
+    def put(self, request, pk):
+        upload = self.get_upload(pk)
+        if upload.post_id:
+            return self.upload_response(upload)
+        start, end = parse_content_range(request.headers.get('Content-Range'), upload)
+        if request.stream is None:
+            raise ValidationError(
+                {
+                    'success': False,
+                    'message': "Request body is empty",
+                }
+            )
+        write_chunk(upload, request.stream, start, end)
+        return self.upload_response(upload)
+
+    @staticmethod
+    def upload_response(upload):
+        response = Response(PostUploadSerializer(upload).data, status=status.HTTP_200_OK)
+        if upload.received:
+            response['Range'] = f'bytes=0-{upload.received - 1}'
+        return response
+
+
+class PostUploadFinalizeView(APIView):
+    permission_classes = [IsAuthenticated,]
+
+    def post(self, request, pk):
+        upload = get_object_or_404(PostUpload, pk=pk, author=request.user)
+        serializer = PostUploadFinalizeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        created = upload.post_id is None
+        post = finalize_upload(upload, serializer.validated_data['description'])
+        serializer = PostSerializer(post, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+
+class CommentTreeMixin:
+
+    def process_page(self, page):
+        return PostComment.objects.attach_replies(page, self.request.user)
+
+    def paginate_queryset(self, queryset):
+        page = super(CommentTreeMixin, self).paginate_queryset(queryset)
+        if page is None:
+            return None
+        return self.process_page(page)
+
+    def get_object(self):
+        return self.process_page([super(CommentTreeMixin, self).get_object()])[0]
+
+
+class PostCommentListView(CommentTreeMixin, ConditionalGetMixin, generics.ListAPIView):
     permission_classes = [AllowAny,]
     serializer_class = PostCommentSerializer
+    pagination_class = CustomPagination
+    cursor_ordering = ('created_time', 'id')
+
+    def get_etag_parts(self, rows):
+        return [row['id'] for row in rows] + [self.get_thread_state(rows)]
+
+    def get_last_modified(self, rows):
+        return self.get_thread_state(rows)['last_modified']
+
+    def get_thread_state(self, rows):
+        """
+        One aggregate over the page's threads and the post row, whose
+        updated_time moves with every comment created or deleted under it.
+        """
+        if not hasattr(self, '_thread_state'):
+            root_ids = [row['id'] for row in rows]
+            post = Post.objects.filter(pk=self.kwargs['pk'])
+            state = PostComment.objects.filter(Q(pk__in=root_ids) | Q(root_id__in=root_ids)).aggregate(
+                last_modified=Max('updated_time'), comments=Count('id'), likes=Sum('likes_count'),
+                post_updated_time=Max(Subquery(post.values('updated_time'))),
+                post_comments_count=Max(Subquery(post.values('comments_count'))),
+            )
+            state['last_modified'] = max(filter(None, [state['last_modified'], state['post_updated_time']]),
+                                         default=None)
+            self._thread_state = state
+        return self._thread_state
 
     def get_queryset(self):
         post_id = self.kwargs['pk']
-        queryset = PostComment.objects.filter(post__id=post_id)
+        queryset = PostComment.objects.filter(post__id=post_id, parent__isnull=True) \
+            .select_related('author').with_me_liked(self.request.user).order_by('created_time', 'id')
         return queryset
 
 
 class PostCommentCreateView(generics.CreateAPIView):
     serializer_class = PostCommentSerializer
     permission_classes = [IsAuthenticated,]
+    throttle_scope = 'comment'
     queryset = PostComment.objects.all()
 
     def perform_create(self, serializer):
         post_id = self.kwargs['pk']
         post = get_object_or_404(Post, pk=post_id)
-        serializer.save(post=post, author=self.request.user)
+        create_comment(serializer, post=post, author=self.request.user)
 
 
-class CommentListCreateView(generics.ListCreateAPIView):
+class CommentListCreateView(CommentTreeMixin, generics.ListCreateAPIView):
     permission_classes = [IsAuthenticatedOrReadOnly,]
+    throttle_scope = 'comment'
     serializer_class = PostCommentSerializer
-    queryset = PostComment.objects.all()
     pagination_class = CustomPagination
 
+    def get_queryset(self):
+        return PostComment.objects.select_related('author').with_me_liked(self.request.user) \
+            .order_by('-created_time', '-id')
+
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        create_comment(serializer, author=self.request.user)
 
 
-class CommentDetailDeleteView(generics.RetrieveDestroyAPIView):
+class CommentDetailDeleteView(CommentTreeMixin, generics.RetrieveDestroyAPIView):
     permission_classes = [IsAuthenticatedOrReadOnly,]
     serializer_class = PostCommentSerializer
-    queryset = PostComment.objects.all()
+
+    def get_queryset(self):
+        return PostComment.objects.select_related('author').with_me_liked(self.request.user)
+
+    def perform_destroy(self, instance):
+        delete_comment(instance)
 
 
 class PostLikeListView(generics.ListAPIView):
@@ -99,7 +424,7 @@ class PostLikeListView(generics.ListAPIView):
 
     def get_queryset(self):
         post_id = self.kwargs['pk']
-        return PostLike.objects.filter(post__id=post_id)
+        return PostLike.objects.filter(post__id=post_id).select_related('author').order_by('-created_time', '-id')
 
 
 class CommentLikeListView(generics.ListAPIView):
@@ -109,82 +434,79 @@ class CommentLikeListView(generics.ListAPIView):
 
     def get_queryset(self):
         comment_id = self.kwargs['pk']
-        return CommentLike.objects.filter(comment__id=comment_id)
-
-
-class PostLikeApiView(APIView):
-
-    def post(self, request, pk):
-        try:
-            post = get_object_or_404(Post, pk=pk)
-            author = request.user
-            if not PostLike.objects.filter(post=post, author=author).exists():
-                post_like = PostLike.objects.create(
-                    post=post,
-                    author=author
-                )
-                serializer = PostLikeSerializer(post_like)
-                data = {
-                    'success': True,
-                    'message': 'Post successfully liked',
-                    'data': serializer.data
-                }
-                return Response(data, status=status.HTTP_201_CREATED)
-            else:
-                post_like = PostLike.objects.get(
-                    post=post,
-                    author=author
-                )
-                post_like.delete()
-                data = {
-                    'success': True,
-                    'message': "Post LIKE successfully deleted",
-                }
-                return Response(data, status=status.HTTP_204_NO_CONTENT)
-        except Exception as e:
+        return CommentLike.objects.filter(comment__id=comment_id).select_related('author') \
+            .order_by('-created_time', '-id')
+
+
+class LikeApiMixin:
+    """
+    PUT likes and DELETE unlikes idempotently, each backed by a single statement.
+    POST keeps the old toggle behaviour for existing clients.
+    """
+    model = None
+    like_serializer_class = None
+    like = None
+    unlike = None
+    label = None
+    throttle_scope = 'like'
+
+    def put(self, request, pk):
+        like = self.like(pk, request.user)
+        if like is None:
+            self.check_target(pk)
             data = {
-                'success': False,
-                'message': str(e),
-                'data': None
+                'success': True,
+                'message': f'{self.label} already liked',
             }
-            return Response(data, status=status.HTTP_400_BAD_REQUEST)
-
-
-class CommentLikeApiView(APIView):
+            return Response(data, status=status.HTTP_200_OK)
+        return self.liked_response(like)
+
+    def delete(self, request, pk):
+        if not self.unlike(pk, request.user):
+            self.check_target(pk)
+        data = {
+            'success': True,
+            'message': f"{self.label} LIKE successfully deleted",
+        }
+        return Response(data, status=status.HTTP_204_NO_CONTENT)
 
     def post(self, request, pk):
-        try:
-            comment = get_object_or_404(PostComment, pk=pk)
-            author = request.user
-            if not CommentLike.objects.filter(comment=comment, author=author).exists():
-                comment_like = CommentLike.objects.create(
-                    comment=comment,
-                    author=author
-                )
-                serializer = CommentLikeSerializer(comment_like)
-                data = {
-                    'success': True,
-                    'message': 'Comment successfully liked',
-                    'data': serializer.data
-                }
-                return Response(data, status=status.HTTP_201_CREATED)
-            else:
-                comment_like = CommentLike.objects.get(
-                    comment=comment,
-                    author=author
-                )
-                comment_like.delete()
-                data = {
-                    'success': True,
-                    'message': "Comment LIKE successfully deleted",
-                }
-                return Response(data, status=status.HTTP_204_NO_CONTENT)
-        except Exception as e:
-            data = {
-                'success': False,
-                'message': str(e),
-                'data': None
-            }
-            return Response(data, status=status.HTTP_400_BAD_REQUEST)
-
-
+        like = self.like(pk, request.user)
+        if like is not None:
+            return self.liked_response(like)
+        if not self.unlike(pk, request.user):
+            self.check_target(pk)
+        data = {
+            'success': True,
+            'message': f"{self.label} LIKE successfully deleted",
+        }
+        return Response(data, status=status.HTTP_204_NO_CONTENT)
+
+    def liked_response(self, like):
+        serializer = self.like_serializer_class(like)
+        data = {
+            'success': True,
+            'message': f'{self.label} successfully liked',
+            'data': serializer.data
+        }
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    def check_target(self, pk):
+        if not self.model.objects.filter(pk=pk).exists():
+            raise NotFound(f"No {self.label} matches the given query.")
+
+
+class PostLikeApiView(LikeApiMixin, APIView):
+    model = Post
+    like_serializer_class = PostLikeSerializer
+    like = staticmethod(like_post)
+    unlike = staticmethod(unlike_post)
+    label = 'Post'
+
+
+class CommentLikeApiView(LikeApiMixin, APIView):
+    model = PostComment
+    like_serializer_class = CommentLikeSerializer
+    like = staticmethod(like_comment)
+    unlike = staticmethod(unlike_comment)
+    label = 'Comment'
@@ -1,3 +1,16 @@
 from django.contrib import admin
 
-# Register your models here.
+from shared.models import OutboxMessage, StoredFile
+
+
+@admin.register(StoredFile)
+class StoredFileAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'size', 'refcount', 'created_time')
+    search_fields = ('name',)
+
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ('id', 'recipient', 'subject', 'status', 'attempts', 'latency', 'created_time')
+    list_filter = ('status',)
+    search_fields = ('id', 'recipient')
@@ -0,0 +1,90 @@
+import hashlib
+
+from django.http import Http404
+from django.utils.cache import get_conditional_response, patch_vary_headers, quote_etag
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+
+class ConditionalGetMixin:
+    """
+    Answers If-None-Match / If-Modified-Since with 304 for list and retrieve
+    actions. Validators are computed from a narrow `.values()` query over
+    `validator_fields` before anything is serialized, and the full objects are only
+    loaded when the client's copy is stale.
+    """
+    validator_fields = ('id', 'created_time', 'updated_time')
+    # list endpoints whose membership can change without any row being updated
+    # (e.g. a deleted post) only get an ETag
+    list_last_modified = True
+
+    def process_page(self, page):
+        return page
+
+    def get_etag_parts(self, rows):
+        return [tuple(row.values()) for row in rows]
+
+    def get_last_modified(self, rows):
+        return max((row['updated_time'] for row in rows), default=None)
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = self.paginate_queryset_values(queryset.values(*self.validator_fields))
+        last_modified = self.get_last_modified(rows) if self.list_last_modified else None
+        not_modified, etag = self.check_not_modified(rows, last_modified)
+        if not_modified is not None:
+            return not_modified
+
+        objects = queryset.in_bulk([row['id'] for row in rows])
+        page = self.process_page([objects[row['id']] for row in rows if row['id'] in objects])
+        serializer = self.get_serializer(page, many=True)
+        if self.paginator is not None:
+            response = self.get_paginated_response(serializer.data)
+        else:
+            response = Response(serializer.data)
+        return self.set_validators(response, etag, last_modified)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = list(queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+                    .values(*self.validator_fields)[:1])
+        if not rows:
+            raise Http404
+        last_modified = self.get_last_modified(rows)
+        not_modified, etag = self.check_not_modified(rows, last_modified)
+        if not_modified is not None:
+            return not_modified
+        response = super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs)
+        return self.set_validators(response, etag, last_modified)
+
+    def paginate_queryset_values(self, queryset):
+        if self.paginator is None:
+            return list(queryset)
+        return self.paginator.paginate_queryset(queryset, self.request, view=self)
+
+    def check_not_modified(self, rows, last_modified):
+        user = self.request.user
+        parts = [user.pk if user.is_authenticated else None, self.get_etag_parts(rows)]
+        page = getattr(self.paginator, 'page', None)
+        if page is not None:
+            # page-number responses carry the total count
+            parts.append(page.paginator.count)
+        etag = quote_etag(hashlib.md5(repr(parts).encode(), usedforsecurity=False).hexdigest())
+        response = get_conditional_response(
+            self.request._request,
+            etag=etag,
+            last_modified=int(last_modified.timestamp()) if last_modified else None,
+        )
+        if response is not None:
+            response = self.set_validators(response, etag, last_modified)
+        return response, etag
+
+    @staticmethod
+    def set_validators(response, etag, last_modified):
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+        # me_liked depends on who is asking
+        patch_vary_headers(response, ('Authorization',))
+        return response
@@ -1,13 +1,41 @@
+import base64
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+PAGE_MODE, CURSOR_MODE = ('page', 'cursor')
 
 
 class CustomPagination(PageNumberPagination):
     page_size = 10
     page_size_query_param = 'page_size'
     max_page_size = 100
+    cursor_query_param = 'cursor'
+    # keyset ordering, views may override it with a `cursor_ordering` attribute
+    ordering = ('-created_time', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_mode = self.get_mode(view) == CURSOR_MODE
+        if not self.cursor_mode:
+            return super(CustomPagination, self).paginate_queryset(queryset, request, view)
+        return self.paginate_queryset_by_cursor(queryset, request, view)
 
     def get_paginated_response(self, data):
+        if self.cursor_mode:
+            return Response(
+                {
+                    'next': self.get_next_link(),
+                    'previous': self.get_previous_link(),
+                    'results': data,
+                }
+            )
         return Response(
             {
                 'next': self.get_next_link(),
@@ -17,4 +45,128 @@ class CustomPagination(PageNumberPagination):
             }
         )
 
+    def get_next_link(self):
+        if not self.cursor_mode:
+            return super(CustomPagination, self).get_next_link()
+        return self.get_cursor_link(self.next_position, reverse=False)
+
+    def get_previous_link(self):
+        if not self.cursor_mode:
+            return super(CustomPagination, self).get_previous_link()
+        return self.get_cursor_link(self.previous_position, reverse=True)
+
+    @staticmethod
+    def get_mode(view):
+        return getattr(view, 'pagination_mode', None) or getattr(settings, 'PAGINATION_MODE', PAGE_MODE)
+
+    def paginate_queryset_by_cursor(self, queryset, request, view=None):
+        queryset, page_size, position, reverse = self.get_cursor_queryset(queryset, request, view)
+        return self.get_cursor_page(list(queryset[:page_size + 1]), page_size, position, reverse)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        paginate_queryset() for async views, the page is read with the async ORM.
+        """
+        self.cursor_mode = self.get_mode(view) == CURSOR_MODE
+        if self.cursor_mode:
+            queryset, page_size, position, reverse = self.get_cursor_queryset(queryset, request, view)
+            results = [item async for item in queryset[:page_size + 1]]
+            return self.get_cursor_page(results, page_size, position, reverse)
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        paginator = self.django_paginator_class(queryset, page_size)
+        # counted here, so that paginator.page() does not run a sync query
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+        self.page.object_list = [item async for item in self.page.object_list]
+        return self.page.object_list
+
+    def get_cursor_queryset(self, queryset, request, view=None):
+        """
+        Orders and filters `queryset` for the requested cursor, returns it with the
+        page size, decoded position and direction.
+        """
+        self.request = request
+        self.ordering = tuple(getattr(view, 'cursor_ordering', self.ordering))
+        page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request.query_params.get(self.cursor_query_param))
+
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(field[1:] if field.startswith('-') else f'-{field}' for field in ordering)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            position = self.parse_position(queryset.model, position)
+            queryset = queryset.filter(self.seek_filter(ordering, position))
+        return queryset, page_size, position, reverse
+
+    def get_cursor_page(self, results, page_size, position, reverse):
+        """
+        Trims the page_size + 1 rows read for a cursor page and sets the positions
+        of the next and previous links.
+        """
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+
+        self.next_position = self.previous_position = None
+        if results:
+            if has_more or reverse:
+                self.next_position = self.get_position(results[-1])
+            if (has_more and reverse) or (position is not None and not reverse):
+                self.previous_position = self.get_position(results[0])
+        return results
+
+    @staticmethod
+    def seek_filter(ordering, position):
+        """
+        Rows strictly after `position` in `ordering`, written as
+        `a <= x AND (a < x OR b < y)` so the leading column bounds the index scan.
+        """
+        (first, first_value), (second, second_value) = zip(
+            [field.lstrip('-') for field in ordering], position
+        )
+        op = 'lt' if ordering[0].startswith('-') else 'gt'
+        return Q(**{f'{first}__{op}e': first_value}) & (
+            Q(**{f'{first}__{op}': first_value}) | Q(**{f'{second}__{op}': second_value})
+        )
+
+    def parse_position(self, model, position):
+        fields = [model._meta.get_field(field.lstrip('-')) for field in self.ordering]
+        try:
+            return [field.to_python(value) for field, value in zip(fields, position)]
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound("Invalid cursor")
+
+    def get_position(self, item):
+        fields = [field.lstrip('-') for field in self.ordering]
+        if isinstance(item, dict):
+            return [item[field] for field in fields]
+        return [getattr(item, field) for field in fields]
+
+    def get_cursor_link(self, position, reverse):
+        if position is None:
+            return None
+        values = [value.isoformat() if hasattr(value, 'isoformat') else str(value) for value in position]
+        cursor = base64.urlsafe_b64encode(json.dumps([values, reverse]).encode()).decode()
+        url = remove_query_param(self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
 
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None, False
+        try:
+            values, reverse = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            if len(values) != len(self.ordering):
+                raise ValueError(cursor)
+            return values, bool(reverse)
+        except (TypeError, ValueError):
+            raise NotFound("Invalid cursor")
@@ -0,0 +1,97 @@
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.decorators import sync_and_async_middleware
+from rest_framework.permissions import SAFE_METHODS
+
+PIN_COOKIE = 'db_primary'
+
+# only requests let through by the middleware read from replicas, everything else
+# (writes, management commands, workers) stays on the primary
+replica_reads = ContextVar('replica_reads', default=False)
+
+
+class ReplicaRouter:
+    """
+    Sends reads to a random alias of DATABASE_REPLICAS when the current request
+    allows it and no transaction is open on the primary, everything else to the
+    primary. Replicas are copies of the primary, so relations and migrations are
+    only decided for the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas or not replica_reads.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.DATABASE_REPLICAS
+
+
+def pin_key(user_id):
+    return f'dbpin:{user_id}'
+
+
+def use_primary():
+    replica_reads.set(False)
+
+
+def record_write(user_id):
+    caches[settings.REPLICA_PIN_CACHE].set(pin_key(user_id), 1, timeout=settings.REPLICA_PIN_SECONDS)
+
+
+def pin_if_recent_write(user_id):
+    """
+    Keeps a user who wrote within REPLICA_PIN_SECONDS on the primary, whatever
+    client they come back from. Called once the request user is known.
+    """
+    if replica_reads.get() and caches[settings.REPLICA_PIN_CACHE].get(pin_key(user_id)):
+        use_primary()
+
+
+def start_request(request):
+    allowed = bool(settings.DATABASE_REPLICAS) and request.method in SAFE_METHODS \
+        and PIN_COOKIE not in request.COOKIES
+    return replica_reads.set(allowed)
+
+
+def finish_request(request, response):
+    if request.method not in SAFE_METHODS and response.status_code < 400:
+        # reads of the next REPLICA_PIN_SECONDS see this write
+        response.set_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax')
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            record_write(user.pk)
+    return response
+
+
+@sync_and_async_middleware
+def replica_pinning_middleware(get_response):
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            token = start_request(request)
+            try:
+                response = await get_response(request)
+            finally:
+                replica_reads.reset(token)
+            return finish_request(request, response)
+    else:
+        def middleware(request):
+            token = start_request(request)
+            try:
+                response = get_response(request)
+            finally:
+                replica_reads.reset(token)
+            return finish_request(request, response)
+    return middleware
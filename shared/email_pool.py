@@ -0,0 +1,214 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.core.mail import get_connection
+
+logger = logging.getLogger(__name__)
+
+_stop = object()
+
+
+class EmailPool:
+    """
+    A fixed number of worker threads sending queued messages. Each worker keeps
+    one backend connection open while there is work and sends whatever is queued,
+    up to `batch_size` messages, over it. When the queue is
+    full, send() waits up to `block_timeout` seconds and then drops the message.
+    """
+
+    def __init__(self, workers=2, queue_size=1000, batch_size=50, block_timeout=1.0, idle_timeout=30.0,
+                 connection_factory=get_connection):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.block_timeout = block_timeout
+        self.idle_timeout = idle_timeout
+        self.connection_factory = connection_factory
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.threads = []
+        self.counters = {
+            'sent': 0,
+            'failed': 0,
+            'dropped': 0,
+            'batches': 0,
+            'connections_opened': 0,
+            'latency_total': 0.0,
+            'latency_samples': 0,
+            'latency_max': 0.0,
+        }
+
+    def start(self):
+        with self.lock:
+            if self.threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self.run, name=f'email-{i}', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def send(self, message, future=None):
+        """
+        Queues `message`, returns False if it was dropped because the queue stayed full.
+        """
+        self.start()
+        try:
+            self.queue.put((message, time.monotonic(), future), block=self.block_timeout != 0,
+                           timeout=self.block_timeout or None)
+        except queue.Full as e:
+            self.count(dropped=1)
+            logger.warning("Email queue is full, dropping message to %s", message.to)
+            if future is not None:
+                future.set_exception(e)
+            return False
+        return True
+
+    def submit(self, message):
+        """
+        Queues `message` and returns a Future that resolves once it was sent, or
+        raises why it was not.
+        """
+        future = Future()
+        self.send(message, future)
+        return future
+
+    def run(self):
+        connection = None
+        while True:
+            try:
+                item = self.queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                # nothing to send for a while, do not keep the server connection open
+                if connection is not None:
+                    self.close(connection)
+                    connection = None
+                continue
+            if item is _stop:
+                self.queue.task_done()
+                break
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _stop:
+                    # hand it on to the worker it was meant for
+                    self.queue.task_done()
+                    self.queue.put(_stop)
+                    break
+                batch.append(item)
+            connection = self.deliver(connection, batch)
+            for _ in batch:
+                self.queue.task_done()
+        if connection is not None:
+            self.close(connection)
+
+    def deliver(self, connection, batch):
+        """
+        Sends the batch over `connection` one message at a time, so a failure is
+        pinned to the message it happened on: messages that already went out are
+        not sent again and the failed one is retried once over a new connection.
+        A message whose send raised may still have reached the server, so delivery
+        is at least once for that message only. Returns the connection to reuse
+        for the next batch.
+        """
+        sent = failed = 0
+        latencies = []
+        for message, queued, future in batch:
+            for _ in range(2):
+                try:
+                    if connection is None:
+                        connection = self.connection_factory(fail_silently=False)
+                        connection.open()
+                        self.count(connections_opened=1)
+                    delivered = connection.send_messages([message]) or 0
+                    break
+                except Exception as e:
+                    logger.exception("Sending email to %s failed", message.to)
+                    error = e
+                    if connection is not None:
+                        self.close(connection)
+                        connection = None
+            else:
+                failed += 1
+                if future is not None:
+                    future.set_exception(error)
+                continue
+            sent += delivered
+            failed += 1 - delivered
+            latencies.append(time.monotonic() - queued)
+            if future is not None:
+                if delivered:
+                    future.set_result(True)
+                else:
+                    future.set_exception(RuntimeError("The email backend did not accept the message"))
+
+        self.count(sent=sent, failed=failed, batches=1)
+        if latencies:
+            self.count(latency_total=sum(latencies), latency_samples=len(latencies), latency_max=max(latencies))
+        return connection
+
+    @staticmethod
+    def close(connection):
+        try:
+            connection.close()
+        except Exception:
+            logger.exception("Closing email connection failed")
+
+    def count(self, latency_max=None, **deltas):
+        with self.lock:
+            for key, delta in deltas.items():
+                self.counters[key] += delta
+            if latency_max is not None:
+                self.counters['latency_max'] = max(self.counters['latency_max'], latency_max)
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+        latency_total = counters.pop('latency_total')
+        samples = counters.pop('latency_samples')
+        counters.update({
+            'workers': len(self.threads),
+            'queue_depth': self.queue.qsize(),
+            'queue_size': self.queue.maxsize,
+            'latency_avg': latency_total / samples if samples else 0.0,
+        })
+        return counters
+
+    def join(self):
+        """
+        Blocks until every queued message has been handled.
+        """
+        self.queue.join()
+
+    def stop(self, timeout=None):
+        with self.lock:
+            threads, self.threads = self.threads, []
+        for _ in threads:
+            self.queue.put(_stop)
+        for thread in threads:
+            thread.join(timeout)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_email_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = EmailPool(
+                workers=settings.EMAIL_WORKERS,
+                queue_size=settings.EMAIL_QUEUE_SIZE,
+                batch_size=settings.EMAIL_BATCH_SIZE,
+                block_timeout=settings.EMAIL_QUEUE_TIMEOUT,
+            )
+            # let queued messages go out when the worker process shuts down
+            atexit.register(_pool.stop, timeout=10)
+        return _pool
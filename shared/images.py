@@ -0,0 +1,156 @@
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.db.models.functions import Now
+from PIL import Image, ImageOps
+
+try:
+    from pillow_heif import register_heif_opener
+except ImportError:
+    register_heif_opener = None
+else:
+    # HEIC/HEIF uploads can only be decoded with the plugin installed
+    register_heif_opener()
+
+logger = logging.getLogger(__name__)
+
+
+def render_variants(data, sizes, image_format='WEBP', quality=80):
+    """
+    Decodes `data`, applies its EXIF orientation and returns {name: encoded bytes}
+    for every (name, longest side) in `sizes`. Runs in a worker process, the
+    output carries no EXIF since it is never passed to save().
+    """
+    with Image.open(BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        variants = {}
+        for name, size in sizes.items():
+            variant = image.copy()
+            variant.thumbnail((size, size), Image.Resampling.LANCZOS)
+            output = BytesIO()
+            variant.save(output, format=image_format, quality=quality, method=4)
+            variants[name] = output.getvalue()
+    return variants
+
+
+def variant_name(name, variant):
+    head, tail = os.path.split(name)
+    stem = os.path.splitext(tail)[0]
+    extension = settings.IMAGE_VARIANT_FORMAT.lower()
+    return os.path.join(head, 'variants', f'{stem}_{variant}.{extension}')
+
+
+def generate_variants(instance, field_name, variants_field, executor=None):
+    """
+    Renders and stores the variants of `instance.<field_name>` and records their
+    storage names in `instance.<variants_field>`. The row is only updated if the
+    field still holds the same file, a newer upload gets its own run.
+    """
+    field_file = getattr(instance, field_name)
+    if not field_file:
+        return {}
+    with field_file.storage.open(field_file.name, 'rb') as source:
+        data = source.read()
+    args = (data, settings.IMAGE_VARIANTS, settings.IMAGE_VARIANT_FORMAT)
+    if executor is None:
+        rendered = render_variants(*args)
+    else:
+        rendered = executor.submit(render_variants, *args).result()
+
+    variants = {}
+    for variant, content in rendered.items():
+        variants[variant] = field_file.storage.save(variant_name(field_file.name, variant), ContentFile(content))
+    # moving updated_time invalidates the validators clients cached with the original image
+    updated = type(instance)._base_manager.filter(pk=instance.pk, **{field_name: field_file.name}) \
+        .update(**{variants_field: variants, 'updated_time': Now()})
+    if not updated:
+        for name in variants.values():
+            field_file.storage.delete(name)
+        return {}
+    setattr(instance, variants_field, variants)
+    return variants
+
+
+class ImagePipeline:
+    """
+    Runs `generate_variants` off the request path. Decoding and resizing happen in
+    a process pool of IMAGE_WORKERS processes, storage and database I/O in as many
+    threads. At most IMAGE_QUEUE_SIZE images wait at a time, beyond that they are
+    dropped and left to `manage.py process_images`.
+    """
+
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.slots = threading.BoundedSemaphore(queue_size)
+        self.lock = threading.Lock()
+        self.processes = None
+        self.threads = None
+
+    def start(self):
+        with self.lock:
+            if self.processes is None:
+                self.processes = ProcessPoolExecutor(max_workers=self.workers)
+                self.threads = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='images')
+
+    def submit(self, instance, field_name, variants_field):
+        if not self.slots.acquire(blocking=False):
+            logger.warning("Image queue is full, skipping %s %s", instance._meta.label, instance.pk)
+            return None
+        self.start()
+        return self.threads.submit(self.run, instance, field_name, variants_field)
+
+    def run(self, instance, field_name, variants_field):
+        close_old_connections()
+        try:
+            return generate_variants(instance, field_name, variants_field, self.processes)
+        except Exception:
+            logger.exception("Could not process %s of %s %s", field_name, instance._meta.label, instance.pk)
+        finally:
+            self.slots.release()
+            close_old_connections()
+
+
+_pipeline = None
+
+
+def get_image_pipeline():
+    global _pipeline
+    if _pipeline is None:
+        _pipeline = ImagePipeline(settings.IMAGE_WORKERS, settings.IMAGE_QUEUE_SIZE)
+    return _pipeline
+
+
+def schedule_variants(instance, field_name, variants_field):
+    """
+    Queues variant generation once the current transaction commits. With
+    IMAGE_WORKERS = 0 the variants are rendered inline instead.
+    """
+    def process():
+        if settings.IMAGE_WORKERS:
+            get_image_pipeline().submit(instance, field_name, variants_field)
+        else:
+            generate_variants(instance, field_name, variants_field)
+
+    if getattr(instance, field_name):
+        transaction.on_commit(process)
+
+
+def variant_urls(field_file, variants, request=None):
+    """
+    URLs of every configured variant, the original's URL for those not rendered yet.
+    """
+    if not field_file:
+        return None
+    urls = {}
+    for variant in settings.IMAGE_VARIANTS:
+        name = variants.get(variant) if variants else None
+        url = field_file.storage.url(name) if name else field_file.url
+        urls[variant] = request.build_absolute_uri(url) if request is not None else url
+    return urls
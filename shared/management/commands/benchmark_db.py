@@ -0,0 +1,109 @@
+import copy
+import threading
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.utils import load_backend
+
+MODES = ('per_request', 'persistent', 'pool')
+
+
+def percentile(latencies, fraction):
+    return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)]
+
+
+class Command(BaseCommand):
+    help = ("Time simulated requests, each running one query between the request_started and "
+            "request_finished connection handling, with a new connection per request, persistent "
+            "connections and the psycopg pool")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=8, help="Threads issuing requests")
+        parser.add_argument('--pool-size', type=int, default=8)
+        parser.add_argument('--query', default='SELECT 1')
+        parser.add_argument('--mode', choices=MODES, action='append', help="Repeat to pick several, default all")
+
+    def handle(self, *args, **options):
+        for mode in options['mode'] or MODES:
+            settings_dict = copy.deepcopy(connections[options['database']].settings_dict)
+            settings_dict['CONN_MAX_AGE'] = 600 if mode == 'persistent' else 0
+            settings_dict['CONN_HEALTH_CHECKS'] = True
+            settings_dict['OPTIONS'] = dict(settings_dict['OPTIONS'])
+            settings_dict['OPTIONS'].pop('pool', None)
+            if mode == 'pool':
+                settings_dict['OPTIONS']['pool'] = {
+                    'min_size': options['pool_size'], 'max_size': options['pool_size'], 'timeout': 30,
+                }
+            try:
+                self.run(mode, settings_dict, options)
+            except ImproperlyConfigured as e:
+                self.stdout.write(f"{mode}: skipped, {' '.join(str(e).split())}")
+
+    def run(self, mode, settings_dict, options):
+        alias = f'benchmark_{mode}'
+        backend = load_backend(settings_dict['ENGINE'])
+        opened = []
+        latencies = []
+        lock = threading.Lock()
+        errors = []
+
+        def count_connection(sender, connection, **kwargs):
+            if connection.alias == alias:
+                opened.append(1)
+
+        def client(requests):
+            wrapper = backend.DatabaseWrapper(settings_dict, alias)
+            timings = []
+            try:
+                for _ in range(requests):
+                    started = time.perf_counter()
+                    wrapper.close_if_unusable_or_obsolete()
+                    with wrapper.cursor() as cursor:
+                        cursor.execute(options['query'])
+                        cursor.fetchall()
+                    wrapper.close_if_unusable_or_obsolete()
+                    timings.append(time.perf_counter() - started)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                wrapper.close()
+                with lock:
+                    latencies.extend(timings)
+
+        share, extra = divmod(options['requests'], options['concurrency'])
+        threads = [threading.Thread(target=client, args=(share + (i < extra),))
+                   for i in range(options['concurrency'])]
+        connection_created.connect(count_connection)
+        stats = None
+        try:
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            wrapper = backend.DatabaseWrapper(settings_dict, alias)
+            pool = getattr(wrapper, 'pool', None)
+            if pool is not None:
+                stats = pool.get_stats()
+                wrapper.close_pool()
+        finally:
+            connection_created.disconnect(count_connection)
+        if errors:
+            raise errors[0]
+
+        latencies.sort()
+        connections_opened = stats['connections_num'] if stats else len(opened)
+        self.stdout.write(
+            f"{mode}: {len(latencies)} requests in {elapsed:.2f}s, {len(latencies) / elapsed:.0f} req/s, "
+            f"{connections_opened} connections opened"
+        )
+        self.stdout.write(
+            f"  latency avg {sum(latencies) / len(latencies) * 1000:.2f}ms, "
+            f"p50 {percentile(latencies, 0.5) * 1000:.2f}ms, p99 {percentile(latencies, 0.99) * 1000:.2f}ms"
+        )
@@ -0,0 +1,34 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from shared.outbox import deliver_batch
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Deliver messages written to the outbox, retrying failures with exponential backoff"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--interval', type=float, default=1,
+                            help="Seconds to wait when nothing is due")
+        parser.add_argument('--once', action='store_true', help="Deliver what is due and exit")
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                sent, failed = deliver_batch(options['batch_size'])
+            except Exception:
+                # the claimed rows are retried once their lease runs out
+                logger.exception("Outbox delivery failed")
+                sent = failed = 0
+            if sent or failed:
+                self.stdout.write(f"Sent {sent}, failed {failed}")
+            if sent + failed == options['batch_size']:
+                continue
+            if options['once']:
+                return
+            time.sleep(options['interval'])
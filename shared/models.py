@@ -1,5 +1,24 @@
 import uuid
 from django.db import models
+from django.db.models import F
+from django.db.models.functions import Greatest, Now
+from django.utils import timezone
+
+
+class CounterQuerySet(models.QuerySet):
+
+    def increment(self, pk, **deltas):
+        return self.filter(pk=pk).update(**self.counter_updates(deltas))
+
+    @staticmethod
+    def counter_updates(deltas):
+        updates = {}
+        for field, delta in deltas.items():
+            # never let a drifted counter go below zero, reconcile_counters fixes the rest
+            updates[field] = F(field) + delta if delta >= 0 else Greatest(F(field) + delta, 0)
+        # counters are part of what clients cache, so they move Last-Modified too
+        updates['updated_time'] = Now()
+        return updates
 
 
 class BaseModel(models.Model):
@@ -9,3 +28,48 @@ class BaseModel(models.Model):
 
     class Meta:
         abstract = True
+
+
+class StoredFile(BaseModel):
+    """
+    A file kept by ContentAddressedStorage and how many references point at it.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField(default=0)
+    refcount = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount})"
+
+
+class OutboxMessage(BaseModel):
+    """
+    A message written in the same transaction as the change that caused it and
+    delivered afterwards by `manage.py process_outbox`.
+    """
+    PENDING, SENT, FAILED = ('pending', 'sent', 'failed')
+    STATUS_CHOICES = (
+        (PENDING, PENDING),
+        (SENT, SENT),
+        (FAILED, FAILED),
+    )
+
+    recipient = models.CharField(max_length=255)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    content_subtype = models.CharField(max_length=31, default='plain')
+    status = models.CharField(max_length=31, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    available_time = models.DateTimeField(default=timezone.now)
+    sent_time = models.DateTimeField(null=True, blank=True)
+    # seconds from being written to being handed to the mail backend
+    latency = models.FloatField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_time'], name='outbox_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {self.recipient} ({self.status})"
@@ -0,0 +1,109 @@
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.db import transaction
+from django.utils import timezone
+
+from shared.email_pool import get_email_pool
+from shared.models import OutboxMessage
+
+
+def enqueue_email(to_email, subject, body, content_type='plain'):
+    """
+    Writes the email to the outbox. Inside a transaction it only becomes visible
+    to the worker, and is only sent, once that transaction commits.
+    """
+    return OutboxMessage.objects.create(
+        recipient=to_email,
+        subject=subject,
+        body=body,
+        content_subtype=content_type,
+    )
+
+
+def retry_delay(attempts):
+    return min(settings.OUTBOX_RETRY_BACKOFF * 2 ** (attempts - 1), settings.OUTBOX_RETRY_BACKOFF_MAX)
+
+
+def claim_batch(batch_size):
+    """
+    Leases up to `batch_size` due messages for OUTBOX_LEASE_SECONDS in one short
+    transaction: the attempt is counted and `available_time` moves to the end of
+    the lease, so no other worker picks them up while they are being sent, and a
+    worker that dies mid-send leaves them to be retried once the lease runs out.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        messages = list(
+            OutboxMessage.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboxMessage.PENDING, available_time__lte=now)
+            .order_by('available_time')[:batch_size]
+        )
+        for message in messages:
+            message.attempts += 1
+            message.available_time = now + timedelta(seconds=settings.OUTBOX_LEASE_SECONDS)
+        OutboxMessage.objects.bulk_update(messages, ['attempts', 'available_time'])
+    return messages
+
+
+def deliver_batch(batch_size=100, pool=None):
+    """
+    Claims up to `batch_size` due messages and hands them to the email pool,
+    whose workers send them over their shared connections, then records each
+    outcome. No transaction is open while the messages are sent. Returns
+    (sent, failed) counts.
+    """
+    sent = failed = 0
+    messages = claim_batch(batch_size)
+    if not messages:
+        return sent, failed
+    pool = pool or get_email_pool()
+    futures = []
+    for message in messages:
+        email = EmailMessage(subject=message.subject, body=message.body, to=[message.recipient])
+        email.content_subtype = message.content_subtype
+        futures.append(pool.submit(email))
+    in_flight = []
+    for message, future in zip(messages, futures):
+        try:
+            future.result(timeout=settings.OUTBOX_SEND_TIMEOUT)
+        except FutureTimeoutError:
+            # still being sent, the lease keeps it from being claimed again until
+            # the outcome is recorded when the send finishes
+            message.last_error = "Still sending after OUTBOX_SEND_TIMEOUT"
+            in_flight.append((message, future))
+            failed += 1
+        except Exception as e:
+            message.last_error = f'{type(e).__name__}: {e}'
+            if message.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+                message.status = OutboxMessage.FAILED
+            else:
+                message.available_time = timezone.now() + timedelta(seconds=retry_delay(message.attempts))
+            failed += 1
+        else:
+            mark_sent(message)
+            sent += 1
+    OutboxMessage.objects.bulk_update(messages, ['status', 'available_time', 'sent_time', 'latency', 'last_error'])
+    for message, future in in_flight:
+        future.add_done_callback(partial(record_late_send, message))
+    return sent, failed
+
+
+def mark_sent(message):
+    message.status = OutboxMessage.SENT
+    message.sent_time = timezone.now()
+    message.latency = (message.sent_time - message.created_time).total_seconds()
+    message.last_error = ''
+
+
+def record_late_send(message, future):
+    # a failed late send is retried when its lease runs out
+    if future.exception() is not None:
+        return
+    mark_sent(message)
+    OutboxMessage.objects.filter(pk=message.pk, status=OutboxMessage.PENDING, attempts=message.attempts).update(
+        status=message.status, sent_time=message.sent_time, latency=message.latency, last_error=message.last_error,
+    )
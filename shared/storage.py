@@ -0,0 +1,99 @@
+import hashlib
+import os
+import posixpath
+import re
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+
+from shared.models import StoredFile
+
+hashed_name_regex = re.compile(r'(^|/)([0-9a-f]{2})/([0-9a-f]{2})/(\2\3[0-9a-f]{60})(\.\w+)?$')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Names every file after the sha256 of its content, sharded as
+    `<upload_to>/ab/cd/abcd....ext`, so directories stay small and an identical
+    upload is stored once. Each save() adds a reference and each delete() drops
+    one; the file is removed with its last reference. Files without a StoredFile
+    row (written before this storage was used) are deleted right away.
+    """
+
+    def _save(self, name, content):
+        # resumable uploads already hashed the file while finalizing
+        digest = getattr(content, 'sha256', None) or self.hash_content(content)
+        target = self.hashed_name(name, digest)
+        with transaction.atomic():
+            # the row lock orders this against delete(), which drops the last
+            # reference and the file under the same lock; a row deleted while we
+            # waited for it is created again
+            refcount = None
+            while refcount is None:
+                StoredFile.objects.bulk_create([StoredFile(name=target, size=content.size)], ignore_conflicts=True)
+                refcount = self.lock(target)
+            StoredFile.objects.filter(name=target).update(refcount=F('refcount') + 1)
+            if not self.exists(target):
+                saved = super(ContentAddressedStorage, self)._save(target, content)
+                if saved != target:
+                    # written concurrently with the same content, keep the first copy
+                    super(ContentAddressedStorage, self).delete(saved)
+        return target
+
+    def delete(self, name):
+        if not name:
+            return
+        with transaction.atomic():
+            refcount = self.lock(name)
+            if refcount is None and self.is_hashed_name(name):
+                # no reference left, the file went with the last one
+                return
+            if refcount is not None and refcount > 1:
+                StoredFile.objects.filter(name=name).update(refcount=F('refcount') - 1)
+                return
+            StoredFile.objects.filter(name=name).delete()
+            super(ContentAddressedStorage, self).delete(name)
+
+    @staticmethod
+    def lock(name):
+        """
+        Locks the StoredFile row of `name` until the transaction ends, returns
+        its refcount or None when there is no row.
+        """
+        return StoredFile.objects.select_for_update().filter(name=name).values_list('refcount', flat=True).first()
+
+    @staticmethod
+    def hash_content(content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        return digest.hexdigest()
+
+    @staticmethod
+    def hashed_name(name, digest):
+        directory = posixpath.dirname(name.replace(os.sep, '/'))
+        extension = os.path.splitext(name)[1].lower()
+        return posixpath.join(directory, digest[:2], digest[2:4], f'{digest}{extension}')
+
+    @staticmethod
+    def is_hashed_name(name):
+        return bool(hashed_name_regex.search(name))
+
+
+def release_files(field_file, variants=None):
+    """
+    Drops the references an instance held on its file and variants once the
+    surrounding transaction commits.
+    """
+    if not field_file:
+        return
+    storage = field_file.storage
+    names = [field_file.name] + list((variants or {}).values())
+
+    def delete():
+        for name in names:
+            storage.delete(name)
+
+    transaction.on_commit(delete)
@@ -1,3 +1,335 @@
-from django.test import TestCase
+import shutil
+import tempfile
+import threading
+from concurrent.futures import Future
+from datetime import timedelta
+from io import StringIO
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.mail import EmailMessage
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from django.db import connection, transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings, \
+    skipUnlessDBFeature
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from post.models import Post
+from shared.db_router import PIN_COOKIE, ReplicaRouter, pin_if_recent_write, replica_pinning_middleware
+from shared.email_pool import EmailPool
+from shared.models import OutboxMessage, StoredFile
+from shared.outbox import deliver_batch, enqueue_email
+from shared.storage import ContentAddressedStorage
+from users.models import User, VIA_EMAIL
+
+
+class ContentAddressedStorageTest(TestCase):
+
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        self.storage = ContentAddressedStorage(location=location)
+
+    def test_identical_content_is_stored_once(self):
+        first = self.storage.save('posts_images/a.JPG', ContentFile(b'same bytes'))
+        second = self.storage.save('posts_images/b.jpg', ContentFile(b'same bytes'))
+        other = self.storage.save('posts_images/c.jpg', ContentFile(b'other bytes'))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertTrue(ContentAddressedStorage.is_hashed_name(first))
+        self.assertRegex(first, r'^posts_images/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+        self.assertEqual(StoredFile.objects.get(name=first).refcount, 2)
+
+        self.storage.delete(first)
+        self.assertTrue(self.storage.exists(first))
+        self.storage.delete(second)
+        self.assertFalse(self.storage.exists(first))
+        self.assertFalse(StoredFile.objects.filter(name=first).exists())
+
+    def test_files_without_references_are_deleted(self):
+        FileSystemStorage(location=self.storage.location).save('posts_images/legacy.jpg', ContentFile(b'old'))
+        self.assertFalse(ContentAddressedStorage.is_hashed_name('posts_images/legacy.jpg'))
+        self.storage.delete('posts_images/legacy.jpg')
+        self.assertFalse(self.storage.exists('posts_images/legacy.jpg'))
+
+
+@skipUnlessDBFeature('has_select_for_update', 'test_db_allows_multiple_connections')
+class ConcurrentStorageTest(TransactionTestCase):
+
+    def test_save_waits_for_the_delete_of_the_last_reference(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        storage = ContentAddressedStorage(location=location)
+        name = storage.save('posts_images/a.jpg', ContentFile(b'same bytes'))
+        saved = []
+
+        def save():
+            try:
+                saved.append(storage.save('posts_images/b.jpg', ContentFile(b'same bytes')))
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=save)
+        # what delete() does with the last reference, with the save arriving in between
+        with transaction.atomic():
+            self.assertEqual(StoredFile.objects.select_for_update().get(name=name).refcount, 1)
+            thread.start()
+            thread.join(0.5)
+            self.assertTrue(thread.is_alive())
+            StoredFile.objects.filter(name=name).delete()
+            FileSystemStorage.delete(storage, name)
+        thread.join()
+
+        self.assertEqual(saved, [name])
+        self.assertTrue(storage.exists(name))
+        self.assertEqual(StoredFile.objects.get(name=name).refcount, 1)
+
+
+class EmailPoolTest(TestCase):
+
+    def test_messages_are_batched_over_one_connection(self):
+        pool = EmailPool(workers=1, batch_size=10, idle_timeout=0.1)
+        self.addCleanup(pool.stop)
+        gate = threading.Event()
+        connection_factory = pool.connection_factory
+
+        def slow_connection(**kwargs):
+            gate.wait(5)
+            return connection_factory(**kwargs)
+
+        pool.connection_factory = slow_connection
+        for i in range(25):
+            self.assertTrue(pool.send(EmailMessage(subject=f'message {i}', to=[f'user{i}@example.com'])))
+        gate.set()
+        pool.join()
+
+        self.assertEqual(len(mail.outbox), 25)
+        stats = pool.stats()
+        self.assertEqual(stats['sent'], 25)
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertLessEqual(stats['batches'], 4)
+        self.assertEqual(stats['connections_opened'], 1)
+        self.assertGreater(stats['latency_max'], 0)
+
+    def test_failed_send_retries_only_that_message(self):
+        sent = []
+
+        class FlakyBackend(BaseEmailBackend):
+            failures = {'message 2'}
+
+            def send_messages(self, email_messages):
+                for message in email_messages:
+                    if message.subject in self.failures:
+                        self.failures.discard(message.subject)
+                        raise ConnectionResetError("connection dropped")
+                    sent.append(message.subject)
+                return len(email_messages)
+
+        pool = EmailPool(workers=0, batch_size=10, connection_factory=FlakyBackend)
+        batch = [(EmailMessage(subject=f'message {i}', to=['user@example.com']), 0, None) for i in range(5)]
+        with self.assertLogs('shared.email_pool', 'ERROR'):
+            pool.deliver(None, batch)
+        self.assertEqual(sent, [f'message {i}' for i in range(5)])
+        stats = pool.stats()
+        self.assertEqual((stats['sent'], stats['failed'], stats['connections_opened']), (5, 0, 2))
+
+    def test_full_queue_sheds_messages(self):
+        pool = EmailPool(workers=0, queue_size=2, block_timeout=0)
+        with self.assertLogs('shared.email_pool', 'WARNING'):
+            results = [pool.send(EmailMessage(subject='hi', to=['user@example.com'])) for _ in range(3)]
+        self.assertEqual(results, [True, True, False])
+        self.assertEqual(pool.stats()['dropped'], 1)
+        self.assertEqual(pool.stats()['queue_depth'], 2)
+
+
+class FailingEmailBackend(BaseEmailBackend):
+
+    def send_messages(self, email_messages):
+        raise ConnectionRefusedError("SMTP server is down")
+
+
+class OutboxTest(APITestCase):
+
+    def test_signup_code_is_sent_by_the_worker(self):
+        response = self.client.post(reverse('signup'), {'email_phone_number': 'new@example.com'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(mail.outbox), 0)
+        message = OutboxMessage.objects.get()
+        self.assertEqual(message.recipient, 'new@example.com')
+
+        call_command('process_outbox', once=True, stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['new@example.com'])
+        message.refresh_from_db()
+        self.assertEqual(message.status, OutboxMessage.SENT)
+        self.assertIsNotNone(message.latency)
+
+    def test_batches_go_out_through_the_email_pool(self):
+        for i in range(5):
+            enqueue_email(f'user{i}@example.com', "Registration", f'{i}')
+        pool = EmailPool(workers=1, batch_size=10)
+        self.addCleanup(pool.stop)
+        self.assertEqual(deliver_batch(pool=pool), (5, 0))
+        self.assertEqual(sorted(email.body for email in mail.outbox), ['0', '1', '2', '3', '4'])
+        stats = pool.stats()
+        self.assertEqual((stats['sent'], stats['connections_opened']), (5, 1))
+        self.assertEqual(OutboxMessage.objects.filter(status=OutboxMessage.SENT).count(), 5)
+
+    @override_settings(OUTBOX_SEND_TIMEOUT=0.01)
+    def test_slow_sends_stay_leased_until_they_finish(self):
+        message = enqueue_email('user@example.com', "Registration", "1234")
+        futures = []
+
+        class SlowPool:
+            def submit(self, email):
+                # the lease is committed before anything is sent
+                futures.append((Future(), OutboxMessage.objects.values_list('attempts', flat=True).get()))
+                return futures[-1][0]
+
+        self.assertEqual(deliver_batch(pool=SlowPool()), (0, 1))
+        self.assertEqual(futures[0][1], 1)
+        # still in flight, so not claimed again
+        self.assertEqual(deliver_batch(pool=SlowPool()), (0, 0))
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), (OutboxMessage.PENDING, 1))
+        self.assertGreater(message.available_time, timezone.now() + timedelta(seconds=60))
+
+        futures[0][0].set_result(True)
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.last_error), (OutboxMessage.SENT, ''))
+
+    @override_settings(EMAIL_BACKEND='shared.tests.FailingEmailBackend', OUTBOX_MAX_ATTEMPTS=2)
+    def test_failures_are_retried_with_backoff(self):
+        pool = EmailPool(workers=1)
+        self.addCleanup(pool.stop)
+        message = enqueue_email('user@example.com', "Registration", "1234")
+        with self.assertLogs('shared.email_pool', 'ERROR'):
+            self.assertEqual(deliver_batch(pool=pool), (0, 1))
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), (OutboxMessage.PENDING, 1))
+        self.assertGreater(message.available_time, timezone.now())
+        self.assertEqual(deliver_batch(pool=pool), (0, 0))
+
+        OutboxMessage.objects.update(available_time=timezone.now())
+        with self.assertLogs('shared.email_pool', 'ERROR'):
+            deliver_batch(pool=pool)
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), (OutboxMessage.FAILED, 2))
+        self.assertIn('SMTP server is down', message.last_error)
+
+
+class ThrottleTest(APITestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.addCleanup(caches['default'].clear)
+
+    def login(self, user_input, ip='10.0.0.1'):
+        return self.client.post(reverse('login'), {'user_input': user_input, 'password': 'password-wrong'},
+                                REMOTE_ADDR=ip)
+
+    def test_identifier_budget_holds_across_ips(self):
+        for i in range(10):
+            self.assertEqual(self.login('target', ip=f'10.0.0.{i}').status_code, 400)
+        response = self.login('Target', ip='10.0.1.1')
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(0 < int(response['Retry-After']) <= 120)
+        # other accounts are not affected
+        self.assertEqual(self.login('bystander', ip='10.0.1.1').status_code, 400)
+
+    def test_ip_budget_and_reads(self):
+        for i in range(60):
+            self.assertEqual(self.login(f'user{i}').status_code, 400)
+        self.assertEqual(self.login('one-more').status_code, 429)
+        self.assertEqual(self.login('one-more', ip='10.0.0.2').status_code, 400)
+        # reads are never throttled
+        self.assertEqual(self.client.get(reverse('post_list'), REMOTE_ADDR='10.0.0.1').status_code, 200)
+
+    def test_forwarded_for_cannot_dodge_the_ip_budget(self):
+        for i in range(60):
+            response = self.client.post(reverse('login'), {'user_input': f'user{i}', 'password': 'password-wrong'},
+                                        REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR=f'192.168.0.{i}')
+            self.assertEqual(response.status_code, 400)
+        response = self.client.post(reverse('login'), {'user_input': 'one-more', 'password': 'password-wrong'},
+                                    REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='192.168.1.1')
+        self.assertEqual(response.status_code, 429)
+
+    def test_views_can_throttle_reads(self):
+        user = User.objects.create(username='verifier', email='verifier@example.com', auth_type=VIA_EMAIL)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {user.token()['access']}")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.get(reverse('new_verify')).status_code, 200)
+        for _ in range(9):
+            self.assertEqual(self.client.get(reverse('new_verify')).status_code, 400)
+        self.assertEqual(self.client.get(reverse('new_verify')).status_code, 429)
+
+
+class DatabaseConnectionTest(APITestCase):
+
+    def test_stats_are_admin_only(self):
+        self.assertEqual(self.client.get(reverse('db_stats')).status_code, 401)
+        admin = User.objects.create(username='admin', password='password-admin', is_staff=True)
+        self.client.force_authenticate(admin)
+        response = self.client.get(reverse('db_stats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(response.data['default']['mode'], ('pool', 'persistent', 'per_request'))
+
+    def test_benchmark_reuses_persistent_connections(self):
+        out = StringIO()
+        call_command('benchmark_db', '--requests', '20', '--concurrency', '2',
+                     '--mode', 'per_request', '--mode', 'persistent', stdout=out)
+        per_request, _, persistent, _ = out.getvalue().splitlines()
+        self.assertTrue(per_request.startswith('per_request: 20 requests'))
+        # one per thread
+        self.assertTrue(persistent.endswith(', 2 connections opened'))
+
+
+@override_settings(DATABASE_REPLICAS=['replica_0'])
+class ReplicaRouterTest(SimpleTestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.factory = RequestFactory()
+
+    def route(self, request, user=None):
+        """
+        Passes `request` through the middleware and returns where a read made by
+        the view would go, after authentication found `user`.
+        """
+        def view(request):
+            if user is not None:
+                request.user = user
+                pin_if_recent_write(user.pk)
+            return HttpResponse(ReplicaRouter().db_for_read(Post) or 'default')
+
+        response = replica_pinning_middleware(view)(request)
+        return response.content.decode(), response
+
+    def test_reads_go_to_replicas_and_writes_pin(self):
+        user = User(username='writer')
+        self.assertEqual(self.route(self.factory.get('/posts/list/'), user)[0], 'replica_0')
+        self.assertEqual(self.route(self.factory.post('/posts/1/liking/'), user)[0], 'default')
+        self.assertIsNone(ReplicaRouter().db_for_read(Post))
+
+        _, response = self.route(self.factory.put('/posts/1/liking/'), user)
+        self.assertIn(PIN_COOKIE, response.cookies)
+        # the same user from a client without the cookie
+        self.assertEqual(self.route(self.factory.get('/posts/list/'), user)[0], 'default')
+        self.assertEqual(self.route(self.factory.get('/posts/list/'), User(username='other'))[0], 'replica_0')
+        self.assertEqual(self.route(self.factory.get('/posts/list/'), AnonymousUser())[0], 'replica_0')
+
+    def test_cookie_pins_anonymous_clients(self):
+        request = self.factory.get('/posts/list/')
+        request.COOKIES[PIN_COOKIE] = '1'
+        self.assertEqual(self.route(request)[0], 'default')
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas(self):
+        self.assertEqual(self.route(self.factory.get('/posts/list/'))[0], 'default')
@@ -0,0 +1,112 @@
+import hashlib
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class SlidingWindowThrottle(SimpleRateThrottle):
+    """
+    Sliding window counter kept in THROTTLE_CACHE, so the limit holds across
+    workers. Each window of `duration` seconds has one counter; the request rate
+    is estimated as the current count plus the previous window's count weighted
+    by how much of it still overlaps the sliding window. That is two cache reads
+    and one increment per request, whatever the budget.
+
+    Only writes are throttled, and only on views with a `throttle_scope`; a view
+    whose reads have side effects lists the methods to throttle in
+    `throttle_methods`. The budget comes from
+    DEFAULT_THROTTLE_RATES['<throttle_scope>.<kind>'], a view without an entry
+    for this kind is not limited by it.
+    """
+    kind = None
+
+    def __init__(self):
+        self.cache = caches[settings.THROTTLE_CACHE]
+        self.wait_seconds = None
+
+    def get_ident_for(self, request, view):
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        methods = getattr(view, 'throttle_methods', None)
+        if scope is None or (request.method not in methods if methods else request.method in SAFE_METHODS):
+            return True
+        self.scope = f'{scope}.{self.kind}'
+        self.rate = api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+        if self.rate is None:
+            return True
+        ident = self.get_ident_for(request, view)
+        if not ident:
+            return True
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+
+        now = time.time()
+        window = int(now // self.duration)
+        elapsed = now - window * self.duration
+        key = self.cache_format % {'scope': self.scope, 'ident': ident}
+        current_key, previous_key = f'{key}:{window}', f'{key}:{window - 1}'
+        # counters live for two windows, long enough to serve as the previous one
+        self.cache.add(current_key, 0, timeout=self.duration * 2)
+        current = self.cache.incr(current_key)
+        previous = self.cache.get(previous_key, 0)
+        weight = 1 - elapsed / self.duration
+        if previous * weight + current <= self.num_requests:
+            return True
+
+        # a refused request does not use up the budget
+        self.cache.decr(current_key)
+        self.wait_seconds = self.retry_after(previous, current - 1, elapsed)
+        return False
+
+    def retry_after(self, previous, current, elapsed):
+        """
+        Seconds until one more request fits under the estimate.
+        """
+        room = self.num_requests - 1 - current
+        if room >= 0 and previous:
+            # wait for enough of the previous window to slide out
+            return max(math.ceil(self.duration * (1 - room / previous) - elapsed), 1)
+        # the current window alone is full, wait until it is the previous one and has slid out enough
+        wait = self.duration - elapsed + self.duration * (1 - (self.num_requests - 1) / max(current, 1))
+        return max(math.ceil(wait), 1)
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class IPThrottle(SlidingWindowThrottle):
+    kind = 'ip'
+
+    def get_ident_for(self, request, view):
+        return self.get_ident(request)
+
+
+class UserThrottle(SlidingWindowThrottle):
+    kind = 'user'
+
+    def get_ident_for(self, request, view):
+        if request.user and request.user.is_authenticated:
+            return str(request.user.pk)
+        return None
+
+
+class IdentifierThrottle(SlidingWindowThrottle):
+    """
+    Keyed by the login, email or phone number the request is about, named by the
+    view's `throttle_identifier` field, so spreading attempts over many IPs does
+    not help against one account.
+    """
+    kind = 'identifier'
+
+    def get_ident_for(self, request, view):
+        field = getattr(view, 'throttle_identifier', None)
+        value = request.data.get(field) if field else None
+        if not isinstance(value, str) or not value.strip():
+            return None
+        return hashlib.sha256(value.strip().lower().encode()).hexdigest()
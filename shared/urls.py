@@ -0,0 +1,8 @@
+from django.urls import path
+
+from shared.views import EmailStatsView, DatabaseStatsView
+
+urlpatterns = [
+    path('stats/email/', EmailStatsView.as_view(), name='email_stats'),
+    path('stats/db/', DatabaseStatsView.as_view(), name='db_stats'),
+]
@@ -1,9 +1,11 @@
 import re
-import threading
 import phonenumbers
 from django.core.mail import EmailMessage
 from django.template.loader import render_to_string
 from rest_framework.exceptions import ValidationError
+
+from shared.email_pool import get_email_pool
+from shared.outbox import enqueue_email
 # from decouple import config
 # from twilio.rest import Client
 
@@ -49,16 +51,6 @@ def check_user_type(user_input):
 
 
 
-class EmailThread(threading.Thread):
-
-    def __init__(self, email):
-        self.email = email
-        threading.Thread.__init__(self)
-
-    def run(self):
-        self.email.send()
-
-
 class Email:
 
     @staticmethod
@@ -70,7 +62,7 @@ class Email:
         )
         if data.get('content_type') == 'html':
             email.content_subtype = 'html'
-        EmailThread(email).start()
+        get_email_pool().send(email)
 
 
 def send_email(email, code):
@@ -78,13 +70,11 @@ def send_email(email, code):
         'email/authentication/activate_account.html',
         {'code': code},
     )
-    Email.send_email(
-        {
-            'subject': "Registration",
-            'to_email': email,
-            'body': html_content,
-            'content_type': "html",
-        }
+    enqueue_email(
+        to_email=email,
+        subject="Registration",
+        body=html_content,
+        content_type='html',
     )
 
 # def send_phone_number(phone_number, code):
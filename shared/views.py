@@ -1,3 +1,41 @@
-from django.shortcuts import render
+from django.db import connections
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
-# Create your views here.
+from shared.email_pool import get_email_pool
+
+
+class EmailStatsView(APIView):
+    """
+    Counters of this process's email pool: queue depth, sent/failed/dropped and send latency in seconds.
+    """
+    permission_classes = [IsAdminUser, ]
+
+    def get(self, request):
+        return Response(get_email_pool().stats())
+
+
+class DatabaseStatsView(APIView):
+    """
+    Connection handling of every database in this process. With DB_POOL on these are
+    the psycopg pool's counters (size, available, waiting requests, errors, ...).
+    """
+    permission_classes = [IsAdminUser, ]
+
+    def get(self, request):
+        stats = {}
+        for alias in connections:
+            connection = connections[alias]
+            pool = getattr(connection, 'pool', None)
+            if pool is not None:
+                stats[alias] = {'mode': 'pool', **pool.get_stats()}
+                continue
+            conn_max_age = connection.settings_dict['CONN_MAX_AGE']
+            stats[alias] = {
+                'mode': 'persistent' if conn_max_age else 'per_request',
+                'conn_max_age': conn_max_age,
+                'health_checks': connection.settings_dict['CONN_HEALTH_CHECKS'],
+                'connected': connection.connection is not None,
+            }
+        return Response(stats)
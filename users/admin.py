@@ -1,5 +1,5 @@
 from django.contrib import admin
-from users.models import User, UserConfirmation
+from users.models import User, UserConfirmation, UserFollow
 
 
 @admin.register(User)
@@ -11,3 +11,9 @@ class UserAdmin(admin.ModelAdmin):
 @admin.register(UserConfirmation)
 class UserConfirmationAdmin(admin.ModelAdmin):
     list_display = ('user', 'verify_type', 'expiration_time', 'is_confirmed')
+
+
+@admin.register(UserFollow)
+class UserFollowAdmin(admin.ModelAdmin):
+    list_display = ('follower', 'following', 'created_time')
+    search_fields = ('follower__username', 'following__username')
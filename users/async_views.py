@@ -0,0 +1,50 @@
+import math
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views import View
+from rest_framework.exceptions import APIException, Throttled, ValidationError
+from rest_framework.request import Request
+from rest_framework.serializers import as_serializer_error
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from users.serializers import LoginSerializer
+from users.views import LoginView
+
+
+class AsyncLoginView(View):
+    """
+    LoginView as a native async view. Under config/asgi.py the password is checked
+    on the hasher pool while the event loop keeps serving other requests, and a
+    full pool refuses the login with 429 at once instead of queueing it. Throttles
+    and response shapes are those of LoginView.
+    """
+    serializer_class = LoginSerializer
+    throttle_scope = LoginView.throttle_scope
+    throttle_identifier = LoginView.throttle_identifier
+
+    async def post(self, request, *args, **kwargs):
+        try:
+            drf_request = Request(request, parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES])
+            await sync_to_async(self.check_throttles)(drf_request)
+            serializer = self.serializer_class(data=drf_request.data)
+            attrs = serializer.to_internal_value(drf_request.data)
+            try:
+                data = await serializer.avalidate(attrs)
+            except ValidationError as e:
+                # shaped like the errors of serializer.is_valid()
+                raise ValidationError(as_serializer_error(e))
+        except APIException as e:
+            detail = e.detail if isinstance(e.detail, (dict, list)) else {'detail': e.detail}
+            response = JsonResponse(detail, safe=False, status=e.status_code, encoder=JSONEncoder)
+            if isinstance(e, Throttled) and e.wait is not None:
+                response['Retry-After'] = str(math.ceil(e.wait))
+            return response
+        return JsonResponse(data, encoder=JSONEncoder)
+
+    def check_throttles(self, request):
+        for throttle_class in api_settings.DEFAULT_THROTTLE_CLASSES:
+            throttle = throttle_class()
+            if not throttle.allow_request(request, self):
+                raise Throttled(throttle.wait())
@@ -0,0 +1,54 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from shared.db_router import pin_if_recent_write
+from users.models import User, ClaimsUser, TOKEN_CLAIMS, user_cache
+from users.tokens import REFRESH_JTI_CLAIM, is_blacklisted
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication without the per-request user query. Tokens carrying
+    TOKEN_CLAIMS give a ClaimsUser, older tokens are resolved through user_cache.
+    Deactivating or deleting a user blacklists their refresh tokens, which
+    revokes the access tokens issued from them within one blacklist filter sync.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+        pin_if_recent_write(user_id)
+        refresh_jti = validated_token.get(REFRESH_JTI_CLAIM)
+        if refresh_jti and is_blacklisted(refresh_jti):
+            raise AuthenticationFailed(_("Token is blacklisted"), code="token_not_valid")
+
+        if all(claim in validated_token for claim in TOKEN_CLAIMS):
+            if api_settings.CHECK_USER_IS_ACTIVE and not validated_token['is_active']:
+                raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+            return ClaimsUser.from_claims(user_id, {claim: validated_token[claim] for claim in TOKEN_CLAIMS})
+
+        row = user_cache.get(str(user_id))
+        if row is None:
+            fields = [field.attname for field in User._meta.concrete_fields]
+            row = User.objects.filter(pk=user_id).values(*fields).first()
+            if row is None:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            user_cache.set(str(user_id), row)
+        user = User.from_db('default', list(row), list(row.values()))
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
+
+
+def load_user(user):
+    """
+    Returns the request user with every field current. Views that change the
+    user start from this, since token claims may be older than the row.
+    """
+    if isinstance(user, ClaimsUser):
+        return User.objects.get(pk=user.pk)
+    return user
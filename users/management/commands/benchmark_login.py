@@ -0,0 +1,52 @@
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+
+from users.models import User, DONE
+from users.serializers import LoginSerializer
+
+
+class Command(BaseCommand):
+    help = "Run LoginSerializer against a throwaway user and report logins per second per core"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=8)
+
+    def handle(self, *args, **options):
+        password = f'benchmark-{uuid.uuid4().hex}'
+        user = User.objects.create(username=f'benchmark_{uuid.uuid4().hex[:12]}', password=password,
+                                   auth_status=DONE)
+        data = {'user_input': user.username, 'password': password}
+
+        def login(_):
+            try:
+                started = time.perf_counter()
+                serializer = LoginSerializer(data=data)
+                serializer.is_valid(raise_exception=True)
+                return time.perf_counter() - started
+            finally:
+                connection.close()
+
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+                latencies = sorted(executor.map(login, range(options['logins'])))
+            elapsed = time.perf_counter() - started
+        finally:
+            OutstandingToken.objects.filter(user=user).delete()
+            user.delete()
+
+        cores = os.cpu_count() or 1
+        rate = len(latencies) / elapsed
+        self.stdout.write(f"Logins: {len(latencies)} in {elapsed:.2f}s, concurrency {options['concurrency']}")
+        self.stdout.write(f"Logins/sec: {rate:.1f}, per core: {rate / cores:.1f} ({cores} cores)")
+        self.stdout.write(
+            f"Latency p50: {latencies[len(latencies) // 2] * 1000:.1f}ms, "
+            f"p99: {latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000:.1f}ms"
+        )
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+
+class Command(BaseCommand):
+    help = "Delete expired outstanding refresh tokens and their blacklist entries"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        # an expired token fails verification anyway, its blacklist row is dead weight
+        expired = OutstandingToken.objects.filter(expires_at__lt=timezone.now()).order_by('id')
+        tokens = blacklisted = 0
+        while True:
+            ids = list(expired.values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            blacklisted += BlacklistedToken.objects.filter(token_id__in=ids).delete()[0]
+            tokens += OutstandingToken.objects.filter(id__in=ids).delete()[0]
+        self.stdout.write(f"Outstanding tokens purged: {tokens}, blacklisted tokens purged: {blacklisted}")
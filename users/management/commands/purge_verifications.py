@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from users.verification import get_verification_store
+
+
+class Command(BaseCommand):
+    help = "Delete expired verification codes, a no-op for the cache store where they expire on their own"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        total = get_verification_store().purge(options['batch_size'])
+        self.stdout.write(f"Verification codes purged: {total}")
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_claims_user'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userconfirmation',
+            index=models.Index(fields=['user', 'is_confirmed', 'expiration_time'], name='user_confirmation_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userconfirmation',
+            index=models.Index(fields=['expiration_time'], name='user_confirmation_expiry_idx'),
+        ),
+    ]
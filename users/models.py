@@ -1,18 +1,55 @@
 import random
 import uuid
-from datetime import datetime, timedelta
+from datetime import timedelta
 
-from django.contrib.auth.models import AbstractUser
+from django.conf import settings
+from django.contrib.auth.models import AbstractUser, UserManager
 from django.core.validators import FileExtensionValidator
-from django.db import models
-from rest_framework_simplejwt.tokens import RefreshToken
+from django.db import IntegrityError, models, transaction
+from django.db.models.signals import post_delete, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
 
-from shared.models import BaseModel
+from shared.cache import LRUCache
+from shared.models import BaseModel, CounterQuerySet
+from shared.storage import release_files
+from users.tokens import FilteredRefreshToken, revoke_tokens
 
 ORDINARY_USER, MANAGER, ADMIN = ('ordinary_user', 'manager', 'admin')
 VIA_EMAIL, VIA_PHONE = ('via_email', 'via_phone')
 NEW, CODE_VERIFIED, DONE, PHOTO_DONE = ('new', 'code_verified', 'done', 'photo_done')
 
+# copied into every token so that authenticating a request needs no query
+TOKEN_CLAIMS = ('username', 'auth_status', 'user_roles', 'is_active')
+
+# rows of users loaded by ClaimsUser, keyed by str(pk)
+user_cache = LRUCache(settings.USER_CACHE_SIZE, settings.USER_CACHE_TTL)
+
+
+class UserQuerySet(CounterQuerySet):
+    """
+    Keeps user_cache and tokens in step with updates that bypass save().
+    """
+
+    def update(self, **kwargs):
+        pks = list(self.values_list('pk', flat=True))
+        updated = super(UserQuerySet, self).update(**kwargs)
+        for pk in pks:
+            user_cache.delete(str(pk))
+            if kwargs.get('is_active') is False:
+                revoke_tokens(pk)
+        return updated
+
+    def increment(self, pk, **deltas):
+        # the pk is known, so skip the lookup of update()
+        updated = super(UserQuerySet, self.filter(pk=pk)).update(**self.counter_updates(deltas))
+        user_cache.delete(str(pk))
+        return updated
+
+
+class CustomUserManager(UserManager.from_queryset(UserQuerySet)):
+    pass
+
 
 class User(AbstractUser, BaseModel):
     USER_ROLES = (
@@ -42,6 +79,11 @@ class User(AbstractUser, BaseModel):
                               validators=[
                                   FileExtensionValidator(allowed_extensions=['png', 'jpg', 'jpeg', 'heif', 'hevc'])
                               ])
+    photo_variants = models.JSONField(default=dict, blank=True, editable=False)
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+
+    objects = CustomUserManager()
 
     def __str__(self):
         return self.username
@@ -50,15 +92,6 @@ class User(AbstractUser, BaseModel):
     def full_name(self):
         return f'{self.first_name} {self.last_name}'
 
-    def create_verify_code(self, verify_type):
-        code = ''.join([str(random.randint(0, 9)) for _ in range(4)])
-        (UserConfirmation.objects.create(
-            user_id=self.id,
-            verify_type=verify_type,
-            code=code,
-        ))
-        return code
-
     def check_username(self):
         if not self.username:
             temp_username = f'instagram-{uuid.uuid4().__str__().split("-")[-1]}'
@@ -80,8 +113,30 @@ class User(AbstractUser, BaseModel):
         if not self.password.startswith('pbkdf2_sha256'):
             self.set_password(self.password)
 
+    def follow(self, user):
+        try:
+            with transaction.atomic():
+                _, created = UserFollow.objects.get_or_create(follower=self, following=user)
+                if created:
+                    User.objects.increment(self.pk, following_count=1)
+                    User.objects.increment(user.pk, followers_count=1)
+        except IntegrityError:
+            # a concurrent request created the same follow
+            return False
+        return created
+
+    def unfollow(self, user):
+        with transaction.atomic():
+            deleted, _ = UserFollow.objects.filter(follower=self, following=user).delete()
+            if deleted:
+                User.objects.increment(self.pk, following_count=-deleted)
+                User.objects.increment(user.pk, followers_count=-deleted)
+        return bool(deleted)
+
     def token(self):
-        refresh = RefreshToken.for_user(self)
+        refresh = FilteredRefreshToken.for_user(self)
+        for claim in TOKEN_CLAIMS:
+            refresh[claim] = getattr(self, claim)
         return {
             'access': str(refresh.access_token),
             'refresh_token': str(refresh),
@@ -95,7 +150,56 @@ class User(AbstractUser, BaseModel):
 
     def save(self, *args, **kwargs):
         self.clean()
+        adding = self._state.adding
         super(User, self).save(*args, **kwargs)
+        user_cache.delete(str(self.pk))
+        if not adding and not self.is_active:
+            revoke_tokens(self.pk)
+
+
+class ClaimsUser(User):
+    """
+    The request user of ClaimsJWTAuthentication, built from the token claims
+    without a query. Every other field is deferred, the first access to one of
+    them loads them all at once from user_cache or the database.
+    """
+
+    class Meta:
+        proxy = True
+
+    @classmethod
+    def from_claims(cls, user_id, claims):
+        values = dict(claims, id=user_id)
+        fields = [field.attname for field in cls._meta.concrete_fields if field.attname in values]
+        return cls.from_db('default', fields, [values[field] for field in fields])
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        deferred = self.get_deferred_fields()
+        if fields is None or not deferred.intersection(fields):
+            return super(ClaimsUser, self).refresh_from_db(using, fields, from_queryset)
+        row = user_cache.get(str(self.pk))
+        if row is None:
+            row = User.objects.filter(pk=self.pk).values(
+                *[field.attname for field in self._meta.concrete_fields]
+            ).first()
+            if row is None:
+                raise User.DoesNotExist("User matching query does not exist.")
+            user_cache.set(str(self.pk), row)
+        # fields from the token, or already changed by the caller, stay as they are
+        for field in deferred:
+            setattr(self, field, row[field])
+
+
+@receiver(pre_delete, sender=User)
+def revoke_user_tokens(sender, instance, **kwargs):
+    # before the delete nulls the user of the outstanding tokens
+    revoke_tokens(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def release_user_photo(sender, instance, **kwargs):
+    release_files(instance.photo, instance.photo_variants)
+    user_cache.delete(str(instance.pk))
 
 
 PHONE_EXPIRE = 2
@@ -119,10 +223,38 @@ class UserConfirmation(BaseModel):
 
     def save(self, *args, **kwargs):
         if self.verify_type == VIA_EMAIL:
-            self.expiration_time = datetime.now() + timedelta(minutes=EMAIL_EXPIRE)
+            self.expiration_time = timezone.now() + timedelta(minutes=EMAIL_EXPIRE)
         else:
-            self.expiration_time = datetime.now() + timedelta(minutes=PHONE_EXPIRE)
+            self.expiration_time = timezone.now() + timedelta(minutes=PHONE_EXPIRE)
         super(UserConfirmation, self).save(*args, **kwargs)
 
     class Meta:
         ordering = ['-expiration_time']
+        indexes = [
+            models.Index(fields=['user', 'is_confirmed', 'expiration_time'], name='user_confirmation_pending_idx'),
+            models.Index(fields=['expiration_time'], name='user_confirmation_expiry_idx'),
+        ]
+
+
+class UserFollow(BaseModel):
+    follower = models.ForeignKey('users.User', on_delete=models.CASCADE, related_name='following')
+    following = models.ForeignKey('users.User', on_delete=models.CASCADE, related_name='followers')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['follower', 'following'],
+                name='unique_user_follow'
+            ),
+            models.CheckConstraint(
+                condition=~models.Q(follower=models.F('following')),
+                name='user_follow_not_self'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['following', 'created_time', 'id'], name='user_followers_idx'),
+            models.Index(fields=['follower', 'created_time', 'id'], name='user_following_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.follower} follows {self.following}"
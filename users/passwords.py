@@ -0,0 +1,97 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, identify_hasher, make_password
+from rest_framework.exceptions import Throttled
+
+
+class PasswordHasherPool:
+    """
+    Verifies password hashes on a fixed number of threads. PBKDF2 runs in C with
+    the GIL released, so the threads use separate cores while the caller waits,
+    or while an async caller's event loop keeps serving. At most `queue_size`
+    checks wait beyond the running ones; when the pool is that busy, a sync caller
+    waits up to `timeout` seconds for room and an async caller not at all, then
+    the login is refused with 429 rather than piling up.
+    """
+
+    def __init__(self, workers, queue_size=100, timeout=1.0):
+        self.workers = workers
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def start(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='passwords')
+
+    def submit(self, raw_password, encoded, timeout):
+        if not self.slots.acquire(timeout=timeout):
+            raise Throttled(detail="Too many login attempts in progress, try again shortly")
+        self.start()
+        future = self.executor.submit(check_password, raw_password, encoded)
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def check(self, raw_password, encoded):
+        return self.submit(raw_password, encoded, self.timeout).result()
+
+    async def acheck(self, raw_password, encoded):
+        return await asyncio.wrap_future(self.submit(raw_password, encoded, 0))
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_password_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = PasswordHasherPool(
+                workers=settings.PASSWORD_HASH_WORKERS,
+                queue_size=settings.PASSWORD_HASH_QUEUE_SIZE,
+                timeout=settings.PASSWORD_HASH_TIMEOUT,
+            )
+        return _pool
+
+
+def must_rehash(user):
+    try:
+        return identify_hasher(user.password).must_update(user.password)
+    except ValueError:
+        return False
+
+
+def verify_password(user, raw_password):
+    """
+    user.check_password() on the hasher pool. Hashes made with old settings are
+    upgraded here, on the calling thread, so the pool never touches the database.
+    """
+    if not user.has_usable_password() or not get_password_pool().check(raw_password, user.password):
+        return False
+    if must_rehash(user):
+        user.set_password(raw_password)
+        user.save(update_fields=['password'])
+    return True
+
+
+async def averify_password(user, raw_password):
+    if not user.has_usable_password() or not await get_password_pool().acheck(raw_password, user.password):
+        return False
+    if must_rehash(user):
+        user.set_password(raw_password)
+        await user.asave(update_fields=['password'])
+    return True
+
+
+def hash_passwords(raw_passwords):
+    """
+    make_password() over a list, meant to be mapped over a process pool in slices.
+    None makes an unusable password.
+    """
+    return [make_password(raw_password) for raw_password in raw_passwords]
@@ -1,9 +1,10 @@
 import re
 
-from django.contrib.auth import authenticate
+from asgiref.sync import sync_to_async
 from django.contrib.auth.models import update_last_login
 from django.contrib.auth.password_validation import validate_password
 from django.core.validators import FileExtensionValidator
+from django.db import transaction
 from django.db.models import Q
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError, PermissionDenied, NotFound
@@ -11,8 +12,13 @@ from rest_framework.generics import get_object_or_404
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
 from rest_framework_simplejwt.tokens import AccessToken
 
+from shared.images import schedule_variants, variant_urls
+from shared.storage import release_files
 from shared.utility import check_email_or_phone, send_email, check_user_type, username_regex
-from users.models import User, VIA_EMAIL, VIA_PHONE, NEW, CODE_VERIFIED, DONE, PHOTO_DONE
+from users.models import User, UserFollow, VIA_EMAIL, VIA_PHONE, NEW, CODE_VERIFIED, DONE, PHOTO_DONE
+from users.passwords import averify_password, verify_password
+from users.tokens import FilteredRefreshToken
+from users.verification import get_verification_store
 
 
 class SignUpSerializer(serializers.ModelSerializer):
@@ -34,13 +40,14 @@ class SignUpSerializer(serializers.ModelSerializer):
             'auth_status': {'read_only': True, 'required': False},
         }
 
+    @transaction.atomic
     def create(self, validated_data):
         user = super(SignUpSerializer, self).create(validated_data)
         if user.auth_type == VIA_EMAIL:
-            code = user.create_verify_code(VIA_EMAIL)
+            code = get_verification_store().create(user, VIA_EMAIL)
             send_email(user.email, code)
         elif user.auth_type == VIA_PHONE:
-            code = user.create_verify_code(VIA_PHONE)
+            code = get_verification_store().create(user, VIA_PHONE)
             send_email(user.phone_number, code)
             # send_phone_number(user.phone_number, code)
         user.save()
@@ -189,9 +196,12 @@ class ChangeUserPhotoSerializer(serializers.Serializer):
     def update(self, instance, validated_data):
         photo = validated_data.get('photo')
         if photo:
+            release_files(instance.photo, instance.photo_variants)
             instance.photo = photo
+            instance.photo_variants = {}
             instance.auth_status = PHOTO_DONE
             instance.save()
+            schedule_variants(instance, 'photo', 'photo_variants')
         return instance
 
 
@@ -203,29 +213,23 @@ class LoginSerializer(TokenObtainPairSerializer):
         self.fields['user_input'] = serializers.CharField(required=True)
         self.fields['username'] = serializers.CharField(required=False, read_only=True)
 
-    def auth_validate(self, data):
+    def find_user(self, data):
         user_input = data.get('user_input')
         user_type = check_user_type(user_input)
         if user_type == 'username':
-            username = user_input
+            lookup = Q(username=user_input)
         elif user_type == 'email':
-            user = self.get_user(email__iexact=user_input)
-            username = user.username
+            lookup = Q(email__iexact=user_input)
         elif user_type == 'phone':
-            user = self.get_user(phone_number=user_input)
-            username = user.username
+            lookup = Q(phone_number=user_input)
         else:
             error = {
                 'success': False,
                 'message': "You must enter a username, email or phone number"
             }
             raise ValidationError(error)
-        authentication_kwargs = {
-            self.username_field: username,
-            'password': data.get('password'),
-        }
 
-        current_user = self.get_user(username=username)
+        current_user = self.get_user(lookup)
         if current_user.auth_status in [NEW, CODE_VERIFIED]:
             raise ValidationError(
                 {
@@ -233,20 +237,44 @@ class LoginSerializer(TokenObtainPairSerializer):
                     'message': "Registration is incomplete",
                 }
             )
+        return current_user
 
-        user = authenticate(**authentication_kwargs)
-        if user is not None:
-            self.user = user
+    def auth_validate(self, data):
+        current_user = self.find_user(data)
+        if current_user.is_active and verify_password(current_user, data.get('password')):
+            self.user = current_user
         else:
-            raise ValidationError(
-                {
-                    'success': False,
-                    'message': 'Sorry, login or password you entered is incorrect. Please check and try again'
-                }
-            )
+            self.login_failed()
+
+    async def aauth_validate(self, data):
+        current_user = await sync_to_async(self.find_user)(data)
+        if current_user.is_active and await averify_password(current_user, data.get('password')):
+            self.user = current_user
+        else:
+            self.login_failed()
+
+    @staticmethod
+    def login_failed():
+        raise ValidationError(
+            {
+                'success': False,
+                'message': 'Sorry, login or password you entered is incorrect. Please check and try again'
+            }
+        )
 
     def validate(self, data):
         self.auth_validate(data)
+        return self.login_data()
+
+    async def avalidate(self, data):
+        """
+        validate() for AsyncLoginView, the event loop keeps serving while the
+        password is checked on the hasher pool.
+        """
+        await self.aauth_validate(data)
+        return await sync_to_async(self.login_data)()
+
+    def login_data(self):
         if self.user.auth_status not in [DONE, PHOTO_DONE]:
             raise PermissionDenied("You do not have permission to login!")
         data = self.user.token()
@@ -254,19 +282,20 @@ class LoginSerializer(TokenObtainPairSerializer):
         data['full_name'] = self.user.full_name
         return data
 
-    def get_user(self, **kwargs):
-        users = User.objects.filter(**kwargs)
-        if not users.exists():
+    def get_user(self, lookup):
+        user = User.objects.filter(lookup).first()
+        if user is None:
             raise ValidationError(
                 {
                     'success': False,
                     'message': "No active account found",
                 }
             )
-        return users.first()
+        return user
 
 
 class LoginRefreshSerializer(TokenRefreshSerializer):
+    token_class = FilteredRefreshToken
 
     def validate(self, attrs):
         data = super(LoginRefreshSerializer, self).validate(attrs)
@@ -332,3 +361,35 @@ class ResetPasswordSerializer(serializers.ModelSerializer):
         password = validated_data.pop('password', None)
         instance.set_password(password)
         return super(ResetPasswordSerializer, self).update(instance, validated_data)
+
+
+class FollowUserSerializer(serializers.ModelSerializer):
+    id = serializers.UUIDField(read_only=True)
+    photo_variants = serializers.SerializerMethodField('get_photo_variants')
+
+    class Meta:
+        model = User
+        fields = (
+            'id',
+            'username',
+            'photo',
+            'photo_variants',
+        )
+
+    def get_photo_variants(self, obj):
+        return variant_urls(obj.photo, obj.photo_variants, self.context.get('request'))
+
+
+class UserFollowSerializer(serializers.ModelSerializer):
+    id = serializers.UUIDField(read_only=True)
+    follower = FollowUserSerializer(read_only=True)
+    following = FollowUserSerializer(read_only=True)
+
+    class Meta:
+        model = UserFollow
+        fields = (
+            'id',
+            'follower',
+            'following',
+            'created_time',
+        )
@@ -1,3 +1,358 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+from collections import deque
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import override_settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.exceptions import Throttled
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from post.models import Post
+from shared.bloom import BloomFilter
+from users.models import User, ClaimsUser, UserConfirmation, DONE, CODE_VERIFIED, VIA_EMAIL, user_cache
+from users.passwords import PasswordHasherPool
+from users.tokens import BlacklistFilter, FilteredRefreshToken, get_blacklist_filter
+from users.verification import CacheVerificationStore, DatabaseVerificationStore
+
+
+class ClaimsAuthenticationTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='reader', email='reader@example.com',
+                                       password='password-reader', auth_status=DONE)
+        cls.post = Post.objects.create(author=cls.user, image='posts_images/test.jpg', description='post')
+
+    def setUp(self):
+        user_cache.clear()
+        get_blacklist_filter().rebuild()
+
+    def authenticate(self, user):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {user.token()['access']}")
+
+    def test_requests_do_not_load_the_user(self):
+        url = reverse('post_like_create_delete', kwargs={'pk': self.post.pk})
+        self.client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as baseline:
+            self.client.delete(url)
+        self.client.force_authenticate(None)
+
+        self.authenticate(self.user)
+        with self.assertNumQueries(len(baseline)):
+            response = self.client.delete(url)
+        self.assertEqual(response.status_code, 204)
+        # the response shows the author, whose row is loaded once and then cached
+        self.assertEqual(self.client.put(url).data['data']['author']['username'], 'reader')
+        self.client.delete(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.put(url)
+        self.assertNotIn('"users_user"', ' '.join(query['sql'] for query in queries))
+
+    def test_other_fields_are_loaded_once_and_cached(self):
+        user = ClaimsUser.from_claims(self.user.pk, {'username': 'reader', 'auth_status': DONE,
+                                                      'user_roles': self.user.user_roles})
+        with self.assertNumQueries(1):
+            self.assertEqual(user.email, 'reader@example.com')
+            self.assertEqual(user.followers_count, 0)
+        again = ClaimsUser.from_claims(self.user.pk, {'username': 'reader', 'auth_status': DONE,
+                                                       'user_roles': self.user.user_roles})
+        with self.assertNumQueries(0):
+            self.assertEqual(again.email, 'reader@example.com')
+
+        self.user.email = 'changed@example.com'
+        self.user.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(ClaimsUser.from_claims(self.user.pk, {
+                'username': 'reader', 'auth_status': DONE, 'user_roles': self.user.user_roles,
+            }).email, 'changed@example.com')
+
+    def test_deactivated_and_deleted_users_lose_access(self):
+        url = reverse('post_feed')
+        user = User.objects.create(username='leaver', password='password-leaver', auth_status=DONE)
+        self.authenticate(user)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        user.is_active = False
+        user.save()
+        self.assertEqual(self.client.get(url).status_code, 401)
+
+        other = User.objects.create(username='mover', password='password-mover', auth_status=DONE)
+        self.authenticate(other)
+        User.objects.filter(pk=other.pk).update(is_active=False)
+        self.assertEqual(self.client.get(url).status_code, 401)
+        User.objects.filter(pk=other.pk).update(is_active=True)
+        self.authenticate(other)
+        other.delete()
+        self.assertEqual(self.client.get(url).status_code, 401)
+
+        # a token issued to an inactive user says so
+        self.authenticate(user)
+        self.assertEqual(self.client.get(url).status_code, 401)
+
+    def test_counter_updates_invalidate_the_cached_row(self):
+        user = ClaimsUser.from_claims(self.user.pk, {'username': 'reader', 'auth_status': DONE,
+                                                      'user_roles': self.user.user_roles, 'is_active': True})
+        self.assertEqual(user.followers_count, 0)
+        User.objects.increment(self.user.pk, followers_count=1)
+        again = ClaimsUser.from_claims(self.user.pk, {'username': 'reader', 'auth_status': DONE,
+                                                       'user_roles': self.user.user_roles, 'is_active': True})
+        self.assertEqual(again.followers_count, 1)
+
+    def test_user_changes_start_from_the_current_row(self):
+        user = User.objects.create(username='newcomer', password='password-newcomer', auth_status=CODE_VERIFIED)
+        self.authenticate(user)
+        User.objects.filter(pk=user.pk).update(auth_status=CODE_VERIFIED, first_name='Stale')
+        response = self.client.put(reverse('change_user_info'), {
+            'first_name': 'New', 'last_name': 'Comer', 'username': 'newcomer',
+            'password': 'a-long-password-1', 'confirm_password': 'a-long-password-1',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['auth_status'], DONE)
+        user.refresh_from_db()
+        self.assertEqual((user.first_name, user.auth_status), ('New', DONE))
+
+
+class TokenBlacklistTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='sessions', password='password-sessions', auth_status=DONE)
+
+    def setUp(self):
+        get_blacklist_filter().rebuild()
+
+    def refresh(self, token):
+        return self.client.post(reverse('login_refresh'), {'refresh': token})
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        keys = [f'jti-{i}' for i in range(1000)]
+        for key in keys:
+            bloom.add(key)
+        self.assertTrue(all(key in bloom for key in keys))
+        false_positives = sum(f'other-{i}' in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_refresh_skips_the_blacklist_table(self):
+        tokens = self.user.token()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.refresh(tokens['refresh_token'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('token_blacklist_blacklistedtoken', ' '.join(query['sql'] for query in queries))
+
+    def test_blacklisted_tokens_are_rejected(self):
+        tokens = self.user.token()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        response = self.client.post(reverse('logout'), {'refresh': tokens['refresh_token']})
+        self.assertEqual(response.status_code, 205)
+        self.assertEqual(self.refresh(tokens['refresh_token']).status_code, 401)
+
+        # blacklisted by another process, seen after the next sync
+        other = self.user.token()['refresh_token']
+        FilteredRefreshToken(other).blacklist()
+        get_blacklist_filter().rebuild()
+        self.assertEqual(self.refresh(other).status_code, 401)
+
+    def test_rows_committed_out_of_id_order_are_synced(self):
+        def outstanding():
+            return OutstandingToken.objects.get(jti=FilteredRefreshToken(self.user.token()['refresh_token'])['jti'])
+
+        first, late, second = outstanding(), outstanding(), outstanding()
+        blacklist_filter = BlacklistFilter(sync_interval=0, overlap=60)
+        BlacklistedToken.objects.create(id=900, token=first)
+        blacklist_filter.rebuild()
+        # the rebuild happened two minutes ago
+        blacklist_filter.checkpoints = deque((at - 120, pk) for at, pk in blacklist_filter.checkpoints)
+        BlacklistedToken.objects.create(id=1000, token=second)
+        self.assertTrue(blacklist_filter.might_contain(second.jti))
+
+        # id 990 was taken before 1000 but its transaction committed after the last sync
+        BlacklistedToken.objects.create(id=990, token=late)
+        self.assertTrue(blacklist_filter.might_contain(late.jti))
+        blacklist_filter.sync()
+        self.assertEqual(len(blacklist_filter.bloom), 3)
+
+    def test_purge_removes_expired_tokens(self):
+        FilteredRefreshToken(self.user.token()['refresh_token']).blacklist()
+        expired = FilteredRefreshToken(self.user.token()['refresh_token'])
+        expired.blacklist()
+        OutstandingToken.objects.filter(jti=expired['jti']).update(expires_at=timezone.now() - timedelta(days=1))
+
+        out = StringIO()
+        call_command('purge_tokens', stdout=out)
+        self.assertIn('Outstanding tokens purged: 1, blacklisted tokens purged: 1', out.getvalue())
+        self.assertEqual(BlacklistedToken.objects.count(), 1)
+        self.assertFalse(OutstandingToken.objects.filter(jti=expired['jti']).exists())
+
+
+class LoginTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='signin', email='signin@example.com',
+                                       password='password-signin', auth_status=DONE)
+
+    def login(self, user_input, password):
+        return self.client.post(reverse('login'), {'user_input': user_input, 'password': password})
+
+    def test_user_is_looked_up_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.login('SignIn@example.com', 'password-signin')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.data)
+        user_queries = [query for query in queries if query['sql'].startswith('SELECT') and '"users_user"' in query['sql']]
+        self.assertEqual(len(user_queries), 1)
+
+    def test_wrong_password_and_inactive_users_are_refused(self):
+        self.assertEqual(self.login('signin', 'password-wrong').status_code, 400)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.login('signin', 'password-signin').status_code, 400)
+        self.assertEqual(self.login('nobody', 'password-signin').status_code, 400)
+
+    def test_async_login_and_full_pool(self):
+        url = reverse('login_async')
+        response = self.client.post(url, {'user_input': 'signin', 'password': 'password-signin'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.json())
+        response = self.client.post(url, {'user_input': 'signin', 'password': 'password-wrong'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), self.login('signin', 'password-wrong').json())
+        self.assertEqual(self.client.post(url, {'password': 'password-signin'}).status_code, 400)
+        cache.clear()
+        self.addCleanup(cache.clear)
+        for _ in range(10):
+            self.client.post(url, {'user_input': 'target', 'password': 'password-wrong'})
+        response = self.client.post(url, {'user_input': 'target', 'password': 'password-wrong'})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+        pool = PasswordHasherPool(workers=1, queue_size=0, timeout=0)
+        pool.slots.acquire()
+        with self.assertRaises(Throttled):
+            pool.check('password-signin', self.user.password)
+        pool.slots.release()
+        self.assertTrue(pool.check('password-signin', self.user.password))
+
+
+class ImportUsersTest(APITestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        User.objects.create(username='taken', email='existing@example.com', auth_status=DONE)
+
+    def import_users(self, name, content, *args):
+        path = f'{self.directory}/{name}'
+        with open(path, 'w') as source:
+            source.write(content)
+        out = StringIO()
+        call_command('import_users', path, '--chunk-size', '2', '--workers', '1', *args, stdout=out)
+        return path, out.getvalue()
+
+    def test_csv_rows_are_created_with_unique_usernames(self):
+        _, out = self.import_users('users.csv', (
+            "username,email,phone_number,first_name,last_name,password\n"
+            "taken,Partner@Example.com,,Part,Ner,password-partner\n"
+            ",,+998901234567,,,\n"
+            "nobody,,,,,\n"
+            "again,existing@example.com,,,,\n"
+        ))
+        self.assertIn('Import finished: 2 created, 2 skipped', out)
+        partner = User.objects.get(email='partner@example.com')
+        self.assertNotEqual(partner.username, 'taken')
+        self.assertTrue(partner.username.startswith('taken'))
+        self.assertTrue(partner.check_password('password-partner'))
+        self.assertFalse(User.objects.get(phone_number='+998901234567').has_usable_password())
+
+    def test_rows_the_columns_cannot_hold_are_skipped(self):
+        _, out = self.import_users('users.csv', (
+            "username,email,phone_number,first_name,last_name,password\n"
+            f"{'u' * 151},long@example.com,,,,\n"
+            ",not-an-email,,,,\n"
+            ",,+9989012345678901,,,\n"
+            f",name@example.com,,{'n' * 151},,\n"
+            "fine,fine@example.com,,,,\n"
+        ))
+        self.assertIn('Import finished: 1 created, 4 skipped', out)
+        self.assertTrue(User.objects.filter(username='fine').exists())
+
+    def test_import_resumes_from_the_checkpoint(self):
+        path = f'{self.directory}/users.jsonl'
+        with open(f'{path}.checkpoint', 'w') as checkpoint:
+            checkpoint.write('{"rows": 2}')
+        _, out = self.import_users('users.jsonl', "\n".join(
+            f'{{"username": "member{i}", "email": "member{i}@example.com"}}' for i in range(5)
+        ))
+        self.assertIn('Resuming after row 2', out)
+        self.assertEqual(
+            sorted(User.objects.filter(username__startswith='member').values_list('username', flat=True)),
+            ['member2', 'member3', 'member4'],
+        )
+        self.assertFalse(os.path.exists(f'{path}.checkpoint'))
+
+
+class VerificationStoreTest(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='verifier', email='verifier@example.com', auth_type=VIA_EMAIL)
+
+    def check_store(self, store):
+        self.assertFalse(store.pending(self.user))
+        with self.captureOnCommitCallbacks(execute=True):
+            code = store.create(self.user, VIA_EMAIL)
+        self.assertTrue(store.pending(self.user))
+        self.assertFalse(store.confirm(self.user, 'x' + code[1:]))
+        self.assertTrue(store.confirm(self.user, code))
+        self.assertFalse(store.confirm(self.user, code))
+        self.assertFalse(store.pending(self.user))
+
+    def test_database_store(self):
+        store = DatabaseVerificationStore()
+        self.check_store(store)
+        store.create(self.user, VIA_EMAIL)
+        UserConfirmation.objects.update(expiration_time=timezone.now() - timedelta(days=1))
+        self.assertFalse(store.pending(self.user))
+        out = StringIO()
+        call_command('purge_verifications', stdout=out)
+        self.assertIn('Verification codes purged: 2', out.getvalue())
+
+    def test_cache_store(self):
+        self.check_store(CacheVerificationStore())
+
+    def test_cache_code_is_confirmed_once(self):
+        store = CacheVerificationStore()
+        with self.captureOnCommitCallbacks(execute=True):
+            code = store.create(self.user, VIA_EMAIL)
+        get = store.cache.get
+
+        def racing_get(key, *args, **kwargs):
+            # another request confirms the code right after this one read it
+            value = get(key, *args, **kwargs)
+            store.cache.delete(key)
+            return value
+
+        with mock.patch.object(store.cache, 'get', racing_get):
+            self.assertFalse(store.confirm(self.user, code))
+
+    @override_settings(VERIFICATION_STORE='cache')
+    def test_verify_with_cache_store(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.user.token()['access']}")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.get(reverse('new_verify')).status_code, 200)
+        self.assertFalse(UserConfirmation.objects.exists())
+        self.assertEqual(self.client.get(reverse('new_verify')).status_code, 400)
+
+        code = CacheVerificationStore().cache.get(f'verify:{self.user.pk}')
+        response = self.client.post(reverse('verify'), {'code': code})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['auth_status'], CODE_VERIFIED)
@@ -0,0 +1,155 @@
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from shared.bloom import BloomFilter
+
+
+class BlacklistFilter:
+    """
+    Per-process Bloom filter of blacklisted JTIs. It is built from the blacklist
+    table on first use, takes tokens blacklisted by this process right away and
+    picks up those blacklisted elsewhere every BLACKLIST_FILTER_SYNC_INTERVAL
+    seconds. A token is looked up in the database only when the filter says it
+    may be blacklisted.
+
+    Ids are taken when a row is inserted but become visible when its transaction
+    commits, so a row can show up below the highest id already synced. Each sync
+    therefore reads from the highest id that was visible `overlap` seconds ago,
+    which every row committed within `overlap` seconds of its insert is above.
+    """
+
+    def __init__(self, error_rate=0.001, sync_interval=5, overlap=60, min_capacity=10000):
+        self.error_rate = error_rate
+        self.sync_interval = sync_interval
+        self.overlap = overlap
+        self.min_capacity = min_capacity
+        self.lock = threading.Lock()
+        self.bloom = None
+        self.last_id = 0
+        # (monotonic time, id): rows inserted after that time have a higher id
+        self.checkpoints = deque()
+        self.synced_at = 0.0
+
+    def rebuild(self):
+        with self.lock:
+            self._rebuild()
+
+    def _rebuild(self):
+        started = time.monotonic()
+        cutoff = timezone.now() - timedelta(seconds=self.overlap)
+        count = BlacklistedToken.objects.count()
+        # twice the current size leaves room until the next rebuild
+        bloom = BloomFilter(max(count * 2, self.min_capacity), self.error_rate)
+        last_id = settled_id = 0
+        rows = BlacklistedToken.objects.order_by('id').values_list('id', 'token__jti', 'blacklisted_at')
+        for pk, jti, blacklisted_at in rows.iterator(chunk_size=10000):
+            bloom.add(jti)
+            last_id = pk
+            if blacklisted_at < cutoff:
+                settled_id = pk
+        self.bloom = bloom
+        self.last_id = last_id
+        self.checkpoints = deque([(started - self.overlap, settled_id), (time.monotonic(), last_id)])
+        self.synced_at = time.monotonic()
+
+    def rescan_from(self, now):
+        """
+        The id of the newest checkpoint at least `overlap` seconds old, older ones are dropped.
+        """
+        horizon = now - self.overlap
+        while len(self.checkpoints) > 1 and self.checkpoints[1][0] <= horizon:
+            self.checkpoints.popleft()
+        return self.checkpoints[0][1]
+
+    def sync(self):
+        with self.lock:
+            if self.bloom is None:
+                self._rebuild()
+                return
+            rows = BlacklistedToken.objects.filter(id__gt=self.rescan_from(time.monotonic())).order_by('id') \
+                .values_list('id', 'token__jti')
+            for pk, jti in rows.iterator(chunk_size=10000):
+                self.bloom.add(jti)
+                self.last_id = max(self.last_id, pk)
+            self.checkpoints.append((time.monotonic(), self.last_id))
+            if len(self.bloom) > self.bloom.capacity:
+                self._rebuild()
+            self.synced_at = time.monotonic()
+
+    def add(self, jti):
+        with self.lock:
+            if self.bloom is not None:
+                self.bloom.add(jti)
+
+    def might_contain(self, jti):
+        if self.bloom is None or time.monotonic() - self.synced_at >= self.sync_interval:
+            self.sync()
+        return jti in self.bloom
+
+
+_filter = None
+_filter_lock = threading.Lock()
+
+
+def get_blacklist_filter():
+    global _filter
+    with _filter_lock:
+        if _filter is None:
+            _filter = BlacklistFilter(
+                error_rate=settings.BLACKLIST_FILTER_ERROR_RATE,
+                sync_interval=settings.BLACKLIST_FILTER_SYNC_INTERVAL,
+                overlap=settings.BLACKLIST_FILTER_SYNC_OVERLAP,
+            )
+        return _filter
+
+
+# jti of the refresh token an access token was issued from, blacklisting the
+# refresh token revokes its access tokens too
+REFRESH_JTI_CLAIM = 'rjti'
+
+
+def is_blacklisted(jti):
+    return get_blacklist_filter().might_contain(jti) and BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+
+def revoke_tokens(user_id):
+    """
+    Blacklists every unexpired refresh token of the user, and with them the
+    access tokens issued from them. Other processes see it after their next sync.
+    """
+    tokens = list(OutstandingToken.objects.filter(
+        user_id=user_id, expires_at__gt=timezone.now(), blacklistedtoken__isnull=True
+    ).values_list('pk', 'jti'))
+    BlacklistedToken.objects.bulk_create([BlacklistedToken(token_id=pk) for pk, _ in tokens], ignore_conflicts=True)
+    blacklist_filter = get_blacklist_filter()
+    for _, jti in tokens:
+        blacklist_filter.add(jti)
+
+
+class FilteredRefreshToken(RefreshToken):
+    """
+    A RefreshToken that consults the blacklist filter before the blacklist table.
+    """
+
+    @property
+    def access_token(self):
+        access = super(FilteredRefreshToken, self).access_token
+        access[REFRESH_JTI_CLAIM] = self.payload[api_settings.JTI_CLAIM]
+        return access
+
+    def check_blacklist(self):
+        if get_blacklist_filter().might_contain(self.payload[api_settings.JTI_CLAIM]):
+            super(FilteredRefreshToken, self).check_blacklist()
+
+    def blacklist(self):
+        result = super(FilteredRefreshToken, self).blacklist()
+        get_blacklist_filter().add(self.payload[api_settings.JTI_CLAIM])
+        return result
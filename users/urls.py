@@ -1,8 +1,11 @@
 from django.urls import path
+from django.views.decorators.csrf import csrf_exempt
 
+from users.async_views import AsyncLoginView
 from users.views import SignUpView, VerifyAPIView, GetNewVerificationView, \
     ChangeUserInfoView, ChangeUserPhotoView, LoginView, LoginRefreshView, \
-    LogOutView, ForgotPasswordView, ResetPasswordView
+    LogOutView, ForgotPasswordView, ResetPasswordView, FollowApiView, FollowerListView, \
+    FollowingListView
 
 
 urlpatterns = [
@@ -16,4 +19,10 @@ urlpatterns = [
     path('change-user-photo/', ChangeUserPhotoView.as_view(), name='change_user_photo'),
     path('forgot-password/', ForgotPasswordView.as_view(), name='forgot_password'),
     path('reset-password/', ResetPasswordView.as_view(), name='reset_password'),
+    path('<uuid:pk>/follow/', FollowApiView.as_view(), name='user_follow'),
+    path('<uuid:pk>/followers/', FollowerListView.as_view(), name='user_followers'),
+    path('<uuid:pk>/following/', FollowingListView.as_view(), name='user_following'),
+
+    # async login for deployments served by config/asgi.py, token authenticated like the DRF views
+    path('async/login/', csrf_exempt(AsyncLoginView.as_view()), name='login_async'),
 ]
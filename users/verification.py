@@ -0,0 +1,95 @@
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from users.models import UserConfirmation, VIA_EMAIL, EMAIL_EXPIRE, PHONE_EXPIRE
+
+
+def generate_code():
+    return ''.join([str(random.randint(0, 9)) for _ in range(4)])
+
+
+def code_lifetime(verify_type):
+    return timedelta(minutes=EMAIL_EXPIRE if verify_type == VIA_EMAIL else PHONE_EXPIRE)
+
+
+class DatabaseVerificationStore:
+    """
+    Codes as UserConfirmation rows. Lookups go through the (user, is_confirmed,
+    expiration_time) index and `manage.py purge_verifications` deletes expired rows.
+    """
+
+    def create(self, user, verify_type):
+        code = generate_code()
+        UserConfirmation.objects.create(user_id=user.pk, verify_type=verify_type, code=code)
+        return code
+
+    def pending(self, user):
+        return UserConfirmation.objects.filter(
+            user_id=user.pk, is_confirmed=False, expiration_time__gte=timezone.now()
+        ).exists()
+
+    def confirm(self, user, code):
+        return UserConfirmation.objects.filter(
+            user_id=user.pk, is_confirmed=False, expiration_time__gte=timezone.now(), code=code
+        ).update(is_confirmed=True) > 0
+
+    def purge(self, batch_size=1000):
+        expired = UserConfirmation.objects.filter(expiration_time__lt=timezone.now())
+        total = 0
+        while True:
+            ids = list(expired.values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return total
+            total += UserConfirmation.objects.filter(id__in=ids).delete()[0]
+
+
+class CacheVerificationStore:
+    """
+    Codes in a cache backend, one key per user that expires with the code, so
+    nothing is left to purge. The cache must be shared by all workers (e.g. redis),
+    the default LocMemCache only works for a single process and in tests.
+    """
+    prefix = 'verify'
+
+    def __init__(self, cache_alias='default'):
+        self.cache = caches[cache_alias]
+
+    def key(self, user):
+        return f'{self.prefix}:{user.pk}'
+
+    def create(self, user, verify_type):
+        code = generate_code()
+        key, timeout = self.key(user), code_lifetime(verify_type).total_seconds()
+        # like a row, the code only exists once the surrounding transaction commits
+        transaction.on_commit(lambda: self.cache.set(key, code, timeout=timeout))
+        return code
+
+    def pending(self, user):
+        return self.cache.get(self.key(user)) is not None
+
+    def confirm(self, user, code):
+        if code is None or self.cache.get(self.key(user)) != code:
+            return False
+        # a confirmed code is used up, only the request whose delete removed it confirms
+        return self.cache.delete(self.key(user))
+
+    def purge(self, batch_size=1000):
+        return 0
+
+
+_stores = {}
+
+
+def get_verification_store():
+    backend = settings.VERIFICATION_STORE
+    if backend not in _stores:
+        if backend == 'cache':
+            _stores[backend] = CacheVerificationStore(settings.VERIFICATION_CACHE)
+        else:
+            _stores[backend] = DatabaseVerificationStore()
+    return _stores[backend]
@@ -1,34 +1,41 @@
-from datetime import datetime
 
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 from rest_framework import status
 from rest_framework.exceptions import ValidationError, NotFound
-from rest_framework.generics import CreateAPIView, UpdateAPIView
+from rest_framework.generics import CreateAPIView, UpdateAPIView, ListAPIView, get_object_or_404
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.exceptions import TokenError
-from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
+from post.timeline import backfill_timeline, remove_from_timeline
+from users.authentication import load_user
+from shared.custom_pagination import CustomPagination
 from shared.utility import send_email, check_email_or_phone
-from users.models import User, NEW, CODE_VERIFIED, VIA_EMAIL, VIA_PHONE
+from users.models import User, UserFollow, NEW, CODE_VERIFIED, VIA_EMAIL, VIA_PHONE
 from users.serializers import SignUpSerializer, ChangeUserInfoSerializer, ChangeUserPhotoSerializer, \
     LoginSerializer, LoginRefreshSerializer, LogoutSerializer, ForgotPasswordserializer, \
-    ResetPasswordSerializer
+    ResetPasswordSerializer, UserFollowSerializer
+from users.tokens import FilteredRefreshToken
+from users.verification import get_verification_store
 
 
 class SignUpView(CreateAPIView):
     queryset = User.objects.all()
     permission_classes = [AllowAny, ]
     serializer_class = SignUpSerializer
+    throttle_scope = 'signup'
+    throttle_identifier = 'email_phone_number'
 
 
 class VerifyAPIView(APIView):
     permission_classes = [IsAuthenticated, ]
+    throttle_scope = 'verify'
 
     def post(self, request):
-        user = self.request.user
+        user = load_user(self.request.user)
         code = request.data.get('code')
         self.check_verify(user, code)
         data = {
@@ -41,20 +48,18 @@ class VerifyAPIView(APIView):
 
     @staticmethod
     def check_verify(user, code):
-        verifies = user.verify_codes.filter(expiration_time__gte=datetime.now(), code=code, is_confirmed=False)
         if code is None:
             error = {
                 'success': False,
                 'message': "Enter the code sent to your email"
             }
             raise ValidationError(error)
-        elif not verifies.exists():
+        elif not get_verification_store().confirm(user, code):
             error = {
                 'status': False,
                 'message': 'The verification code is incorrect or expired'
             }
             raise ValidationError(error)
-        verifies.update(is_confirmed=True)
         if user.auth_status == NEW:
             user.auth_status = CODE_VERIFIED
             user.save()
@@ -63,22 +68,26 @@ class VerifyAPIView(APIView):
 
 class GetNewVerificationView(APIView):
     permission_classes = [IsAuthenticated, ]
+    throttle_scope = 'new_verify'
+    # a GET that sends a code
+    throttle_methods = ('GET',)
 
-    def get(self):
-        user = self.request.user
+    def get(self, request):
+        user = load_user(self.request.user)
         self.check_verification(user)
-        if user.auth_type == VIA_EMAIL:
-            code = user.create_verify_code(VIA_EMAIL)
-            send_email(user.email, code)
-        elif user.auth_type == VIA_PHONE:
-            code = user.create_verify_code(VIA_PHONE)
-            send_email(user.phone_number, code)
-        else:
-            error = {
-                'status': False,
-                'message': "Invalid email or phone number"
-            }
-            raise ValidationError(error)
+        with transaction.atomic():
+            if user.auth_type == VIA_EMAIL:
+                code = get_verification_store().create(user, VIA_EMAIL)
+                send_email(user.email, code)
+            elif user.auth_type == VIA_PHONE:
+                code = get_verification_store().create(user, VIA_PHONE)
+                send_email(user.phone_number, code)
+            else:
+                error = {
+                    'status': False,
+                    'message': "Invalid email or phone number"
+                }
+                raise ValidationError(error)
         return Response(
             data={
                 'status': True,
@@ -88,8 +97,7 @@ class GetNewVerificationView(APIView):
 
     @staticmethod
     def check_verification(user):
-        verifies = user.verify_codes.filter(expiration_time__gte=datetime.now(), is_confirmed=False)
-        if verifies.exists():
+        if get_verification_store().pending(user):
             error = {
                 'status': False,
                 'message': "Verification code has been sent to you. Please wait a while to send again"
@@ -104,14 +112,17 @@ class ChangeUserInfoView(UpdateAPIView):
     http_method_names = ['put']
 
     def get_object(self):
-        return self.request.user
+        return load_user(self.request.user)
+
+    def perform_update(self, serializer):
+        self.user = serializer.save()
 
     def update(self, request, *args, **kwargs):
         super(ChangeUserInfoView, self).update(request, *args, **kwargs)
         data = {
             'status': True,
             'message': "User information updated successfully",
-            'auth_status': self.request.user.auth_status,
+            'auth_status': self.user.auth_status,
         }
         return Response(data, status=status.HTTP_200_OK)
 
@@ -122,7 +133,7 @@ class ChangeUserPhotoView(APIView):
     def put(self, request):
         serializer = ChangeUserPhotoSerializer(data=request.data)
         if serializer.is_valid():
-            user = request.user
+            user = load_user(request.user)
             serializer.update(user, serializer.validated_data)
             return Response(
                 {
@@ -134,10 +145,13 @@ class ChangeUserPhotoView(APIView):
 
 class LoginView(TokenObtainPairView):
     serializer_class = LoginSerializer
+    throttle_scope = 'login'
+    throttle_identifier = 'user_input'
 
 
 class LoginRefreshView(TokenRefreshView):
     serializer_class = LoginRefreshSerializer
+    throttle_scope = 'login_refresh'
 
 
 class LogOutView(APIView):
@@ -149,7 +163,7 @@ class LogOutView(APIView):
         serializer.is_valid(raise_exception=True)
         try:
             refresh_token = self.request.data.get('refresh')
-            token = RefreshToken(refresh_token)
+            token = FilteredRefreshToken(refresh_token)
             token.blacklist()
             data = {
                 'success': True,
@@ -163,6 +177,8 @@ class LogOutView(APIView):
 class ForgotPasswordView(APIView):
     permission_classes = [AllowAny, ]
     serializer_class = ForgotPasswordserializer
+    throttle_scope = 'forgot_password'
+    throttle_identifier = 'email_or_phone'
 
     def post(self, request):
         serializer = self.serializer_class(data=request.data)
@@ -170,12 +186,13 @@ class ForgotPasswordView(APIView):
         email_or_phone = serializer.validated_data.get('email_or_phone')
         user = serializer.validated_data.get('user')
         self.check_verification(user)
-        if check_email_or_phone(email_or_phone) == 'phone':
-            code = user.create_verify_code(VIA_PHONE)
-            send_email(user.phone_number, code)
-        elif check_email_or_phone(email_or_phone) == 'email':
-            code = user.create_verify_code(VIA_EMAIL)
-            send_email(user.email, code)
+        with transaction.atomic():
+            if check_email_or_phone(email_or_phone) == 'phone':
+                code = get_verification_store().create(user, VIA_PHONE)
+                send_email(user.phone_number, code)
+            elif check_email_or_phone(email_or_phone) == 'email':
+                code = get_verification_store().create(user, VIA_EMAIL)
+                send_email(user.email, code)
         return Response(
             {
                 'success': True,
@@ -188,8 +205,7 @@ class ForgotPasswordView(APIView):
 
     @staticmethod
     def check_verification(user):
-        verifies = user.verify_codes.filter(expiration_time__gte=datetime.now(), is_confirmed=False)
-        if verifies.exists():
+        if get_verification_store().pending(user):
             error = {
                 'status': False,
                 'message': "Verification code has been sent to you. Please wait a while to send again"
@@ -203,7 +219,7 @@ class ResetPasswordView(UpdateAPIView):
     serializer_class = ResetPasswordSerializer
 
     def get_object(self):
-        return self.request.user
+        return load_user(self.request.user)
 
     def update(self, request, *args, **kwargs):
         response = super(ResetPasswordView, self).update(request, *args, **kwargs)
@@ -219,3 +235,62 @@ class ResetPasswordView(UpdateAPIView):
                 'refresh': user.token()['refresh_token'],
             }
         )
+
+
+class FollowApiView(APIView):
+    permission_classes = [IsAuthenticated, ]
+
+    def put(self, request, pk):
+        following = get_object_or_404(User, pk=pk)
+        if following.pk == request.user.pk:
+            raise ValidationError(
+                {
+                    'success': False,
+                    'message': "You cannot follow yourself",
+                }
+            )
+        if request.user.follow(following):
+            backfill_timeline(request.user, following)
+            return Response(
+                {
+                    'success': True,
+                    'message': f"You are now following {following.username}",
+                }, status=status.HTTP_201_CREATED
+            )
+        return Response(
+            {
+                'success': True,
+                'message': f"You are already following {following.username}",
+            }, status=status.HTTP_200_OK
+        )
+
+    def delete(self, request, pk):
+        following = get_object_or_404(User, pk=pk)
+        if request.user.unfollow(following):
+            remove_from_timeline(request.user, following)
+        return Response(
+            {
+                'success': True,
+                'message': f"You have unfollowed {following.username}",
+            }, status=status.HTTP_204_NO_CONTENT
+        )
+
+
+class FollowerListView(ListAPIView):
+    permission_classes = [AllowAny, ]
+    serializer_class = UserFollowSerializer
+    pagination_class = CustomPagination
+
+    def get_queryset(self):
+        return UserFollow.objects.filter(following_id=self.kwargs['pk']) \
+            .select_related('follower', 'following').order_by('-created_time', '-id')
+
+
+class FollowingListView(ListAPIView):
+    permission_classes = [AllowAny, ]
+    serializer_class = UserFollowSerializer
+    pagination_class = CustomPagination
+
+    def get_queryset(self):
+        return UserFollow.objects.filter(follower_id=self.kwargs['pk']) \
+            .select_related('follower', 'following').order_by('-created_time', '-id')